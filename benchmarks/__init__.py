@@ -0,0 +1,3 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""Benchmarks of kerneltest, run them from the top of the repository."""
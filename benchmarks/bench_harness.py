@@ -0,0 +1,170 @@
+#!/usr/bin/python
+#
+# Licensed under the terms of the GNU GPL License version 2
+
+"""Benchmark the dispatching of the kernel builds to the test guests.
+
+Replays kernel builds arriving at the given rates, or recorded messages,
+to the harness dispatcher starting simulated guests, and reports the
+dispatch latency (from a build being queued to a guest starting to test
+it), the utilization of the guests and the depth of the queue. The
+simulation runs ``--speed`` times faster than real time, the times
+reported are in simulated seconds:
+
+    python benchmarks/bench_harness.py --rates 1 4 12 --builds 40 --releases 3
+    python benchmarks/bench_harness.py --replay builds.jsonl
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import harness  # noqa: E402
+
+
+def synthetic_messages(rate, n_builds, n_releases, seed=0):
+    """Return ``n_builds`` kernel build messages of the latest releases,
+    arriving ``rate`` per hour on average, along with as many messages of
+    other builds.
+    """
+    rand = random.Random(seed)
+    releases = [f"fc{41 - idx}" for idx in range(n_releases)]
+    patches = dict.fromkeys(releases, 0)
+    messages = []
+    timestamp = 0
+    for idx in range(n_builds):
+        timestamp += rand.expovariate(rate / 3600)
+        release = rand.choice(releases)
+        patches[release] += 1
+        for name, version in [("kernel", f"6.9.{patches[release]}"), ("bash", f"5.2.{idx}")]:
+            messages.append(
+                dict(
+                    topic="org.fedoraproject.prod.buildsys.build.state.change",
+                    msg=dict(
+                        name=name,
+                        version=version,
+                        release=f"200.{release}",
+                        new=harness.BUILD_COMPLETE,
+                        instance="primary",
+                    ),
+                    timestamp=timestamp,
+                )
+            )
+    return messages, [harness.domainmap(release) for release in releases]
+
+
+def simulate(messages, n_guests, args):
+    """Replay the messages to simulated guests, return the statistics."""
+    speed = args.speed
+    hypervisor = harness.SimulatedHypervisor(
+        args.boot_time / speed, args.test_time / speed, args.shutdown_time / speed
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = harness.JobQueue(os.path.join(tmpdir, "queue.sqlite"))
+        dispatcher = harness.Dispatcher(hypervisor, queue, max_running=args.max_running)
+        hypervisor.on_stopped = dispatcher.stopped
+
+        # Sample the depth of the queue every simulated minute
+        depths = []
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(60 / speed):
+                depths.append(queue.depth())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+
+        start = time.monotonic()
+        harness.run(harness.ReplaySource(messages, speed), dispatcher)
+        while dispatcher.busy() or queue.depth():
+            time.sleep(0.01 / speed)
+        elapsed = time.monotonic() - start
+        done.set()
+        dispatcher.close()
+
+        latencies = [
+            (started - queued) * speed
+            for started, queued in queue.connection.execute(
+                "SELECT started, queued FROM jobs WHERE started IS NOT NULL"
+            )
+        ]
+        states = dict(queue.connection.execute("SELECT state, count(*) FROM jobs GROUP BY state"))
+    hypervisor.close()
+
+    latencies.sort()
+    return dict(
+        tested=states.get("finished", 0),
+        superseded=states.get("superseded", 0),
+        latency_mean=statistics.mean(latencies) if latencies else 0,
+        latency_p95=latencies[int(len(latencies) * 0.95)] if latencies else 0,
+        latency_max=latencies[-1] if latencies else 0,
+        utilization=hypervisor.busy_time() / (n_guests * elapsed),
+        depth_mean=statistics.mean(depths) if depths else 0,
+        depth_max=max(depths, default=0),
+        duration=elapsed * speed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--rates", type=float, nargs="+", default=[1, 4, 12], help="Kernel builds per hour"
+    )
+    parser.add_argument("--builds", type=int, default=40, help="Kernel builds per rate")
+    parser.add_argument("--releases", type=int, default=3, help="Releases built")
+    parser.add_argument("--replay", help="Replay the messages recorded in this file instead")
+    parser.add_argument("--boot-time", type=float, default=60, help="Seconds to boot a guest")
+    parser.add_argument("--test-time", type=float, default=600, help="Seconds to run the tests")
+    parser.add_argument(
+        "--shutdown-time", type=float, default=10, help="Seconds to shut off a guest"
+    )
+    parser.add_argument(
+        "--max-running", type=int, default=None, help="Guests running at the same time"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1000, help="Run the simulation that many times faster"
+    )
+    args = parser.parse_args()
+
+    if args.replay:
+        messages = list(harness.read_messages(args.replay))
+        domains = set()
+        for message in messages:
+            try:
+                kernel = harness.parse_build(message["topic"], harness.message_body(message))
+            except ValueError:
+                # Skipped by the harness as well
+                continue
+            if kernel is not None:
+                domains.add(harness.domainmap(kernel.split(".")[-1]))
+        runs = [("replay", messages, len(domains))]
+    else:
+        runs = []
+        for rate in args.rates:
+            messages, domains = synthetic_messages(rate, args.builds, args.releases)
+            runs.append((f"{rate:g}/h", messages, len(domains)))
+
+    print(
+        f"{'rate':>8} {'tested':>7} {'superseded':>10} {'latency':>9} {'p95':>9} {'max':>9}"
+        f" {'util':>6} {'depth':>6} {'max':>4}"
+    )
+    for name, messages, n_releases in runs:
+        stats = simulate(messages, 2 * n_releases, args)
+        print(
+            f"{name:>8} {stats['tested']:>7} {stats['superseded']:>10}"
+            f" {stats['latency_mean']:>8.0f}s {stats['latency_p95']:>8.0f}s"
+            f" {stats['latency_max']:>8.0f}s {stats['utilization']:>6.1%}"
+            f" {stats['depth_mean']:>6.1f} {stats['depth_max']:>4}"
+        )
+
+
+if __name__ == "__main__":
+    main()
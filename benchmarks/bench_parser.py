@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#
+# Licensed under the terms of the GNU GPL License version 2
+
+"""Benchmark the parsing of the header of uploaded result files.
+
+Compares the previous line-by-line substring parser with
+``kerneltest.parser.parse_header`` on a regular log, on a large log and
+on malformed logs (no separator, a single huge line, binary garbage).
+
+    python benchmarks/bench_parser.py --repeat 200
+"""
+
+import argparse
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import kerneltest.parser as parser  # noqa: E402
+
+HEADER = (
+    b"Date: Thu Apr 24 11:48:35 CDT 2014\n"
+    b"Test set: default\n"
+    b"Kernel: 3.14.1-200.fc20.x86_64\n"
+    b"Release: Fedora release 19 (Schrodingers Cat)\n"
+    b"Result: FAIL\n"
+)
+BODY = b"Starting test ./default/libhugetlbfs\nYou need to be root to run this test\n"
+
+LOGS = {
+    "regular": HEADER + b"Failed Tests: ./default/paxtest\n" + b"=" * 60 + b"\n" + BODY * 50,
+    "large": HEADER + b"Failed Tests: ./default/paxtest\n" + b"=" * 60 + b"\n" + BODY * 50000,
+    "no separator": HEADER + BODY * 50000,
+    "single line": b"x" * (4 * 1024 * 1024),
+    "binary": bytes(range(256)) * 16384,
+}
+
+
+def legacy_parseresults(log):
+    """The parser used before ``kerneltest.parser``."""
+    testdate = None
+    testset = None
+    testkver = None
+    testrel = None
+    testresult = None
+    failedtests = None
+    for line in log:
+        line = line.decode()
+        if "Date: " in line:
+            testdate = line.replace("Date: ", "", 1).rstrip("\n")
+        elif "Test set: " in line:
+            testset = line.replace("Test set: ", "", 1).rstrip("\n")
+        elif "Kernel: " in line:
+            testkver = line.replace("Kernel: ", "", 1).rstrip("\n")
+        elif "Release: " in line:
+            testrel = line.replace("Release: ", "", 1).rstrip("\n")
+        elif "Result: " in line:
+            testresult = line.replace("Result: ", "", 1).rstrip("\n")
+        elif "Failed Tests: " in line:
+            failedtests = line.replace("Failed Tests: ", "", 1).rstrip("\n")
+        elif "========" in line:
+            break
+    return testdate, testset, testkver, testrel, testresult, failedtests
+
+
+def run(function, data):
+    """Parse ``data`` with ``function``, ignoring decoding errors."""
+    try:
+        function(io.BytesIO(data))
+    except UnicodeDecodeError:
+        pass
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    argparser.add_argument("--repeat", type=int, default=100, help="Runs per log")
+    args = argparser.parse_args()
+
+    print(f"{'log':>14} {'bytes':>9} {'legacy (ms)':>12} {'parser (ms)':>12}")
+    for name, data in LOGS.items():
+        timings = []
+        for function in (legacy_parseresults, parser.parse_header):
+            elapsed = timeit.timeit(lambda f=function, d=data: run(f, d), number=args.repeat)
+            timings.append(elapsed / args.repeat * 1000)
+        print(f"{name:>14} {len(data):>9} {timings[0]:>12.3f} {timings[1]:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+#
+# Licensed under the terms of the GNU GPL License version 2
+
+"""Benchmark the computation of the statistics displayed on /stats.
+
+Seeds a database with a synthetic set of test results and reports, for
+each size, the number of queries issued and the wall time spent by the
+previous per-release/per-kernel implementation and by the current
+aggregate-based ``dbtools.get_stats``.
+
+    python benchmarks/bench_stats.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sqlalchemy as sa  # noqa: E402
+
+import kerneltest.dbtools as dbtools  # noqa: E402
+
+ARCHES = ["x86_64", "i686", "aarch64", "ppc64le", "s390x"]
+TESTERS = ["kerneltest", "anon", "pingou", "jforbes", "jmflinuxtx"]
+
+
+def seed(session, n_rows, n_releases=10, kernels_per_release=50):
+    """Insert ``n_rows`` test results spread over the given releases."""
+    releases = list(range(30, 30 + n_releases))
+    session.execute(
+        sa.insert(dbtools.Release),
+        [dict(releasenum=rel, support="RELEASE") for rel in releases],
+    )
+    kernels = [
+        (rel, f"6.{idx}.0-200.fc{rel}") for rel in releases for idx in range(kernels_per_release)
+    ]
+    rand = random.Random(0)
+    batch = []
+    for testid in range(1, n_rows + 1):
+        rel, kver = rand.choice(kernels)
+        arch = rand.choice(ARCHES)
+        batch.append(
+            dict(
+                testid=testid,
+                tester=rand.choice(TESTERS),
+                testdate="Thu Apr 24 11:48:35 CDT 2014",
+                testset="default",
+                kver=f"{kver}.{arch}",
+                fver=rel,
+                testarch=arch,
+                testrel=f"Fedora release {rel}",
+                testresult=rand.choice(["PASS", "FAIL", "WARN"]),
+                failedtests=None,
+                authenticated=True,
+            )
+        )
+        if len(batch) == 10000:
+            session.execute(sa.insert(dbtools.KernelTest), batch)
+            batch = []
+    if batch:
+        session.execute(sa.insert(dbtools.KernelTest), batch)
+    session.commit()
+
+
+def legacy_get_stats(session):
+    """The implementation of ``get_stats`` prior to using aggregates."""
+    output = {}
+    output["arches"] = [arch[0] for arch in dbtools.getarches(session)]
+    output["kernels"] = set([rel[0] for rel in dbtools.getkernelsbyrelease(session)])
+    output["n_test"] = session.query(dbtools.KernelTest).count()
+
+    rel_stats = {}
+    for release in session.query(dbtools.Release).all():
+        tmp = {}
+        tmp["kernels"] = dbtools.getkernelsbyrelease(session, release.releasenum)
+        tmp["tests"] = dbtools.getresultsbyrelease(session, release.releasenum)
+        tmp["arches"] = set([test.testarch for test in tmp["tests"]])
+        tmp["testers"] = set([test.tester for test in tmp["tests"]])
+        rel_stats[release.releasenum] = tmp
+    output["rel_stats"] = rel_stats
+
+    ker_stats = {}
+    for kernel in output["kernels"]:
+        tmp = {}
+        tmp["releases"] = dbtools.getreleasebykernel(session, kernel)
+        tmp["tests"] = dbtools.getresultsbykernel(session, kernel)
+        tmp["arches"] = set([test.testarch for test in tmp["tests"]])
+        tmp["testers"] = set([test.tester for test in tmp["tests"]])
+        ker_stats[kernel] = tmp
+    output["ker_stats"] = ker_stats
+    return output
+
+
+def measure(session, function):
+    """Return the number of queries and the time spent running ``function``."""
+    queries = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    engine = session.get_bind()
+    sa.event.listen(engine, "before_cursor_execute", count)
+    try:
+        start = time.perf_counter()
+        function(session)
+        elapsed = time.perf_counter() - start
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", count)
+        session.expunge_all()
+    return len(queries), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Rows to seed"
+    )
+    parser.add_argument(
+        "--db-url", default=None, help="Database to use, defaults to a temporary SQLite file"
+    )
+    parser.add_argument(
+        "--legacy-max",
+        type=int,
+        default=100000,
+        help="Skip the legacy implementation above this number of rows",
+    )
+    args = parser.parse_args()
+    if args.db_url:
+        # The tables are dropped after each size, they must be ours
+        engine = sa.create_engine(args.db_url)
+        existing = sorted(
+            set(sa.inspect(engine).get_table_names()) & set(dbtools.BASE.metadata.tables)
+        )
+        engine.dispose()
+        if existing:
+            parser.error(f"{args.db_url} already has the tables {', '.join(existing)}")
+
+    print(f"{'rows':>10} {'implementation':>15} {'queries':>8} {'seconds':>9}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_url = args.db_url or f"sqlite:///{os.path.join(tmpdir, 'bench.sqlite')}"
+            session = dbtools.create_session(db_url, create_table=True)
+            try:
+                seed(session, size)
+                runs = [("aggregate", dbtools.get_stats)]
+                if size <= args.legacy_max:
+                    runs.append(("legacy", legacy_get_stats))
+                for name, function in runs:
+                    n_queries, elapsed = measure(session, function)
+                    print(f"{size:>10} {name:>15} {n_queries:>8} {elapsed:>9.3f}")
+            finally:
+                session.remove()
+                if args.db_url:
+                    dbtools.BASE.metadata.drop_all(session.get_bind())
+                session.get_bind().dispose()
+
+
+if __name__ == "__main__":
+    main()
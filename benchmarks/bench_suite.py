@@ -0,0 +1,285 @@
+#!/usr/bin/python
+#
+# Licensed under the terms of the GNU GPL License version 2
+
+"""Benchmark the dbtools functions and the routes of the application.
+
+Seeds a database with benchmarks.dataset for each size and times every
+dbtools query and every route, the latter through the Flask test client
+with the page cache disabled, recording the number of queries of each call.
+The results are saved as JSON in benchmarks/results/ and can be compared to
+the ones of a previous run, to spot regressions:
+
+    python benchmarks/bench_suite.py --sizes 10000 100000 1000000
+    python benchmarks/bench_suite.py --sizes 10000 --compare benchmarks/results/<previous>.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sqlalchemy as sa  # noqa: E402
+
+import kerneltest.dbtools as dbtools  # noqa: E402
+from benchmarks import dataset  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+API_KEY = "benchmark api key"
+
+LOG = (
+    "Date: Thu Apr 24 11:48:35 CDT 2014\n"
+    "Test set: default\n"
+    "Kernel: {kver}\n"
+    "Release: Fedora release 40\n"
+    "Result: FAIL\n"
+    "Failed Tests: ./default/paxtest ./default/memfd\n"
+    "========================================================\n"
+) + "Starting test ./default/libhugetlbfs\n" * 200
+
+
+def dbtools_cases(kernel, release, arch, testname):
+    """Return the (name, function) of the dbtools calls to time, the
+    functions taking the session as argument.
+    """
+    since = datetime.datetime(2024, 1, 1)
+    return [
+        ("getcurrentreleases", dbtools.getcurrentreleases),
+        ("getrawhide", dbtools.getrawhide),
+        ("getarches", dbtools.getarches),
+        ("getarches(release)", lambda s: dbtools.getarches(s, release)),
+        ("getlatest", lambda s: dbtools.getlatest(s, release, arch)),
+        ("getlatestmatrix", dbtools.getlatestmatrix),
+        ("getkernelsbyrelease", dbtools.getkernelsbyrelease),
+        ("getkernelsbyrelease(release)", lambda s: dbtools.getkernelsbyrelease(s, release)),
+        ("getkernelsbyrelease(page)", lambda s: dbtools.getkernelsbyrelease(s, release, 100)),
+        (
+            "getkernelsbyrelease(version)",
+            lambda s: dbtools.getkernelsbyrelease(s, release, version=kernel.split("-")[0]),
+        ),
+        ("getresultsbykernel", lambda s: dbtools.getresultsbykernel(s, kernel)),
+        ("getresultsbykernel(page)", lambda s: dbtools.getresultsbykernel(s, kernel, 100)),
+        ("getallkernels", dbtools.getallkernels),
+        ("iterallkernels", lambda s: sum(1 for _ in dbtools.iterallkernels(s))),
+        ("getresultsbyrelease", lambda s: dbtools.getresultsbyrelease(s, release)),
+        ("getresultsbyrelease(page)", lambda s: dbtools.getresultsbyrelease(s, release, 100)),
+        (
+            "getresultsbyrelease(since)",
+            lambda s: dbtools.getresultsbyrelease(s, release, 100, since=since),
+        ),
+        ("getreleasebykernel", lambda s: dbtools.getreleasebykernel(s, kernel)),
+        ("searchfailures", lambda s: dbtools.searchfailures(s, testname, limit=100)),
+        (
+            "searchfailures(release)",
+            lambda s: dbtools.searchfailures(s, testname, release, arch, limit=100),
+        ),
+        ("getfailurerates", lambda s: dbtools.getfailurerates(s, limit=20)),
+        ("getfailurerates(release)", lambda s: dbtools.getfailurerates(s, release, arch, 20)),
+        ("getfailurestart", lambda s: dbtools.getfailurestart(s, testname, release, arch)),
+        ("getfailureheatmap", lambda s: dbtools.getfailureheatmap(s, testname)),
+        ("getdataversion", dbtools.getdataversion),
+        ("get_stats", dbtools.get_stats),
+    ]
+
+
+def route_cases(app, kernel, release, testname):
+    """Return the (name, function) of the requests to time."""
+    client = app.APP.test_client()
+
+    def get(url):
+        def function(session):
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+
+        return function
+
+    def upload(url, **data):
+        def function(session):
+            log = LOG.format(kver=kernel).encode("utf-8")
+            files = dict(data, test_result=(io.BytesIO(log), "result.log"))
+            response = client.post(url, data=files, content_type="multipart/form-data")
+            assert response.status_code == 200, (url, response.status_code)
+
+        return function
+
+    return [
+        ("GET /", get("/")),
+        ("GET /release", get(f"/release/{release}")),
+        ("GET /kernel", get(f"/kernel/{kernel}")),
+        ("GET /stats", get("/stats")),
+        ("GET /search", get(f"/search?test={testname}")),
+        ("GET /api/v1/matrix", get("/api/v1/matrix")),
+        ("GET /api/v1/release", get(f"/api/v1/release/{release}/kernels")),
+        ("GET /api/v1/kernel", get(f"/api/v1/kernel/{kernel}/results")),
+        ("GET /api/v1/stats", get("/api/v1/stats")),
+        ("POST /upload/autotest", upload("/upload/autotest", api_token=API_KEY)),
+        ("POST /upload/anonymous", upload("/upload/anonymous", username="bench")),
+    ]
+
+
+def measure(session, function, repeat):
+    """Run ``function`` ``repeat`` times and return the number of queries
+    of the last run and the fastest and median times, in seconds.
+    """
+    queries = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    engine = session.get_bind()
+    timings = []
+    for _ in range(repeat):
+        del queries[:]
+        sa.event.listen(engine, "before_cursor_execute", count)
+        try:
+            start = time.perf_counter()
+            function(session)
+            timings.append(time.perf_counter() - start)
+        finally:
+            sa.event.remove(engine, "before_cursor_execute", count)
+            session.rollback()
+            session.expunge_all()
+    return dict(queries=len(queries), min=min(timings), median=statistics.median(timings))
+
+
+def metadata(db_url):
+    """Return a description of the environment the benchmark ran in."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        date=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        commit=commit,
+        python=platform.python_version(),
+        sqlalchemy=sa.__version__,
+        database=sa.engine.make_url(db_url).get_backend_name(),
+        host=platform.node(),
+    )
+
+
+def compare(previous, results, threshold):
+    """Print the results next to the ones of a previous run and return
+    the number of calls whose fastest run got slower by more than ``threshold`` or
+    issue more queries.
+    """
+    before = {(row["size"], row["name"]): row for row in previous["results"]}
+    regressions = 0
+    print(f"\nCompared to {previous['meta']['date']} ({previous['meta']['commit']})")
+    print(f"{'rows':>10} {'call':<32} {'before':>9} {'after':>9} {'ratio':>6} {'queries':>9}")
+    for row in results:
+        old = before.get((row["size"], row["name"]))
+        if old is None:
+            continue
+        # The fastest runs are the least affected by the noise of the host
+        ratio = row["min"] / old["min"] if old["min"] else 1
+        flag = ""
+        if ratio > threshold or row["queries"] > old["queries"]:
+            flag = "REGRESSION"
+            regressions += 1
+        print(
+            f"{row['size']:>10} {row['name']:<32} {old['min']:>9.4f} {row['min']:>9.4f}"
+            f" {ratio:>6.2f} {old['queries']:>4}>{row['queries']:<4} {flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Rows to seed"
+    )
+    parser.add_argument(
+        "--db-url", default=None, help="Database to use, defaults to a temporary SQLite file"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each call")
+    parser.add_argument("--only", default=None, help="Only time the calls matching this regex")
+    parser.add_argument("--output", default=RESULTS_DIR, help="Directory to save the results in")
+    parser.add_argument("--compare", default=None, help="Results of a previous run to compare to")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Slowdown ratio reported as a regression when comparing",
+    )
+    args = parser.parse_args()
+    if args.db_url:
+        # The tables are dropped after each size, they must be ours
+        engine = sa.create_engine(args.db_url)
+        existing = sorted(
+            set(sa.inspect(engine).get_table_names()) & set(dbtools.BASE.metadata.tables)
+        )
+        engine.dispose()
+        if existing:
+            parser.error(f"{args.db_url} already has the tables {', '.join(existing)}")
+
+    import kerneltest.app as app
+
+    app.APP.config["TESTING"] = True
+    app.APP.config["API_KEY"] = API_KEY
+    app.APP.config["OUTBOX_DISPATCHER"] = False
+    app.APP.config["ALLOWED_MIMETYPES"] = ["application/octet-stream", "text/plain"]
+    # Time the rendering of the pages, not the page cache
+    app.PAGES = None
+
+    results = []
+    print(f"{'rows':>10} {'call':<32} {'queries':>8} {'min (s)':>9} {'median (s)':>11}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_url = args.db_url or f"sqlite:///{os.path.join(tmpdir, 'bench.sqlite')}"
+            app.APP.config["LOG_DIR"] = os.path.join(tmpdir, "logs")
+            session = dbtools.create_session(db_url, create_table=True)
+            try:
+                kernels = dataset.generate(session, size)
+                kernel = kernels[len(kernels) // 2]
+                version = dbtools.parser.parse_kver(kernel)
+                app.SESSION = session
+                app.RELEASES.invalidate()
+                cases = dbtools_cases(kernel, version.fver, version.arch, "./default/paxtest")
+                cases += route_cases(app, kernel, version.fver, "./default/paxtest")
+                for name, function in cases:
+                    if args.only and not re.search(args.only, name):
+                        continue
+                    row = dict(size=size, name=name, **measure(session, function, args.repeat))
+                    results.append(row)
+                    print(
+                        f"{size:>10} {name:<32} {row['queries']:>8} {row['min']:>9.4f}"
+                        f" {row['median']:>11.4f}"
+                    )
+            finally:
+                session.remove()
+                if args.db_url:
+                    dbtools.BASE.metadata.drop_all(session.get_bind())
+                session.get_bind().dispose()
+
+    output = dict(meta=metadata(args.db_url or "sqlite://"), results=results)
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(
+        args.output, f"bench-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    with open(path, "w") as stream:
+        json.dump(output, stream, indent=2)
+    print(f"\nResults saved in {path}")
+
+    if args.compare:
+        with open(args.compare) as stream:
+            previous = json.load(stream)
+        if compare(previous, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""Generate synthetic but realistic datasets of test results.
+
+The results are spread over many releases, the recent ones getting most
+of them, each release having its series of kernel builds tested on a few
+arches by the autotest client and a handful of humans. About one result
+in five failed, listing one to three tests from a pool of test names.
+
+    python benchmarks/dataset.py --rows 100000 sqlite:////var/tmp/bench.sqlite
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sqlalchemy as sa  # noqa: E402
+
+import kerneltest.dbtools as dbtools  # noqa: E402
+import kerneltest.parser as parser  # noqa: E402
+
+ARCHES = ["x86_64", "aarch64", "ppc64le", "s390x", "i686"]
+# Relative number of results uploaded for each arch
+ARCH_WEIGHTS = [60, 20, 8, 7, 5]
+HUMANS = [f"tester{idx}" for idx in range(200)]
+TESTNAMES = [f"./default/{name}" for name in ("paxtest", "libhugetlbfs", "memfd", "selinux")] + [
+    f"./{suite}/test{idx}" for suite in ("minimal", "stress", "performance") for idx in range(60)
+]
+TIMEZONES = ["UTC", "CDT", "CEST", "EDT", "PDT", "JST"]
+
+BATCH_SIZE = 10000
+
+
+def releases(n_releases):
+    """Return the (releasenum, support) of ``n_releases`` releases, the
+    newest being rawhide and the three before it still supported.
+    """
+    first = 41 - n_releases
+    output = []
+    for releasenum in range(first, 41):
+        if releasenum == 40:
+            support = "RAWHIDE"
+        elif releasenum >= 37:
+            support = "RELEASE"
+        else:
+            support = "RETIRED"
+        output.append((releasenum, support))
+    return output
+
+
+def kernels(releasenum, count, rand):
+    """Return ``count`` kernel versions built for a release, oldest first:
+    a few minor versions, each with release candidates and stable updates.
+    """
+    output = []
+    major, minor = divmod(releasenum * 2 - 10, 20)
+    major += 3
+    while len(output) < count:
+        for rc in range(1, rand.randint(2, 8)):
+            output.append(f"{major}.{minor}.0-0.rc{rc}.{rc}.fc{releasenum}")
+        for patch in range(rand.randint(5, 20)):
+            output.append(f"{major}.{minor}.{patch}-{100 + patch}.fc{releasenum}")
+        minor += 1
+        if minor >= 20:
+            major, minor = major + 1, 0
+    return output[:count]
+
+
+def generate(session, n_rows, n_releases=20, kernels_per_release=60, seed=0):
+    """Insert ``n_rows`` test results, their failed tests and the releases
+    they were ran on in the database. Return the kernels tested.
+    """
+    rand = random.Random(seed)
+    session.execute(
+        sa.insert(dbtools.Release),
+        [dict(releasenum=num, support=support) for num, support in releases(n_releases)],
+    )
+
+    builds = [
+        (num, kver)
+        for num, _ in releases(n_releases)
+        for kver in kernels(num, kernels_per_release, rand)
+    ]
+    # The newer releases and builds get more results
+    weights = [1 + idx for idx in range(len(builds))]
+    start = datetime.datetime(2014, 1, 1)
+    span = (datetime.datetime(2024, 6, 1) - start).total_seconds()
+
+    versions = {}
+    tests, failures = [], []
+    for testid in range(1, n_rows + 1):
+        fver, kver = rand.choices(builds, weights)[0]
+        arch = rand.choices(ARCHES, ARCH_WEIGHTS)[0]
+        kver = f"{kver}.{arch}"
+        if kver not in versions:
+            versions[kver] = (parser.parse_kver(kver), parser.kver_key(kver))
+        version, kverkey = versions[kver]
+        tester = "kerneltest" if rand.random() < 0.6 else rand.choice(HUMANS)
+        testtime = start + datetime.timedelta(seconds=span * testid / n_rows)
+        result = rand.choices(["PASS", "FAIL", "WARN"], [75, 20, 5])[0]
+        names = []
+        if result == "FAIL":
+            names = rand.sample(TESTNAMES, rand.choice([1, 1, 1, 2, 3]))
+        tests.append(
+            dict(
+                testid=testid,
+                tester=tester,
+                testdate=testtime.strftime(f"%a %b %d %H:%M:%S {rand.choice(TIMEZONES)} %Y"),
+                testtime=testtime,
+                uploaded=testtime + datetime.timedelta(seconds=rand.randint(1, 600)),
+                testset=rand.choice(["default", "default", "minimal", "stress"]),
+                kver=kver,
+                fver=fver,
+                testarch=version.arch,
+                kmajor=version.major,
+                kminor=version.minor,
+                kpatch=version.patch,
+                kbuild=version.build,
+                kdist=version.dist,
+                kverkey=kverkey,
+                testrel=f"Fedora release {fver}",
+                testresult=result,
+                failedtests=" ".join(names) or None,
+                authenticated=tester == "kerneltest" or rand.random() < 0.5,
+            )
+        )
+        failures.extend(
+            dict(testid=testid, testname=name, fver=fver, testarch=version.arch) for name in names
+        )
+        if len(tests) >= BATCH_SIZE:
+            flush(session, tests, failures)
+    flush(session, tests, failures)
+    session.commit()
+
+    return sorted({kver for kver, in session.query(dbtools.KernelTest.kver).distinct()})
+
+
+def flush(session, tests, failures):
+    """Insert the given rows and empty the lists."""
+    if tests:
+        session.execute(dbtools.KernelTest.__table__.insert(), tests)
+    if failures:
+        session.execute(dbtools.FailedTest.__table__.insert(), failures)
+    del tests[:], failures[:]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    argparser.add_argument("db_url", help="Database to fill, its tables are created if needed")
+    argparser.add_argument("--rows", type=int, default=10000, help="Test results to generate")
+    argparser.add_argument("--releases", type=int, default=20, help="Releases to generate")
+    argparser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+    args = argparser.parse_args()
+
+    session = dbtools.create_session(args.db_url, create_table=True)
+    kernels = generate(session, args.rows, n_releases=args.releases, seed=args.seed)
+    print(f"{args.rows} test results of {len(kernels)} kernels generated")
+
+
+if __name__ == "__main__":
+    main()
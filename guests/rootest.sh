@@ -2,37 +2,53 @@
 #
 # Licensed under the terms of the GNU GPL License version 2
 
-FedoraRelease=Fedora40
+# Name of the libvirt domain of this guest, as the harness names them:
+# Fedora40_64, Fedora40_arm64, ..., Rawhide64 or Rawhidearm64
+Domain=Fedora40_64
+# URL of the harness serving the kernel each guest is assigned, on the
+# bridge of the libvirt network of the guests
+HarnessURL=http://192.168.122.1:8088
+arch=`uname -m`
 currentkernel=kernel-`uname -r`
 kojidir=/home/kerneltest/koji/
 kerneltestdir=/home/kerneltest/kernel-tests/
 
-# Just gives us time to log in and kill it for maintenance
-sleep 90
+# Log in and create this file to keep the guest up for maintenance
+if [ -f /root/maintenance ]; then
+    exit 0
+fi
 
 #Update Guest
 dnf -y update
 
-if [ ! -f /data/latest/$FedoraRelease ]; then
-    mount /data
+#Kernel assigned to this guest, waiting up to 5 minutes for one
+job=`curl -sf --retry 10 --retry-connrefused --max-time 330 "$HarnessURL/jobs/$Domain?wait=300"`
+if [ -z "$job" ]; then
+    echo "No kernel assigned to $Domain"
+    /usr/sbin/shutdown now -h
+    exit 0
 fi
-
-latestkernel=`cat /data/latest/$FedoraRelease`
-
-#Make sure we are on the latest kernel, install if not
-if [ "$currentkernel" != "$latestkernel.x86_64" ]
+jobfield() {
+    echo "$job" | python3 -c "import json, sys; print(json.load(sys.stdin)['$1'])"
+}
+jobid=`jobfield id`
+latestkernel=`jobfield kernel`
+
+#Make sure we are on the assigned kernel, install if not
+if [ "$currentkernel" != "$latestkernel.$arch" ]
 then
     cd $kojidir
     rm *.rpm
-    koji download-build --arch=x86_64 $latestkernel
+    koji download-build --arch=$arch $latestkernel
     dnf -y update *.rpm
     reboot
 fi
+curl -sf --retry 10 -X POST "$HarnessURL/jobs/$Domain/$jobid/pickup"
 
-#We are on the latest kernel, run some tests
+#We are on the latest kernel, run some tests once the boot is complete
 cd $kerneltestdir
 git pull
-sleep 120
+systemctl is-system-running --wait
 #Regression Test as root
 ./runtests.sh
 if [ "$result" != "0" ]
@@ -40,5 +56,6 @@ then
     echo "Regression Test Suite fail for kernel $currentkernel"
     ./runtests.sh
 fi
+curl -sf --retry 10 -X POST "$HarnessURL/jobs/$Domain/$jobid/finish"
 
 /usr/sbin/shutdown now -h
@@ -2,17 +2,89 @@
 #
 # Licensed under the terms of the GNU GPL License version 2
 
+"""Start the test guests when a new kernel is built.
+
+Every completed kernel build is queued for the guests of its release, in
+a SQLite database kept across restarts. When a guest is free, its next
+kernel is assigned to it and the guest is started. A guest still testing
+the previous kernel is started again as soon as it shuts off, which
+libvirt reports with a lifecycle event.
+
+The guests fetch the kernel they are assigned over HTTP and report when
+they pick it up and when they are done testing it, see AssignmentHandler.
+
+The builds are received from the message bus, the harness consuming the
+Koji build state changes with fedora-messaging, or read from recorded
+messages replayed with --replay. The guests are started by a hypervisor,
+libvirt or guests simulated with --simulate:
+
+    python harness.py --replay builds.jsonl --simulate --queue /tmp/queue.sqlite
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import json
+import logging
 import os
-import string
+import re
+import sqlite3
+import threading
 import time
-import _thread
-import logging
+import urllib.parse
+
+from fedora_messaging import api as fm_api
+from fedora_messaging.exceptions import Drop, Nack
+
+import kerneltest.parser as parser
+
+try:
+    import libvirt
+except ImportError:  # pragma: no cover
+    libvirt = None
+
+_log = logging.getLogger("harness")
+
+# Number of threads calling libvirt to start the guests
+MAX_WORKERS = 4
+# Number of guests running at the same time, None for no limit
+MAX_RUNNING = None
+# Number of seconds between the checks of the guests running, in case the
+# event of one shutting off was lost
+RECONCILE_INTERVAL = 30
+# Number of seconds before starting again a guest which could not be
+# started, doubled after each failure up to MAX_RETRY_DELAY
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 1800
+# Where the queue of kernels to test is kept
+QUEUE_PATH = "/var/lib/harness/queue.sqlite"
+# Where the kernels queued are logged
+LOG_PATH = "/var/log/harness.log"
+# Address on which the guests fetch the kernel they are assigned, the
+# bridge of the default libvirt network so only the guests reach it, and
+# maximum number of seconds they may wait for a new assignment
+LISTEN_ADDRESS = ("192.168.122.1", 8088)
+MAX_WAIT = 300
+
+# Queue of the message broker receiving the Koji build state changes
+AMQP_QUEUE = "kerneltest-harness"
+TOPIC_PREFIX = "org.fedoraproject.prod"
+
+# Topic of the Koji messages, state of the completed builds, and version
+# of the kernels tested
+BUILD_TOPIC = "buildsys.build.state.change"
+BUILD_COMPLETE = 1
+KERNEL_VERSION = "6."
+
+# Kernel to test on a guest, domain being the name of the guest and
+# release the prefix of the guests of the release, see domainmap
+Job = collections.namedtuple("Job", ["id", "release", "kernel", "domain", "state"])
+
 
-import fedmsg
-import fedmsg.config
-import fedmsg.meta
+class HypervisorError(Exception):
+    """Raised when a guest cannot be started."""
 
-import libvirt
 
 def domainmap(buildrel):
     rawhide = "fc41"
@@ -22,54 +94,742 @@ def domainmap(buildrel):
         domain = buildrel.replace("fc", "Fedora") + "_"
     return domain
 
-def writelatest(domain, kernel):
-    domfilename = domain.replace("_", "")
-    domfile = open('/data/latest/%s' %(domfilename), 'w')
-    domfile.write(kernel)
-    domfile.close()
-
-def launchdomain(domain):
-    conn = libvirt.open(None)
-    dom = conn.lookupByName(domain)
-    if "Rawhide" in domain:
-        dom.reboot()
-    else:
+
+def parse_build(topic, body):
+    """Return the NVR of the kernel build announced by a message, or None if
+    the message is not about a completed kernel build of the primary Koji
+    instance. Only the fields of the message are looked at, most of the
+    builds being of other packages. Raise ValueError if the body of a build
+    message is malformed.
+    """
+    if not topic.endswith(BUILD_TOPIC):
+        return None
+    if not isinstance(body, dict):
+        raise ValueError(f"Invalid build message: {body!r}")
+    if body.get("instance") != "primary" or body.get("new") != BUILD_COMPLETE:
+        return None
+    if body.get("name") != "kernel" or not str(body.get("version")).startswith(KERNEL_VERSION):
+        return None
+    try:
+        return "{name}-{version}-{release}".format(**body)
+    except KeyError as err:
+        raise ValueError(f"Build message without {err}") from err
+
+
+## Message sources
+
+
+class BuildConsumer:
+    """fedora-messaging callback queuing the kernels built."""
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def __call__(self, message):
+        try:
+            handle_message(self.dispatcher, message.topic, message.body)
+        except ValueError as err:
+            # It would be just as malformed when delivered again
+            _log.error("Dropping message %s: %s", message.id, err)
+            raise Drop() from err
+        except sqlite3.Error as err:
+            # Let the broker deliver the message again
+            _log.error("Could not queue the build: %s", err)
+            raise Nack() from err
+
+
+def consume(dispatcher, queue=AMQP_QUEUE):
+    """Consume the Koji build state changes from the message bus, until the
+    process is stopped.
+
+    The queue is bound to the topic of the build state changes only, and
+    kept by the broker while the harness is stopped.
+    """
+    bindings = [
+        dict(
+            exchange="amq.topic",
+            queue=queue,
+            routing_keys=[f"{TOPIC_PREFIX}.{BUILD_TOPIC}"],
+        )
+    ]
+    queues = {queue: dict(durable=True, auto_delete=False, exclusive=False, arguments={})}
+    fm_api.consume(BuildConsumer(dispatcher), bindings=bindings, queues=queues)
+
+
+def read_messages(path):
+    """Yield the messages recorded in a file, one JSON object per line
+    holding the ``topic``, the ``body`` (or ``msg`` for fedmsg messages)
+    and the ``timestamp`` of a message.
+    """
+    with open(path) as stream:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def message_body(message):
+    """Return the body of a recorded message, see read_messages."""
+    return message["body"] if "body" in message else message["msg"]
+
+
+class ReplaySource:
+    """Recorded messages, a file or an iterable of them (see read_messages),
+    replayed as (topic, body) tuples ``speed`` times faster than they were
+    received, or as fast as possible if ``speed`` is None.
+    """
+
+    def __init__(self, messages, speed=1.0):
+        self.messages = messages
+        self.speed = speed
+
+    def __iter__(self):
+        messages = self.messages
+        if isinstance(messages, str):
+            messages = read_messages(messages)
+        start = first = None
+        for message in messages:
+            if self.speed and message.get("timestamp") is not None:
+                if first is None:
+                    start, first = time.monotonic(), message["timestamp"]
+                delay = (message["timestamp"] - first) / self.speed
+                time.sleep(max(0, start + delay - time.monotonic()))
+            yield message["topic"], message_body(message)
+
+
+## Job queue
+
+
+class JobQueue:
+    """Queue of the kernels to test on each guest, stored in SQLite.
+
+    A kernel is queued once per guest. While a guest has not started
+    testing a kernel, a newer kernel of the same release supersedes it, so
+    guests only test the newest kernel of their release. Kernels being
+    tested when the harness stopped are queued again on the guests found
+    shut off when it starts.
+
+    The kernel a guest is started to test is its assignment, the guest
+    reports when it picks it up and when it completes its tests.
+    """
+
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        # Notified when the assignment of a guest changes
+        self._changed = threading.Condition(self._lock)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                release TEXT NOT NULL,
+                kernel TEXT NOT NULL,
+                kernelkey TEXT NOT NULL,
+                domain TEXT NOT NULL,
+                state TEXT NOT NULL,
+                queued REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                UNIQUE (kernel, domain)
+            );
+            CREATE INDEX IF NOT EXISTS ix_jobs_domain_state ON jobs (domain, state);
+            """
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+        for column in ("pickedup", "completed"):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} REAL")
+
+    def _select(self, where, *params):
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT id, release, kernel, domain, state FROM jobs WHERE {where} ORDER BY id",
+                params,
+            ).fetchall()
+        return [Job(*row) for row in rows]
+
+    def add(self, release, kernel, domains):
+        """Queue the kernel on the guests, return the guests it was queued on.
+
+        The kernel is skipped on the guests it was already queued on, and on
+        the guests which were given a newer kernel of the release. It
+        supersedes the older kernels queued on the other guests.
+        """
+        key = parser.kver_key(kernel)
+        queued = []
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for domain in domains:
+                known = self.connection.execute(
+                    "SELECT 1 FROM jobs WHERE domain = ? AND kernelkey >= ?", (domain, key)
+                ).fetchone()
+                if known is not None:
+                    continue
+                self.connection.execute(
+                    "UPDATE jobs SET state = 'superseded', finished = ?"
+                    " WHERE domain = ? AND state = 'queued'",
+                    (now, domain),
+                )
+                self.connection.execute(
+                    "INSERT INTO jobs (release, kernel, kernelkey, domain, state, queued)"
+                    " VALUES (?, ?, ?, ?, 'queued', ?)",
+                    (release, kernel, key, domain, now),
+                )
+                queued.append(domain)
+        return queued
+
+    def start(self, domain):
+        """Mark the next kernel queued on the guest as being tested and
+        return its Job, or None if there is none.
+        """
+        now = time.time()
+        with self._changed, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            jobs = self._select("domain = ? AND state = 'queued'", domain)
+            if not jobs:
+                return None
+            # A Rawhide guest is rebooted in the middle of its test
+            self.connection.execute(
+                "UPDATE jobs SET state = 'interrupted', finished = ?"
+                " WHERE domain = ? AND state = 'started'",
+                (now, domain),
+            )
+            self.connection.execute(
+                "UPDATE jobs SET state = 'started', started = ? WHERE id = ?", (now, jobs[0].id)
+            )
+            self._changed.notify_all()
+        return jobs[0]._replace(state="started")
+
+    def finish(self, domain):
+        """Mark the kernel tested by the guest as finished."""
+        with self._changed, self.connection:
+            self.connection.execute(
+                "UPDATE jobs SET state = 'finished', finished = ?"
+                " WHERE domain = ? AND state = 'started'",
+                (time.time(), domain),
+            )
+            self._changed.notify_all()
+
+    def requeue(self, domain):
+        """Queue again the kernel the guest was testing, unless a newer
+        kernel was queued meanwhile.
+        """
+        with self._changed, self.connection:
+            self.connection.execute(
+                "UPDATE jobs SET state = CASE WHEN EXISTS ("
+                "    SELECT 1 FROM jobs AS queued WHERE queued.domain = jobs.domain"
+                "    AND queued.state = 'queued') THEN 'superseded' ELSE 'queued' END"
+                " WHERE domain = ? AND state = 'started'",
+                (domain,),
+            )
+            self._changed.notify_all()
+
+    def pending(self):
+        """Return the guests having kernels queued."""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT domain FROM jobs WHERE state = 'queued' GROUP BY domain ORDER BY min(id)"
+            ).fetchall()
+        return [domain for domain, in rows]
+
+    def depth(self):
+        """Return the number of kernels queued."""
+        with self._lock:
+            return self.connection.execute(
+                "SELECT count(*) FROM jobs WHERE state = 'queued'"
+            ).fetchone()[0]
+
+    def started(self):
+        """Return the Jobs of the kernels being tested."""
+        return self._select("state = 'started'")
+
+    def assignment(self, domain, known=None, timeout=0):
+        """Return the Job of the kernel the guest is assigned, or None.
+
+        While there is none, or the id of that Job is ``known``, wait up to
+        ``timeout`` seconds for a new one.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                jobs = self._select("domain = ? AND state = 'started'", domain)
+                job = jobs[-1] if jobs else None
+                remaining = deadline - time.monotonic()
+                if (job is not None and job.id != known) or remaining <= 0:
+                    return job
+                self._changed.wait(remaining)
+
+    def report(self, domain, job_id, event):
+        """Record that the guest picked up (``event`` being "pickedup") or
+        completed the job. Return False if the guest has no such job.
+        """
+        if event not in ("pickedup", "completed"):
+            raise ValueError(event)
+        with self._lock, self.connection:
+            cursor = self.connection.execute(
+                f"UPDATE jobs SET {event} = ? WHERE id = ? AND domain = ?",
+                (time.time(), job_id, domain),
+            )
+        return cursor.rowcount == 1
+
+
+## Hypervisors, starting the guests and calling ``on_stopped`` with the
+## name of the guests shutting off
+
+
+class LibvirtHypervisor:
+    """Connection to libvirt shared by the dispatcher, reporting the domains
+    shutting off with lifecycle events.
+
+    The events sent while the connection is lost are missed, so
+    ``on_reconnected``, if set, is called in a thread once it is opened
+    again.
+    """
+
+    def __init__(self, uri=None, on_stopped=None, on_reconnected=None):
+        if libvirt is None:
+            raise HypervisorError("The libvirt python bindings are not installed")
+        self.uri = uri
+        self.on_stopped = on_stopped
+        self.on_reconnected = on_reconnected
+        self.conn = None
+        self._lock = threading.Lock()
+
+        libvirt.virEventRegisterDefaultImpl()
+        thread = threading.Thread(target=self._run_events, name="libvirt-events", daemon=True)
+        thread.start()
+
+    def _run_events(self):
         while True:
-            domstate = dom.info()[0]
-            if domstate == 5:
-               break
-            time.sleep(30)
-        dom.create()
-    print("Domain %s started" % (domain))
- 
-if __name__ == '__main__':
-    logging.basicConfig()
-    pidfile = open('/var/run/harness.pid', 'w')
-    pid = str(os.getpid())
-    pidfile.write(pid)
-    pidfile.close()
-    config = fedmsg.config.load_config([], None)
-    config['mute'] = True
-    config['timeout'] = 0
-    fedmsg.meta.make_processors(**config)
-
-    for name, endpoint, topic, msg in fedmsg.tail_messages(**config):
-        if "buildsys.build.state.change" in topic and msg['msg']['instance'] == 'primary':
-            matchedmsg = fedmsg.meta.msg2repr(msg, **config)
-            if "completed" in matchedmsg and "kernel-6" in matchedmsg:
-                objectmsg = fedmsg.meta.msg2subtitle(msg, legacy=False, **config)
-                package = objectmsg.split(' ')
-                fcrelease = package[1].split('.')
-                domain = domainmap(fcrelease[-1])
-                logfile = open('/var/log/harness.log', 'a')
-                logfile.write(matchedmsg + '\n')
-                logfile.write('Testing ' + package[1] + '\n')
-                logfile.close()
-                writelatest(domain, package[1])
-                dom32 = domain + 'arm64'
-                dom64 = domain + '64'
-                print(matchedmsg)
-                print("starting domain %s" % (dom32))
-                _thread.start_new(launchdomain, (dom32,))
-                print("starting domain %s" % (dom64))
-                _thread.start_new(launchdomain, (dom64,))
+            libvirt.virEventRunDefaultImpl()
+
+    def _lifecycle(self, conn, dom, event, detail, opaque):
+        if event == libvirt.VIR_DOMAIN_EVENT_STOPPED and self.on_stopped is not None:
+            self.on_stopped(dom.name())
+
+    def connection(self):
+        """Return the connection to libvirt, opening it again if it was lost."""
+        reconnected = False
+        with self._lock:
+            if self.conn is None or not self.conn.isAlive():
+                _log.info("Connecting to libvirt")
+                reconnected = self.conn is not None
+                self.conn = libvirt.open(self.uri)
+                self.conn.setKeepAlive(5, 3)
+                self.conn.domainEventRegisterAny(
+                    None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._lifecycle, None
+                )
+            conn = self.conn
+        if reconnected and self.on_reconnected is not None:
+            threading.Thread(
+                target=self.on_reconnected, name="libvirt-reconnected", daemon=True
+            ).start()
+        return conn
+
+    def is_running(self, domain):
+        """Return whether the domain is running."""
+        try:
+            dom = self.connection().lookupByName(domain)
+            return dom.info()[0] != libvirt.VIR_DOMAIN_SHUTOFF
+        except libvirt.libvirtError as err:
+            raise HypervisorError(str(err)) from err
+
+    def start(self, domain):
+        """Start the domain, or reboot it if it is running."""
+        try:
+            dom = self.connection().lookupByName(domain)
+            if dom.info()[0] == libvirt.VIR_DOMAIN_SHUTOFF:
+                dom.create()
+            else:
+                dom.reboot()
+        except libvirt.libvirtError as err:
+            raise HypervisorError(str(err)) from err
+
+
+class SimulatedHypervisor:
+    """Simulated guests, which shut off ``boot_time + test_time +
+    shutdown_time`` seconds after being started. A guest started while it
+    runs is rebooted and starts over.
+
+    It keeps track of the time each guest spent running, see busy_time.
+    """
+
+    def __init__(self, boot_time=60, test_time=600, shutdown_time=10, on_stopped=None):
+        self.boot_time = boot_time
+        self.test_time = test_time
+        self.shutdown_time = shutdown_time
+        self.on_stopped = on_stopped
+        self._lock = threading.Lock()
+        # Timer shutting off each running guest and when it was started
+        self._timers = {}
+        self._busy = collections.defaultdict(float)
+
+    def is_running(self, domain):
+        """Return whether the guest is running."""
+        return domain in self._timers
+
+    def start(self, domain):
+        """Start the guest, or reboot it if it is running."""
+        duration = self.boot_time + self.test_time + self.shutdown_time
+        with self._lock:
+            self._stop(domain)
+            timer = threading.Timer(duration, self._shutoff)
+            timer.args = (domain, timer)
+            timer.daemon = True
+            self._timers[domain] = (timer, time.monotonic())
+            timer.start()
+
+    def _stop(self, domain):
+        entry = self._timers.pop(domain, None)
+        if entry is not None:
+            entry[0].cancel()
+            self._busy[domain] += time.monotonic() - entry[1]
+        return entry is not None
+
+    def _shutoff(self, domain, timer):
+        with self._lock:
+            # The guest may have been rebooted meanwhile
+            if self._timers.get(domain, (None,))[0] is not timer or not self._stop(domain):
+                return
+        if self.on_stopped is not None:
+            self.on_stopped(domain)
+
+    def busy_time(self):
+        """Return the number of seconds the guests spent running."""
+        now = time.monotonic()
+        with self._lock:
+            running = sum(now - started for _, started in self._timers.values())
+            return sum(self._busy.values()) + running
+
+    def close(self):
+        """Shut off the guests, without reporting it."""
+        with self._lock:
+            for domain in list(self._timers):
+                self._stop(domain)
+
+
+## Dispatcher
+
+
+class Dispatcher:
+    """Start the guests having kernels queued using at most ``max_workers``
+    threads and ``max_running`` guests at the same time.
+
+    The guests are started as soon as they shut off: requests for a guest
+    which is running, or waiting to be started, are merged into one.
+    Rawhide guests are rebooted right away. Guests which could not be
+    started are tried again after ``retry_delay`` seconds.
+    """
+
+    def __init__(
+        self,
+        hypervisor,
+        queue,
+        max_workers=MAX_WORKERS,
+        max_running=MAX_RUNNING,
+        retry_delay=RETRY_DELAY,
+    ):
+        self.hypervisor = hypervisor
+        self.queue = queue
+        self.max_running = max_running
+        self.retry_delay = retry_delay
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="harness"
+        )
+        self._lock = threading.Lock()
+        # Guests to start, in the order they were requested
+        self.waiting = {}
+        # Guests being started and guests started by the dispatcher
+        self.starting = set()
+        self.running = set()
+        # Number of times in a row each guest could not be started, and
+        # the timers starting them again
+        self.failures = collections.Counter()
+        self._retries = {}
+        self._closed = threading.Event()
+
+    def resume(self):
+        """Pick up the jobs left by a previous run of the harness."""
+        for job in self.queue.started():
+            if self.hypervisor.is_running(job.domain):
+                with self._lock:
+                    self.running.add(job.domain)
+            else:
+                _log.info("Queuing %s again on %s", job.kernel, job.domain)
+                self.queue.requeue(job.domain)
+        for domain in self.queue.pending():
+            self.submit(domain)
+
+    def busy(self):
+        """Return whether guests are waiting, being started or running."""
+        with self._lock:
+            return bool(self.waiting or self.starting or self.running)
+
+    def close(self):
+        """Stop watching the guests and wait for the ones being started."""
+        self._closed.set()
+        with self._lock:
+            for timer in self._retries.values():
+                timer.cancel()
+        self.executor.shutdown(wait=True)
+
+    def reconcile(self):
+        """Note the guests started which shut off without the dispatcher
+        being told, such as while the connection to libvirt was lost.
+        """
+        with self._lock:
+            running = list(self.running - self.starting)
+        for domain in running:
+            try:
+                if self.hypervisor.is_running(domain):
+                    continue
+            except HypervisorError as err:
+                _log.error("Could not check domain %s: %s", domain, err)
+                return
+            with self._lock:
+                if domain not in self.running or domain in self.starting:
+                    continue
+            _log.warning("Domain %s shut off unnoticed", domain)
+            self.stopped(domain)
+
+    def watch(self, interval=RECONCILE_INTERVAL):
+        """Reconcile the guests running every ``interval`` seconds, in a
+        thread, until the dispatcher is closed.
+        """
+
+        def loop():
+            while not self._closed.wait(interval):
+                self.reconcile()
+
+        threading.Thread(target=loop, name="harness-reconcile", daemon=True).start()
+
+    def submit(self, domain):
+        """Start the domain once it is free."""
+        with self._lock:
+            self.waiting[domain] = True
+        self._schedule()
+
+    def stopped(self, domain):
+        """Note that the domain shut off, and start the waiting guests."""
+        self.queue.finish(domain)
+        with self._lock:
+            self.running.discard(domain)
+            if domain in self.queue.pending():
+                self.waiting[domain] = True
+        self._schedule()
+
+    def _schedule(self):
+        with self._lock:
+            for domain in list(self.waiting):
+                busy = len(self.starting) + len(self.running)
+                if self.max_running is not None and busy >= self.max_running:
+                    break
+                if domain in self.starting:
+                    continue
+                if domain in self.running and "Rawhide" not in domain:
+                    continue
+                del self.waiting[domain]
+                self.starting.add(domain)
+                self.executor.submit(self._launch, domain)
+
+    def _retry(self, domain):
+        """Start the domain again after a delay growing with its failures."""
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self.failures[domain] += 1
+            delay = min(self.retry_delay * 2 ** (self.failures[domain] - 1), MAX_RETRY_DELAY)
+            timer = threading.Timer(delay, self.submit, [domain])
+            timer.daemon = True
+            previous = self._retries.pop(domain, None)
+            if previous is not None:
+                previous.cancel()
+            self._retries[domain] = timer
+        _log.info("Starting domain %s again in %g seconds", domain, delay)
+        timer.start()
+
+    def _launch(self, domain):
+        job = None
+        try:
+            if "Rawhide" not in domain and self.hypervisor.is_running(domain):
+                # Not started by us, wait for its lifecycle event
+                with self._lock:
+                    self.waiting[domain] = True
+                    self.running.add(domain)
+                # It may have shut off before it was marked as running
+                if not self.hypervisor.is_running(domain):
+                    self.stopped(domain)
+                return
+            job = self.queue.start(domain)
+            if job is None:
+                return
+            self.hypervisor.start(domain)
+            _log.info("Domain %s started to test %s", domain, job.kernel)
+            with self._lock:
+                self.running.add(domain)
+                self.failures.pop(domain, None)
+                self._retries.pop(domain, None)
+        except (HypervisorError, OSError) as err:
+            _log.error("Could not start domain %s: %s", domain, err)
+            if job is not None:
+                self.queue.requeue(domain)
+            # A guest found running is started again once it shuts off
+            with self._lock:
+                retry = domain not in self.running
+            if retry:
+                self._retry(domain)
+        finally:
+            with self._lock:
+                self.starting.discard(domain)
+            self._schedule()
+
+
+def handle_build(dispatcher, kernel):
+    """Queue the kernel on the guests of its release."""
+    domain = domainmap(kernel.split(".")[-1])
+    guests = [domain + "arm64", domain + "64"]
+    for guest in dispatcher.queue.add(domain, kernel, guests):
+        _log.info("Queued %s on domain %s", kernel, guest)
+        dispatcher.submit(guest)
+
+
+## Kernel assignments
+
+
+class AssignmentHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP interface of the guests to the job queue.
+
+    ``GET /jobs/<domain>`` returns the JSON of the job the guest is
+    assigned, with its id as ETag, or 204 if it has none. With ``?wait=N``,
+    the request waits up to N seconds for an assignment, or for a new one
+    if the ETag of the current one is given in If-None-Match, and returns
+    304 if there is none.
+
+    ``POST /jobs/<domain>/<id>/pickup`` and ``POST /jobs/<domain>/<id>/finish``
+    record when the guest picked up the job and when it finished testing.
+    """
+
+    server_version = "kerneltest-harness"
+
+    def log_message(self, format, *args):
+        _log.debug("%s %s", self.address_string(), format % args)
+
+    def send(self, status, body=None, etag=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        match = re.fullmatch(r"/jobs/([\w.-]+)", url.path)
+        if match is None:
+            return self.send(404, {"error": "Not found"})
+        try:
+            wait = float(urllib.parse.parse_qs(url.query).get("wait", ["0"])[0])
+        except ValueError:
+            return self.send(400, {"error": "Invalid wait"})
+
+        known = None
+        etag = self.headers.get("If-None-Match", "").strip('"')
+        if etag.isdigit():
+            known = int(etag)
+        job = self.server.queue.assignment(match[1], known, min(max(wait, 0), MAX_WAIT))
+        if job is None:
+            return self.send(204)
+        if job.id == known:
+            return self.send(304, etag=f'"{job.id}"')
+        self.send(200, job._asdict(), etag=f'"{job.id}"')
+
+    def do_POST(self):
+        match = re.fullmatch(r"/jobs/([\w.-]+)/(\d+)/(pickup|finish)", self.path)
+        if match is None:
+            return self.send(404, {"error": "Not found"})
+        event = "pickedup" if match[3] == "pickup" else "completed"
+        if not self.server.queue.report(match[1], int(match[2]), event):
+            return self.send(404, {"error": "No such job"})
+        self.send(200, {"id": int(match[2]), event: True})
+
+
+class AssignmentServer(http.server.ThreadingHTTPServer):
+    """HTTP server of the kernel assignments, see AssignmentHandler."""
+
+    daemon_threads = True
+
+    def __init__(self, queue, address=LISTEN_ADDRESS):
+        super().__init__(address, AssignmentHandler)
+        self.queue = queue
+
+
+def handle_message(dispatcher, topic, body):
+    """Queue the kernel built according to the message, if any."""
+    kernel = parse_build(topic, body)
+    if kernel is not None:
+        _log.info("Testing %s", kernel)
+        handle_build(dispatcher, kernel)
+
+
+def run(source, dispatcher):
+    """Queue the kernels built according to the messages of the source."""
+    for topic, body in source:
+        try:
+            handle_message(dispatcher, topic, body)
+        except ValueError as err:
+            _log.error("Skipping message: %s", err)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    argparser.add_argument("--queue", default=QUEUE_PATH, help="Where the queue is kept")
+    argparser.add_argument("--replay", help="Replay the messages recorded in this file")
+    argparser.add_argument(
+        "--speed", type=float, default=1.0, help="Replay the messages that many times faster"
+    )
+    argparser.add_argument(
+        "--simulate", action="store_true", help="Simulate the guests instead of using libvirt"
+    )
+    argparser.add_argument(
+        "--address", default=LISTEN_ADDRESS[0], help="Address serving the assignments"
+    )
+    argparser.add_argument(
+        "--port", type=int, default=LISTEN_ADDRESS[1], help="Port serving the assignments"
+    )
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.simulate:
+        hypervisor = SimulatedHypervisor()
+    else:
+        logging.getLogger().addHandler(logging.FileHandler(LOG_PATH))
+        pidfile = open("/var/run/harness.pid", "w")
+        pid = str(os.getpid())
+        pidfile.write(pid)
+        pidfile.close()
+        hypervisor = LibvirtHypervisor()
+
+    queue = JobQueue(args.queue)
+    server = AssignmentServer(queue, (args.address, args.port))
+    threading.Thread(target=server.serve_forever, name="assignments", daemon=True).start()
+
+    dispatcher = Dispatcher(hypervisor, queue)
+    hypervisor.on_stopped = dispatcher.stopped
+    if not args.simulate:
+        hypervisor.on_reconnected = dispatcher.reconcile
+    dispatcher.resume()
+    dispatcher.watch()
+    if args.replay:
+        run(ReplaySource(args.replay, args.speed), dispatcher)
+    else:
+        consume(dispatcher)
+
+
+if __name__ == "__main__":
+    main()
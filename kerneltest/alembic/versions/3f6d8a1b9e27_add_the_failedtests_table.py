@@ -0,0 +1,62 @@
+"""Add the failedtests table indexing the names of the failed tests
+
+Revision ID: 3f6d8a1b9e27
+Revises: 9e3b71c0d2a4
+Create Date: 2026-10-18 10:02:45.190377
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from kerneltest.parser import split_failedtests
+
+# revision identifiers, used by Alembic.
+revision = "3f6d8a1b9e27"
+down_revision = "9e3b71c0d2a4"
+
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    """Create the failedtests table and fill it from the existing results"""
+    op.create_table(
+        "failedtests",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "testid",
+            sa.Integer,
+            sa.ForeignKey("kerneltest.testid", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column("testname", sa.Text(), nullable=False),
+    )
+    op.create_index("ix_failedtests_testname_testid", "failedtests", ["testname", "testid"])
+
+    kerneltest = sa.table("kerneltest", sa.column("testid"), sa.column("failedtests"))
+    failedtests = sa.table("failedtests", sa.column("testid"), sa.column("testname"))
+    connection = op.get_bind()
+    last = 0
+    while True:
+        rows = connection.execute(
+            sa.select(kerneltest.c.testid, kerneltest.c.failedtests)
+            .where(kerneltest.c.testid > last)
+            .where(kerneltest.c.failedtests.isnot(None))
+            .order_by(kerneltest.c.testid)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        values = [
+            dict(testid=testid, testname=testname)
+            for testid, names in rows
+            for testname in split_failedtests(names)
+        ]
+        if values:
+            connection.execute(failedtests.insert(), values)
+        last = rows[-1][0]
+
+
+def downgrade():
+    """Drop the failedtests table"""
+    op.drop_index("ix_failedtests_testname_testid", table_name="failedtests")
+    op.drop_table("failedtests")
@@ -0,0 +1,41 @@
+"""Add composite indexes to the kerneltest table
+
+Revision ID: 5c0a2f4ad7c1
+Revises: 02d7abf0710c
+Create Date: 2026-10-18 09:12:03.518211
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5c0a2f4ad7c1"
+down_revision = "02d7abf0710c"
+
+
+def upgrade():
+    """Add the indexes used by the index page, the release pages and the stats"""
+    op.create_index(
+        "ix_kerneltest_tester_fver_testarch_testid",
+        "kerneltest",
+        ["tester", "fver", "testarch", sa.text("testid DESC")],
+    )
+    op.create_index("ix_kerneltest_fver_testarch", "kerneltest", ["fver", "testarch"])
+    op.create_index(
+        "ix_kerneltest_fver_kver_testarch_tester",
+        "kerneltest",
+        ["fver", "kver", "testarch", "tester"],
+    )
+    op.create_index(
+        "ix_kerneltest_kver_fver_testarch_tester",
+        "kerneltest",
+        ["kver", "fver", "testarch", "tester"],
+    )
+
+
+def downgrade():
+    """Drop the composite indexes"""
+    op.drop_index("ix_kerneltest_kver_fver_testarch_tester", table_name="kerneltest")
+    op.drop_index("ix_kerneltest_fver_kver_testarch_tester", table_name="kerneltest")
+    op.drop_index("ix_kerneltest_fver_testarch", table_name="kerneltest")
+    op.drop_index("ix_kerneltest_tester_fver_testarch_testid", table_name="kerneltest")
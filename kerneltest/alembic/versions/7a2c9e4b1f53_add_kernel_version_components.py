@@ -0,0 +1,95 @@
+"""Add the components of the kernel version and its sort key to kerneltest
+
+Revision ID: 7a2c9e4b1f53
+Revises: c41e5d7f20b8
+Create Date: 2026-10-18 11:12:08.631042
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from kerneltest.parser import kver_key, parse_kver
+
+# revision identifiers, used by Alembic.
+revision = "7a2c9e4b1f53"
+down_revision = "c41e5d7f20b8"
+
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    """Add the kernel version columns and fill them from kver"""
+    op.add_column("kerneltest", sa.Column("kmajor", sa.Integer, nullable=True))
+    op.add_column("kerneltest", sa.Column("kminor", sa.Integer, nullable=True))
+    op.add_column("kerneltest", sa.Column("kpatch", sa.Integer, nullable=True))
+    op.add_column("kerneltest", sa.Column("kbuild", sa.Text(), nullable=True))
+    op.add_column("kerneltest", sa.Column("kdist", sa.String(16), nullable=True))
+    op.add_column("kerneltest", sa.Column("kverkey", sa.Text(), nullable=True))
+
+    kerneltest = sa.table(
+        "kerneltest",
+        sa.column("testid"),
+        sa.column("kver"),
+        sa.column("kmajor"),
+        sa.column("kminor"),
+        sa.column("kpatch"),
+        sa.column("kbuild"),
+        sa.column("kdist"),
+        sa.column("kverkey"),
+    )
+    update = (
+        kerneltest.update()
+        .where(kerneltest.c.testid == sa.bindparam("_testid"))
+        .values(
+            kmajor=sa.bindparam("kmajor"),
+            kminor=sa.bindparam("kminor"),
+            kpatch=sa.bindparam("kpatch"),
+            kbuild=sa.bindparam("kbuild"),
+            kdist=sa.bindparam("kdist"),
+            kverkey=sa.bindparam("kverkey"),
+        )
+    )
+    connection = op.get_bind()
+    last = 0
+    while True:
+        rows = connection.execute(
+            sa.select(kerneltest.c.testid, kerneltest.c.kver)
+            .where(kerneltest.c.testid > last)
+            .order_by(kerneltest.c.testid)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        values = []
+        for testid, kver in rows:
+            value = dict(_testid=testid, kverkey=kver_key(kver))
+            try:
+                version = parse_kver(kver)
+            except ValueError:
+                # Still sorted, but left out of the version filters
+                version = None
+            value["kmajor"] = version.major if version else None
+            value["kminor"] = version.minor if version else None
+            value["kpatch"] = version.patch if version else None
+            value["kbuild"] = version.build if version else None
+            value["kdist"] = version.dist if version else None
+            values.append(value)
+        connection.execute(update, values)
+        last = rows[-1][0]
+
+    op.create_index("ix_kerneltest_kverkey", "kerneltest", ["kverkey"])
+    op.create_index("ix_kerneltest_fver_kverkey_kver", "kerneltest", ["fver", "kverkey", "kver"])
+    op.create_index(
+        "ix_kerneltest_kmajor_kminor_kpatch_fver",
+        "kerneltest",
+        ["kmajor", "kminor", "kpatch", "fver"],
+    )
+
+
+def downgrade():
+    """Drop the kernel version columns"""
+    op.drop_index("ix_kerneltest_kmajor_kminor_kpatch_fver", table_name="kerneltest")
+    op.drop_index("ix_kerneltest_fver_kverkey_kver", table_name="kerneltest")
+    op.drop_index("ix_kerneltest_kverkey", table_name="kerneltest")
+    for column in ("kverkey", "kdist", "kbuild", "kpatch", "kminor", "kmajor"):
+        op.drop_column("kerneltest", column)
@@ -0,0 +1,30 @@
+"""Add the outbox table
+
+Revision ID: 9e3b71c0d2a4
+Revises: 5c0a2f4ad7c1
+Create Date: 2026-10-18 09:41:27.774012
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9e3b71c0d2a4"
+down_revision = "5c0a2f4ad7c1"
+
+
+def upgrade():
+    """Create the table holding the messages waiting to be published"""
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("schema", sa.String(255), nullable=False),
+        sa.Column("topic", sa.Text(), nullable=False),
+        sa.Column("body", sa.Text(), nullable=False),
+        sa.Column("created", sa.DateTime, nullable=False),
+    )
+
+
+def downgrade():
+    """Drop the outbox table"""
+    op.drop_table("outbox")
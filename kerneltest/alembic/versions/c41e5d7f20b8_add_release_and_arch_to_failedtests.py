@@ -0,0 +1,36 @@
+"""Add the release and arch of the test runs to the failedtests table
+
+Revision ID: c41e5d7f20b8
+Revises: 3f6d8a1b9e27
+Create Date: 2026-10-18 10:31:12.404158
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c41e5d7f20b8"
+down_revision = "3f6d8a1b9e27"
+
+
+def upgrade():
+    """Add the fver and testarch columns, copied from the kerneltest table"""
+    op.add_column("failedtests", sa.Column("fver", sa.Integer, nullable=True))
+    op.add_column("failedtests", sa.Column("testarch", sa.String(8), nullable=True))
+    op.execute(
+        "UPDATE failedtests SET "
+        "fver = (SELECT fver FROM kerneltest WHERE kerneltest.testid = failedtests.testid), "
+        "testarch = (SELECT testarch FROM kerneltest WHERE kerneltest.testid = failedtests.testid)"
+    )
+    op.create_index(
+        "ix_failedtests_testname_fver_testarch_testid",
+        "failedtests",
+        ["testname", "fver", "testarch", "testid"],
+    )
+
+
+def downgrade():
+    """Drop the fver and testarch columns"""
+    op.drop_index("ix_failedtests_testname_fver_testarch_testid", table_name="failedtests")
+    op.drop_column("failedtests", "testarch")
+    op.drop_column("failedtests", "fver")
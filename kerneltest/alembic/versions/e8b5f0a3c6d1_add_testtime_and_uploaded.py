@@ -0,0 +1,68 @@
+"""Add the parsed test date and the upload date to kerneltest
+
+Revision ID: e8b5f0a3c6d1
+Revises: 7a2c9e4b1f53
+Create Date: 2026-10-18 11:40:51.276310
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from kerneltest.parser import parse_testdate
+
+# revision identifiers, used by Alembic.
+revision = "e8b5f0a3c6d1"
+down_revision = "7a2c9e4b1f53"
+
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    """Add the testtime and uploaded columns and fill them from testdate"""
+    op.add_column("kerneltest", sa.Column("testtime", sa.DateTime, nullable=True))
+    op.add_column("kerneltest", sa.Column("uploaded", sa.DateTime, nullable=True))
+
+    kerneltest = sa.table(
+        "kerneltest",
+        sa.column("testid"),
+        sa.column("testdate"),
+        sa.column("testtime"),
+        sa.column("uploaded"),
+    )
+    update = (
+        kerneltest.update()
+        .where(kerneltest.c.testid == sa.bindparam("_testid"))
+        .values(testtime=sa.bindparam("testtime"), uploaded=sa.bindparam("uploaded"))
+    )
+    connection = op.get_bind()
+    last = 0
+    while True:
+        rows = connection.execute(
+            sa.select(kerneltest.c.testid, kerneltest.c.testdate)
+            .where(kerneltest.c.testid > last)
+            .order_by(kerneltest.c.testid)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        values = []
+        for testid, testdate in rows:
+            testtime = parse_testdate(testdate)
+            # The upload date was not recorded, the results were usually
+            # uploaded right after the tests ran
+            values.append(dict(_testid=testid, testtime=testtime, uploaded=testtime))
+        connection.execute(update, values)
+        last = rows[-1][0]
+
+    op.create_index("ix_kerneltest_testtime", "kerneltest", ["testtime"])
+    op.create_index("ix_kerneltest_uploaded", "kerneltest", ["uploaded"])
+    op.create_index("ix_kerneltest_fver_testtime", "kerneltest", ["fver", "testtime"])
+
+
+def downgrade():
+    """Drop the testtime and uploaded columns"""
+    op.drop_index("ix_kerneltest_fver_testtime", table_name="kerneltest")
+    op.drop_index("ix_kerneltest_uploaded", table_name="kerneltest")
+    op.drop_index("ix_kerneltest_testtime", table_name="kerneltest")
+    op.drop_column("kerneltest", "uploaded")
+    op.drop_column("kerneltest", "testtime")
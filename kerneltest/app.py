@@ -1,13 +1,20 @@
 # Licensed under the terms of the GNU GPL License version 2
 
 import datetime
+import hashlib
+import io
 import logging
 import logging.handlers
+import mimetypes
 import os
 import sys
+import tarfile
+import time
 import urllib.parse
+import zipfile
 from functools import wraps
 
+import click
 import flask
 import flask_wtf
 import munch
@@ -17,10 +24,15 @@ from flask_oidc import OpenIDConnect
 from flask_wtf.file import FileRequired
 from kerneltest_messages import ReleaseEditV1, ReleaseNewV1, UploadNewV1
 from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import FileStorage
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+import kerneltest.cache as cache
 import kerneltest.dbtools as dbtools
+import kerneltest.logstore as logstore
 import kerneltest.messaging as messaging
+import kerneltest.metrics as metrics
+import kerneltest.parser as parser
 
 __version__ = "1.3.0"
 
@@ -69,7 +81,85 @@ APP.logger.addHandler(STDERR_LOG)
 
 APP.wsgi_app = ProxyFix(APP.wsgi_app, x_proto=1, x_host=1)
 
-SESSION = dbtools.create_session(APP.config["DB_URL"])
+SESSION = dbtools.create_session(
+    APP.config["DB_URL"],
+    pool_recycle=APP.config["DB_POOL_RECYCLE"],
+    pool_size=APP.config["DB_POOL_SIZE"],
+    max_overflow=APP.config["DB_MAX_OVERFLOW"],
+    pool_timeout=APP.config["DB_POOL_TIMEOUT"],
+    pool_pre_ping=APP.config["DB_POOL_PRE_PING"],
+    statement_timeout=APP.config["DB_STATEMENT_TIMEOUT"],
+)
+
+RELEASES = cache.ReleaseCache(ttl=APP.config["RELEASE_CACHE_TTL"])
+
+PAGES = cache.page_store(
+    APP.config["PAGE_CACHE"],
+    ttl=APP.config["PAGE_CACHE_TTL"],
+    max_pages=APP.config["PAGE_CACHE_MAX_PAGES"],
+)
+
+# Started on the first commit of each process, see wake_dispatcher
+DISPATCHER = None
+
+metrics.instrument_engines()
+
+# Metrics exposed for the connection pool: key of dbtools.pool_status, name,
+# description and type
+POOL_METRICS = [
+    ("size", "kerneltest_db_pool_size", "Connections kept open.", "gauge"),
+    ("checkedout", "kerneltest_db_pool_checkedout", "Connections in use.", "gauge"),
+    ("overflow", "kerneltest_db_pool_overflow", "Connections beyond the pool size.", "gauge"),
+    ("checkouts", "kerneltest_db_pool_checkouts_total", "Connections checked out.", "counter"),
+    ("timeouts", "kerneltest_db_pool_timeouts_total", "Checkouts which timed out.", "counter"),
+    ("wait_total", "kerneltest_db_pool_wait_seconds_total", "Time spent waiting.", "counter"),
+    ("wait_max", "kerneltest_db_pool_wait_max_seconds", "Longest wait.", "gauge"),
+]
+
+
+## Request instrumentation
+
+
+@APP.before_request
+def start_timings():
+    """Start timing the phases of the request."""
+    flask.g.timings = metrics.RequestTimings()
+
+
+@flask.before_render_template.connect_via(APP)
+def start_render(sender, template, context, **extra):
+    """Note when the rendering of a template starts."""
+    flask.g.render_start = time.perf_counter()
+
+
+@flask.template_rendered.connect_via(APP)
+def end_render(sender, template, context, **extra):
+    """Add the time spent rendering a template to the request timings."""
+    timings = metrics.current()
+    start = flask.g.pop("render_start", None)
+    if timings is not None and start is not None:
+        timings.add("render", time.perf_counter() - start)
+
+
+@APP.after_request
+def record_timings(response):
+    """Record the metrics of the request and report its timings in the
+    Server-Timing header.
+    """
+    timings = metrics.current()
+    if timings is None:
+        return response
+
+    endpoint = flask.request.endpoint or "none"
+    metrics.REQUESTS.inc(endpoint, flask.request.method, response.status_code)
+    metrics.REQUEST_SECONDS.observe(timings.elapsed(), endpoint)
+    metrics.REQUEST_QUERIES.observe(timings.queries, endpoint)
+    for phase, seconds in timings.phases.items():
+        metrics.REQUEST_PHASE_SECONDS.observe(seconds, endpoint, phase)
+
+    if APP.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
 
 
 @APP.before_request
@@ -104,100 +194,200 @@ class InvalidInputException(Exception):
     pass
 
 
-## Generic functions
+class BatchTooLargeException(Exception):
+    """Exception raised when a batch upload holds too many result files."""
 
+    pass
 
-def parseresults(log):
-    """Parse the result of the kernel tests."""
-    testdate = None
-    testset = None
-    testkver = None
-    testrel = None
-    testresult = None
-    failedtests = None
-    for line in log:
-        line = line.decode()
-        if "Date: " in line:
-            testdate = line.replace("Date: ", "", 1).rstrip("\n")
-            APP.logger.warn(testdate)
-        elif "Test set: " in line:
-            testset = line.replace("Test set: ", "", 1).rstrip("\n")
-        elif "Kernel: " in line:
-            testkver = line.replace("Kernel: ", "", 1).rstrip("\n")
-        elif "Release: " in line:
-            testrel = line.replace("Release: ", "", 1).rstrip("\n")
-        elif "Result: " in line:
-            testresult = line.replace("Result: ", "", 1).rstrip("\n")
-        elif "Failed Tests: " in line:
-            failedtests = line.replace("Failed Tests: ", "", 1).rstrip("\n")
-        elif "========" in line:
-            break
-        # else:
-        # APP.logger.info("No match found for: %s", line)
-    return testdate, testset, testkver, testrel, testresult, failedtests
 
+## Generic functions
 
-def upload_results(test_result, username, authenticated=False):
-    """Actually try to upload the results into the database."""
+
+def parse_results(test_result, username, authenticated=False):
+    """Parse the uploaded results and return the corresponding KernelTest,
+    not yet added to the database.
+    """
     allowed_file(test_result)
 
-    logdir = APP.config.get("LOG_DIR", "logs")
-    if not os.path.exists(logdir) and not os.path.isdir(logdir):
-        os.mkdir(logdir)
     try:
-        (testdate, testset, testkver, testrel, testresult, failedtests) = parseresults(test_result)
-        APP.logger.error(testkver)
+        result = parser.parse_header(
+            test_result,
+            max_bytes=APP.config["PARSE_MAX_BYTES"],
+            max_lines=APP.config["PARSE_MAX_LINES"],
+        )
     except Exception as err:
         APP.logger.debug(err)
         raise InvalidInputException("Could not parse these results") from err
 
-    if not testkver:
+    if not result.kver:
         raise InvalidInputException("Could not parse these results")
 
-    relarch = testkver.split(".")
-    fver = relarch[-2].replace("fc", "", 1)
-    testarch = relarch[-1]
-    # Work around for F19 and older kver conventions
-    if testarch == "PAE":
-        testarch = "i686+PAE"
-        fver = relarch[-3].replace("fc", "", 1)
+    try:
+        version = parser.parse_kver(result.kver)
+    except ValueError as err:
+        APP.logger.debug(err)
+        raise InvalidInputException("Could not parse these results") from err
+    # The release has always been announced as a string in the messages
+    fver, testarch = str(version.fver), version.arch
 
     if is_authenticated():
         username = flask.g.fas_user.username
 
-    test = dbtools.KernelTest(
+    return dbtools.KernelTest(
         tester=username,
-        testdate=testdate,
-        testset=testset,
-        kver=testkver,
+        testdate=result.testdate,
+        testtime=parser.parse_testdate(result.testdate),
+        testset=result.testset,
+        kver=result.kver,
         fver=fver,
         testarch=testarch,
-        testrel=testrel,
-        testresult=testresult,
-        failedtests=failedtests,
+        kmajor=version.major,
+        kminor=version.minor,
+        kpatch=version.patch,
+        kbuild=version.build,
+        kdist=version.dist,
+        kverkey=parser.kver_key(result.kver),
+        testrel=result.testrel,
+        testresult=result.testresult,
+        failedtests=result.failedtests,
         authenticated=authenticated,
+        failures=[
+            dbtools.FailedTest(testname=testname, fver=fver, testarch=testarch)
+            for testname in parser.split_failedtests(result.failedtests)
+        ],
     )
 
-    SESSION.add(test)
-    SESSION.flush()
 
-    if authenticated:
+def store_results(test, test_result):
+    """Save the uploaded file in the logs directory and queue the message
+    announcing the new results, once the test has been flushed to the
+    database.
+    """
+    logdir = APP.config.get("LOG_DIR", "logs")
+    test_result.seek(0)
+    with metrics.timed("save"):
+        logstore.save(logdir, test.testid, test_result.stream)
+
+    if test.authenticated:
         msg = UploadNewV1(
             body=dict(
-                agent=username,
+                agent=test.tester,
                 test=test.to_json(),
             )
         )
 
-        messaging.publish(msg)
+        with metrics.timed("publish"):
+            messaging.enqueue(SESSION, msg)
 
-    filename = f"{test.testid}.log"
-    test_result.seek(0)
-    test_result.save(os.path.join(logdir, filename))
+
+def upload_results(test_result, username, authenticated=False):
+    """Actually try to upload the results into the database."""
+    test = parse_results(test_result, username, authenticated=authenticated)
+
+    SESSION.add(test)
+    SESSION.flush()
+
+    store_results(test, test_result)
 
     return test
 
 
+def iter_archive(archive):
+    """Yield the name and the content of the files in the uploaded tar or
+    zip archive, the content being None for files bigger than the size
+    allowed for a single upload.
+    """
+    max_size = APP.config["MAX_CONTENT_LENGTH"]
+    stream = archive.stream
+    if zipfile.is_zipfile(stream):
+        stream.seek(0)
+        with zipfile.ZipFile(stream) as zipped:
+            for info in zipped.infolist():
+                if info.is_dir():
+                    continue
+                with zipped.open(info) as member:
+                    data = member.read(max_size + 1)
+                yield info.filename, data if len(data) <= max_size else None
+        return
+
+    stream.seek(0)
+    try:
+        tarred = tarfile.open(fileobj=stream, mode="r:*")
+    except tarfile.TarError as err:
+        raise InvalidInputException("Invalid archive") from err
+    with tarred:
+        for member in tarred:
+            if not member.isfile():
+                continue
+            if member.size > max_size:
+                yield member.name, None
+                continue
+            yield member.name, tarred.extractfile(member).read()
+
+
+def iter_batch(form):
+    """Yield the name and the FileStorage of every result file of a batch
+    upload, the FileStorage being None for files too big to be uploaded.
+
+    Raise BatchTooLargeException past BATCH_MAX_ITEMS files, before reading
+    the next one.
+    """
+    max_items = APP.config["BATCH_MAX_ITEMS"]
+    for count, item in enumerate(_iter_batch(form)):
+        if count >= max_items:
+            raise BatchTooLargeException(f"More than {max_items} result files")
+        yield item
+
+
+def _iter_batch(form):
+    max_size = APP.config["MAX_CONTENT_LENGTH"]
+    for test_result in form.test_result.data:
+        if not test_result:
+            continue
+        test_result.stream.seek(0, os.SEEK_END)
+        too_big = test_result.stream.tell() > max_size
+        test_result.stream.seek(0)
+        yield test_result.filename, None if too_big else test_result
+
+    if form.archive.data:
+        for name, data in iter_archive(form.archive.data):
+            if data is None:
+                yield name, None
+                continue
+            content_type = mimetypes.guess_type(name)[0] or "text/plain"
+            yield name, FileStorage(io.BytesIO(data), filename=name, content_type=content_type)
+
+
+def discard_uploads(paths):
+    """Roll back the results inserted by the request and remove the logs
+    saved for them at ``paths``.
+    """
+    SESSION.rollback()
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError as err:
+            APP.logger.exception(err)
+
+
+def wake_dispatcher():
+    """Let the outbox dispatcher of this process know that new messages
+    were committed, starting it if needed.
+    """
+    global DISPATCHER
+    if not APP.config["OUTBOX_DISPATCHER"]:
+        return
+
+    if DISPATCHER is None or not DISPATCHER.is_alive():
+        DISPATCHER = messaging.Dispatcher(
+            SESSION,
+            interval=APP.config["OUTBOX_INTERVAL"],
+            batch_size=APP.config["OUTBOX_BATCH_SIZE"],
+        )
+        DISPATCHER.start()
+    DISPATCHER.wake()
+
+
 ## Flask specific utility function
 
 
@@ -272,11 +462,94 @@ def allowed_file(input_file):
         raise InvalidInputException(f"Invalid input submitted: {input_file.mimetype}")
 
 
+def cached_page(*tags, query_args=()):
+    """Flask decorator caching the pages rendered for anonymous users.
+
+    The pages are cached by path and by value of the ``query_args`` the
+    view reads, other query arguments being ignored, and tagged with
+    "releases" and ``tags``, formatted with the arguments of the view, see
+    result_pages.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def decorated_function(*args, **kwargs):
+            """Wrapped function serving the page from the cache."""
+            # Pages showing a user or a flashed message are not shared
+            if PAGES is None or is_authenticated() or "_flashes" in flask.session:
+                return function(*args, **kwargs)
+
+            query = [
+                (arg, flask.request.args[arg]) for arg in query_args if arg in flask.request.args
+            ]
+            key = flask.request.path
+            if query:
+                key += "?" + urllib.parse.urlencode(query)
+            page = PAGES.get(key)
+            if page is None:
+                rendered = time.time()
+                body = function(*args, **kwargs)
+                if not isinstance(body, str):
+                    return body
+                body = body.encode("utf-8")
+                page = cache.CachedPage(body, hashlib.sha1(body).hexdigest(), rendered)
+                page_tags = ["releases"] + [tag.format(**kwargs) for tag in tags]
+                PAGES.set(key, page, page_tags)
+
+            response = flask.Response(page.body, mimetype="text/html")
+            response.set_etag(page.etag)
+            response.last_modified = page.last_modified
+            return response.make_conditional(flask.request)
+
+        return decorated_function
+
+    return decorator
+
+
+def query_budget(limit):
+    """Flask decorator declaring the number of SQL queries the view may
+    issue, see kerneltest.metrics.QueryBudget.
+
+    The budget is checked according to QUERY_BUDGET, and logged in debug
+    mode when QUERY_BUDGET is not set.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def decorated_function(*args, **kwargs):
+            """Wrapped function counting the queries of the view."""
+            mode = APP.config["QUERY_BUDGET"] or ("log" if APP.debug else None)
+            if not mode:
+                return function(*args, **kwargs)
+
+            budget = metrics.QueryBudget(limit, flask.request.endpoint, strict=mode == "raise")
+            with budget:
+                return function(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
+
+
+def result_pages(tests):
+    """Return the tags of the cached pages showing the given test results."""
+    tags = {"index", "stats"}
+    for test in tests:
+        tags.add(f"release:{test.fver}")
+        tags.add(f"kernel:{test.kver}")
+    return tags
+
+
+def invalidate_pages(tags):
+    """Drop the cached pages tagged with any of ``tags``."""
+    if PAGES is not None:
+        PAGES.invalidate(tags)
+
+
 @APP.context_processor
 def inject_variables():
     """Inject some variables in every templates."""
-    releases = dbtools.getcurrentreleases(SESSION)
-    rawhide = dbtools.getrawhide(SESSION)
+    releases, rawhide = RELEASES.get(SESSION)
     admin = False
     if is_authenticated():
         admin = is_admin(flask.g.fas_user)
@@ -300,18 +573,13 @@ def shutdown_session(exception=None):
 
 
 @APP.route("/")
+@query_budget(2)
+@cached_page("index")
 def index():
     """Display the index page."""
-    releases = dbtools.getcurrentreleases(SESSION)
-    rawhide = dbtools.getrawhide(SESSION)
+    releases, rawhide = RELEASES.get(SESSION)
 
-    test_matrix = []
-    for release in releases:
-        arches = dbtools.getarches(SESSION, release.releasenum)
-        for arch in arches:
-            results = dbtools.getlatest(SESSION, release.releasenum, arch[0])
-            if results:
-                test_matrix.append(results)
+    test_matrix = dbtools.getlatestmatrix(SESSION)
 
     return flask.render_template(
         "index.html",
@@ -322,37 +590,144 @@ def index():
 
 
 @APP.route("/release/<release>")
+@query_budget(2)
+@cached_page("release:{release}", query_args=("version", "before", "after"))
 def release(release):
     """Display page with information about a specific release."""
-    kernels = dbtools.getkernelsbyrelease(SESSION, release)
+    version = flask.request.args.get("version") or None
+    try:
+        page = dbtools.getkernelsbyrelease(
+            SESSION,
+            release,
+            limit=APP.config["PAGE_SIZE"],
+            before=flask.request.args.get("before"),
+            after=flask.request.args.get("after"),
+            version=version,
+        )
+    except ValueError:
+        flask.abort(400, "Invalid version")
 
     return flask.render_template(
         "release.html",
         release=release,
-        kernels=kernels,
+        version=version,
+        kernels=page.items,
+        page=page,
     )
 
 
 @APP.route("/kernel/<kernel>")
+@query_budget(2)
+@cached_page("kernel:{kernel}", query_args=("before", "after"))
 def kernel(kernel):
     """Display page with information about a specific kernel."""
-    tests = dbtools.getresultsbykernel(SESSION, kernel)
+    page = dbtools.getresultsbykernel(
+        SESSION,
+        kernel,
+        limit=APP.config["PAGE_SIZE"],
+        before=flask.request.args.get("before", type=int),
+        after=flask.request.args.get("after", type=int),
+    )
 
     return flask.render_template(
         "kernel.html",
         kernel=kernel,
-        tests=tests,
+        tests=page.items,
+        page=page,
+    )
+
+
+@APP.route("/search")
+@query_budget(2)
+def search():
+    """Display the test results in which a given test failed."""
+    testname = flask.request.args.get("test", "").strip()
+    release = flask.request.args.get("release", type=int)
+    arch = flask.request.args.get("arch") or None
+
+    page = None
+    if testname:
+        page = dbtools.searchfailures(
+            SESSION,
+            testname,
+            release=release,
+            arch=arch,
+            limit=APP.config["PAGE_SIZE"],
+            before=flask.request.args.get("before", type=int),
+            after=flask.request.args.get("after", type=int),
+        )
+
+    return flask.render_template(
+        "search.html",
+        testname=testname,
+        release=release,
+        arch=arch,
+        tests=page.items if page else [],
+        page=page,
+    )
+
+
+def send_log(path, etag):
+    """Send the log file at ``path``, letting the web server send it when
+    configured to do so.
+    """
+    accel_prefix = APP.config.get("LOGS_X_ACCEL_REDIRECT")
+    if accel_prefix:
+        logdir = APP.config.get("LOG_DIR", "logs")
+        response = flask.Response(mimetype="text/plain")
+        response.set_etag(etag)
+        response.last_modified = os.stat(path).st_mtime
+        response.make_conditional(flask.request)
+        if response.status_code == 304:
+            return response
+        # nginx does not keep the Content-Encoding of the response, the
+        # compressed logs are sent by gzip_static for their name without .gz
+        relpath = os.path.relpath(path, logdir).removesuffix(".gz")
+        response.headers["X-Accel-Redirect"] = "/".join([accel_prefix.rstrip("/"), relpath])
+        return response
+
+    # Relies on X-Sendfile when USE_X_SENDFILE is set
+    return flask.send_file(
+        path, mimetype="text/plain", etag=etag, max_age=APP.config["LOGS_MAX_AGE"]
     )
 
 
-@APP.route("/logs/<logid>")
+@APP.route("/logs/<int:logid>")
+@query_budget(0)
 def logs(logid):
     """Display logs of a specific test run."""
     logdir = APP.config.get("LOG_DIR", "logs")
-    return flask.send_from_directory(logdir, f"{logid}.log")
+    path = logstore.log_path(logdir, logid)
+    etag = f"log-{logid}"
+
+    if not os.path.exists(path):
+        # Uploaded before the log store and not migrated yet
+        path = logstore.legacy_path(logdir, logid)
+        if not os.path.exists(path):
+            flask.abort(404)
+        response = send_log(path, etag)
+    elif flask.request.accept_encodings["gzip"]:
+        response = send_log(path, f"{etag}-gzip")
+        response.content_encoding = "gzip"
+    else:
+        response = flask.Response(logstore.iter_decompressed(path), mimetype="text/plain")
+        response.set_etag(etag)
+        response.last_modified = os.stat(path).st_mtime
+        response.make_conditional(
+            flask.request, accept_ranges=True, complete_length=logstore.decompressed_size(path)
+        )
+
+    # Logs never change once uploaded
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.max_age = APP.config["LOGS_MAX_AGE"]
+    response.cache_control.immutable = True
+    return response
 
 
 @APP.route("/stats")
+@query_budget(4)
+@cached_page("stats")
 def stats():
     """Display some stats about the data gathered."""
     stats = dbtools.get_stats(SESSION)
@@ -363,7 +738,165 @@ def stats():
     )
 
 
+## Read-only JSON API
+
+
+def api_etag():
+    """Return the ETag of the JSON API response to the current request,
+    derived from the version of the data and the URL requested.
+    """
+    version = dbtools.getdataversion(SESSION)
+    key = f"{version}:{flask.request.full_path}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def api_fields(items):
+    """Restrict the dictionnaries in ``items`` to the keys requested in the
+    ``fields`` argument of the request, comma separated.
+    """
+    fields = flask.request.args.get("fields")
+    if not fields:
+        return items
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for item in items[:1] for field in fields if field not in item]
+    if unknown:
+        jsonout = flask.jsonify({"error": f"Unknown fields: {', '.join(unknown)}"})
+        jsonout.status_code = 400
+        flask.abort(jsonout)
+    return [{field: item[field] for field in fields} for item in items]
+
+
+def api_limit():
+    """Return the page size requested, at most PAGE_SIZE."""
+    limit = flask.request.args.get("limit", APP.config["PAGE_SIZE"], type=int)
+    return max(1, min(limit, APP.config["PAGE_SIZE"]))
+
+
+def api_test(test):
+    """Return the JSON representation of a test result."""
+    output = test.to_json()
+    output["testid"] = test.testid
+    output["testtime"] = test.testtime.isoformat() if test.testtime else None
+    output["uploaded"] = test.uploaded.isoformat() if test.uploaded else None
+    return output
+
+
+def api_page(page, items):
+    """Return the JSON representation of a Page."""
+    return dict(items=items, prev=page.prev, next=page.next)
+
+
+def api_view(function):
+    """Return the output of the decorated view as JSON, answering with a
+    304 when the client already has the current version of the data.
+
+    The ETag is checked before calling the view so polling clients do not
+    trigger the queries building the response.
+    """
+
+    @wraps(function)
+    def decorated_function(*args, **kwargs):
+        etag = api_etag()
+        if etag in flask.request.if_none_match:
+            response = flask.Response(status=304)
+        else:
+            response = flask.jsonify(function(*args, **kwargs))
+        response.set_etag(etag)
+        # Let clients keep the response but revalidate it every time
+        response.cache_control.no_cache = True
+        return response
+
+    return decorated_function
+
+
+@APP.route("/api/v1/releases")
+@query_budget(2)
+@api_view
+def api_releases():
+    """Return the active releases."""
+    releases, rawhide = RELEASES.get(SESSION)
+    return dict(
+        items=api_fields([release.to_json() for release in releases]),
+        rawhide=rawhide.releasenum if rawhide else None,
+    )
+
+
+@APP.route("/api/v1/matrix")
+@query_budget(3)
+@api_view
+def api_matrix():
+    """Return the latest test result for each active release and arch."""
+    test_matrix = dbtools.getlatestmatrix(SESSION)
+    return dict(items=api_fields([api_test(test) for test in test_matrix]))
+
+
+@APP.route("/api/v1/release/<int:release>/kernels")
+@query_budget(3)
+@api_view
+def api_release(release):
+    """Return the kernels tested for a release, optionally restricted to
+    a version given in the ``version`` argument.
+    """
+    try:
+        page = dbtools.getkernelsbyrelease(
+            SESSION,
+            release,
+            limit=api_limit(),
+            before=flask.request.args.get("before"),
+            after=flask.request.args.get("after"),
+            version=flask.request.args.get("version") or None,
+        )
+    except ValueError:
+        jsonout = flask.jsonify({"error": "Invalid version"})
+        jsonout.status_code = 400
+        flask.abort(jsonout)
+    return api_page(page, [kver for kver, _ in page.items])
+
+
+@APP.route("/api/v1/kernel/<kernel>/results")
+@query_budget(3)
+@api_view
+def api_kernel(kernel):
+    """Return the test results of a kernel."""
+    page = dbtools.getresultsbykernel(
+        SESSION,
+        kernel,
+        limit=api_limit(),
+        before=flask.request.args.get("before", type=int),
+        after=flask.request.args.get("after", type=int),
+    )
+    return api_page(page, api_fields([api_test(test) for test in page.items]))
+
+
+@APP.route("/api/v1/stats")
+@query_budget(5)
+@api_view
+def api_stats():
+    """Return some stats about the data gathered."""
+    return dbtools.get_stats(SESSION)
+
+
+@APP.route("/metrics")
+def metrics_view():
+    """Expose the request metrics of this worker process in the Prometheus
+    text format.
+    """
+    if not APP.config["METRICS"]:
+        flask.abort(404)
+
+    status = dbtools.pool_status(SESSION)
+    extra = [
+        (name, description, kind, status[key])
+        for key, name, description, kind in POOL_METRICS
+        if key in status
+    ]
+    return flask.Response(
+        metrics.exposition(extra), mimetype="text/plain", content_type="text/plain; version=0.0.4"
+    )
+
+
 @APP.route("/upload/", methods=["GET", "POST"])
+@query_budget(3)
 @OIDC.require_login
 def upload():
     """Display the page where new results can be uploaded."""
@@ -380,7 +913,10 @@ def upload():
 
         try:
             tests = upload_results(test_result, username, authenticated=is_authenticated())
+            pages = result_pages([tests])
             SESSION.commit()
+            invalidate_pages(pages)
+            wake_dispatcher()
             flask.flash("Upload successful!")
         except InvalidInputException as err:
             APP.logger.debug(err)
@@ -405,6 +941,7 @@ def upload():
 
 
 @APP.route("/upload/autotest", methods=["POST"])
+@query_budget(3)
 def upload_autotest():
     """Specific endpoint for some clients to upload their results."""
     form = ApiUploadForm(meta={"csrf": False})
@@ -422,7 +959,10 @@ def upload_autotest():
 
         try:
             tests = upload_results(test_result, "kerneltest", authenticated=True)
+            pages = result_pages([tests])
             SESSION.commit()
+            invalidate_pages(pages)
+            wake_dispatcher()
             output = {"message": "Upload successful!"}
         except InvalidInputException as err:
             APP.logger.debug(err)
@@ -447,7 +987,96 @@ def upload_autotest():
     return jsonout
 
 
+@APP.route("/upload/autotest/batch", methods=["POST"])
+@query_budget(0)
+def upload_autotest_batch():
+    """Specific endpoint for the autotest client to upload many results,
+    as several files or as a tar or zip archive, in a single request.
+    """
+    flask.request.max_content_length = APP.config["BATCH_MAX_CONTENT_LENGTH"]
+    form = ApiBatchUploadForm(meta={"csrf": False})
+
+    if not form.validate_on_submit():
+        jsonout = flask.jsonify({"error": "Invalid request", "messages": form.errors})
+        jsonout.status_code = 400
+        return jsonout
+
+    api_token = form.api_token.data
+    if api_token is None or api_token != APP.config.get("API_KEY", None):
+        jsonout = flask.jsonify({"error": "Invalid api_token provided"})
+        jsonout.status_code = 401
+        return jsonout
+
+    # Each result is inserted and its log saved as soon as it is read, so
+    # the files of the batch are not all kept in memory
+    logdir = APP.config.get("LOG_DIR", "logs")
+    results = []
+    uploads = []
+    saved = []
+    try:
+        for name, test_result in iter_batch(form):
+            status = {"filename": name}
+            results.append(status)
+            if test_result is None:
+                status["error"] = "File too large"
+                continue
+            try:
+                test = parse_results(test_result, "kerneltest", authenticated=True)
+            except InvalidInputException as err:
+                APP.logger.debug(err)
+                status["error"] = "Invalid input file"
+                continue
+
+            # Inserted along with its failed tests and its message
+            metrics.allow_queries(3)
+            SESSION.add(test)
+            SESSION.flush()
+            try:
+                store_results(test, test_result)
+            except OSError as err:
+                APP.logger.exception(err)
+                SESSION.delete(test)
+                status["error"] = "Could not save the result file"
+                continue
+            saved.append(logstore.log_path(logdir, test.testid))
+            uploads.append(test)
+            status["message"] = "Upload successful!"
+            status["testid"] = test.testid
+
+        if not results:
+            jsonout = flask.jsonify({"error": "No result file provided"})
+            jsonout.status_code = 400
+            return jsonout
+
+        pages = result_pages(uploads)
+        SESSION.commit()
+    except InvalidInputException as err:
+        APP.logger.debug(err)
+        discard_uploads(saved)
+        jsonout = flask.jsonify({"error": "Invalid archive"})
+        jsonout.status_code = 400
+        return jsonout
+    except BatchTooLargeException as err:
+        APP.logger.debug(err)
+        discard_uploads(saved)
+        max_items = APP.config["BATCH_MAX_ITEMS"]
+        jsonout = flask.jsonify({"error": f"At most {max_items} result files per batch"})
+        jsonout.status_code = 413
+        return jsonout
+    except SQLAlchemyError as err:
+        APP.logger.exception(err)
+        discard_uploads(saved)
+        jsonout = flask.jsonify({"error": "Could not save data in the database"})
+        jsonout.status_code = 500
+        return jsonout
+
+    invalidate_pages(pages)
+    wake_dispatcher()
+    return flask.jsonify({"results": results})
+
+
 @APP.route("/upload/anonymous", methods=["POST"])
+@query_budget(2)
 def upload_anonymous():
     """Specific endpoint for some clients to upload their results."""
     form = UploadForm(meta={"csrf": False})
@@ -470,7 +1099,10 @@ def upload_anonymous():
 
         try:
             tests = upload_results(test_result, username, authenticated=is_authenticated())
+            pages = result_pages([tests])
             SESSION.commit()
+            invalidate_pages(pages)
+            wake_dispatcher()
             output = {"message": "Upload successful!"}
         except InvalidInputException as err:
             APP.logger.debug(err)
@@ -533,6 +1165,7 @@ def logout():
 
 
 @APP.route("/admin/new", methods=("GET", "POST"))
+@query_budget(3)
 @admin_required
 def admin_new_release():
     form = ReleaseForm()
@@ -540,7 +1173,6 @@ def admin_new_release():
         release = dbtools.Release()
         SESSION.add(release)
         form.populate_obj(obj=release)
-        SESSION.commit()
 
         msg = ReleaseNewV1(
             body=dict(
@@ -548,7 +1180,11 @@ def admin_new_release():
                 release=release.to_json(),
             )
         )
-        messaging.publish(msg)
+        messaging.enqueue(SESSION, msg)
+        SESSION.commit()
+        RELEASES.invalidate()
+        invalidate_pages(["releases"])
+        wake_dispatcher()
 
         flask.flash(f'Release "{release.releasenum}" added')
         return flask.redirect(flask.url_for("index"))
@@ -556,6 +1192,7 @@ def admin_new_release():
 
 
 @APP.route("/admin/<relnum>/edit", methods=("GET", "POST"))
+@query_budget(4)
 @admin_required
 def admin_edit_release(relnum):
     release = dbtools.get_release(SESSION, relnum)
@@ -566,7 +1203,6 @@ def admin_edit_release(relnum):
     form = ReleaseForm(obj=release)
     if form.validate_on_submit():
         form.populate_obj(obj=release)
-        SESSION.commit()
 
         msg = ReleaseEditV1(
             body=dict(
@@ -574,7 +1210,11 @@ def admin_edit_release(relnum):
                 release=release.to_json(),
             )
         )
-        messaging.publish(msg)
+        messaging.enqueue(SESSION, msg)
+        SESSION.commit()
+        RELEASES.invalidate()
+        invalidate_pages(["releases"])
+        wake_dispatcher()
 
         flask.flash(f'Release "{release.releasenum}" updated')
         return flask.redirect(flask.url_for("index"))
@@ -583,6 +1223,40 @@ def admin_edit_release(relnum):
     )
 
 
+## Command line interface
+
+
+@APP.cli.command("dispatch-outbox")
+@click.option("--once", is_flag=True, help="Publish the waiting messages and exit.")
+def dispatch_outbox(once):
+    """Publish the messages of the outbox to the message bus."""
+    batch_size = APP.config["OUTBOX_BATCH_SIZE"]
+    while True:
+        while messaging.dispatch(SESSION, batch_size) == batch_size:
+            pass
+        SESSION.remove()
+        if once:
+            break
+        time.sleep(APP.config["OUTBOX_INTERVAL"])
+
+
+@APP.cli.command("migrate-logs")
+@click.option("--jobs", "-j", type=int, default=None, help="Number of parallel processes.")
+def migrate_logs(jobs):
+    """Compress the logs stored flat in LOG_DIR into the log store."""
+    logdir = APP.config.get("LOG_DIR", "logs")
+    count = logstore.migrate(logdir, jobs=jobs)
+    click.echo(f"{count} logs migrated")
+
+
+@APP.cli.command("backfill-failures")
+@click.option("--batch-size", type=int, default=1000, help="Test results per transaction.")
+def backfill_failures(batch_size):
+    """Index the failed tests of the results uploaded before the failedtests table."""
+    count = dbtools.backfill_failedtests(SESSION, batch_size=batch_size)
+    click.echo(f"{count} failed tests added")
+
+
 ## Form used to upload new results
 
 
@@ -601,6 +1275,14 @@ class ApiUploadForm(flask_wtf.FlaskForm):
     test_result = wtf.FileField("Result file", validators=[FileRequired()])
 
 
+class ApiBatchUploadForm(flask_wtf.FlaskForm):
+    """Form used to upload many results of kernel tests at once via the api."""
+
+    api_token = wtf.StringField("API token", validators=[wtf.validators.DataRequired()])
+    test_result = wtf.MultipleFileField("Result files")
+    archive = wtf.FileField("Archive of result files")
+
+
 class ReleaseForm(flask_wtf.FlaskForm):
     """Form used to create or edit release in the database."""
 
@@ -0,0 +1,268 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+import kerneltest.dbtools as dbtools
+
+
+class ReleaseCache:
+    """Process-local cache of the active releases and of the rawhide release.
+
+    The releases change a few times a year, so instead of querying them for
+    every rendered page they are kept in memory until they are explicitly
+    invalidated (when an admin edits them) or until ``ttl`` seconds have
+    passed, which lets the other worker processes pick up the changes.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = 0
+        # Incremented by invalidate, so a query racing it is not cached
+        self._generation = 0
+
+    def get(self, session):
+        """Return a tuple of the active releases and the rawhide release."""
+        value = self._value
+        if value is not None and time.monotonic() < self._expires:
+            return value
+
+        generation = self._generation
+        releases = [
+            # Copies detached from the session, so they can outlive it
+            dbtools.Release(releasenum=release.releasenum, support=release.support)
+            for release in dbtools.getcurrentreleases(session)
+        ]
+        # The active releases are sorted newest first, same as getrawhide
+        rawhide = next((release for release in releases if release.support == "RAWHIDE"), None)
+        value = (releases, rawhide)
+        with self._lock:
+            if generation == self._generation:
+                self._value = value
+                self._expires = time.monotonic() + self.ttl
+        return value
+
+    def invalidate(self):
+        """Drop the cached releases, they will be reloaded on the next call."""
+        with self._lock:
+            self._generation += 1
+            self._value = None
+
+
+# A rendered page: its content, its ETag and the time it was rendered at
+CachedPage = collections.namedtuple("CachedPage", ["body", "etag", "last_modified"])
+
+
+class MemoryPageStore:
+    """Process-local store of rendered pages.
+
+    Each page is stored with a set of tags naming the data it shows, so
+    that a change of that data drops only the pages showing it. Pages
+    invalidated by other worker processes are kept until ``ttl`` seconds
+    have passed, use SQLitePageStore to share the pages between processes.
+    At most ``max_pages`` pages are kept, the oldest ones are dropped first.
+    """
+
+    def __init__(self, ttl=300, max_pages=1000):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        # Oldest first, which is also the order in which they expire
+        self._pages = collections.OrderedDict()
+        self._tags = collections.defaultdict(set)
+        self._invalidated = {}
+
+    def get(self, key):
+        """Return the CachedPage stored for ``key``, if any."""
+        entry = self._pages.get(key)
+        if entry is None or time.monotonic() >= entry[1]:
+            return None
+        return entry[0]
+
+    def _drop(self, key):
+        """Drop the page stored for ``key``, with the lock held."""
+        _, _, tags = self._pages.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def set(self, key, page, tags):
+        """Store the page for ``key``, unless one of its tags was
+        invalidated after the page was rendered.
+        """
+        tags = list(tags)
+        now = time.monotonic()
+        with self._lock:
+            if any(self._invalidated.get(tag, 0) >= page.last_modified for tag in tags):
+                return
+            if key in self._pages:
+                self._drop(key)
+            while self._pages:
+                oldest = next(iter(self._pages))
+                if self._pages[oldest][1] > now and len(self._pages) < self.max_pages:
+                    break
+                self._drop(oldest)
+            self._pages[key] = (page, now + self.ttl, tags)
+            for tag in tags:
+                self._tags[tag].add(key)
+
+    def invalidate(self, tags):
+        """Drop the pages tagged with any of ``tags``."""
+        now = time.time()
+        with self._lock:
+            # Only needed while the pages rendered before now are stored
+            self._invalidated = {
+                tag: invalidated
+                for tag, invalidated in self._invalidated.items()
+                if invalidated >= now - self.ttl
+            }
+            for tag in tags:
+                self._invalidated[tag] = now
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+
+    def clear(self):
+        """Drop all the pages."""
+        with self._lock:
+            self._pages.clear()
+            self._tags.clear()
+            self._invalidated.clear()
+
+
+class SQLitePageStore:
+    """Store of rendered pages in a SQLite database, shared by all the
+    worker processes of a host.
+
+    Works like MemoryPageStore, each thread using its own connection.
+    """
+
+    def __init__(self, path, ttl=300, max_pages=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        """Return the connection of the current thread and process."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    etag TEXT NOT NULL,
+                    last_modified REAL NOT NULL,
+                    expires REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_pages_expires ON pages (expires);
+                CREATE TABLE IF NOT EXISTS page_tags (
+                    tag TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (tag, key)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS ix_page_tags_key ON page_tags (key);
+                CREATE TABLE IF NOT EXISTS invalidated_tags (
+                    tag TEXT PRIMARY KEY,
+                    invalidated REAL NOT NULL
+                );
+                """
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        """Return the CachedPage stored for ``key``, if any."""
+        row = self.connection.execute(
+            "SELECT body, etag, last_modified FROM pages WHERE key = ? AND expires > ?",
+            (key, time.time()),
+        ).fetchone()
+        return CachedPage(*row) if row else None
+
+    def set(self, key, page, tags):
+        """Store the page for ``key``, unless one of its tags was
+        invalidated after the page was rendered.
+        """
+        tags = list(tags)
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            invalidated = connection.execute(
+                "SELECT MAX(invalidated) FROM invalidated_tags "
+                f"WHERE tag IN ({', '.join('?' * len(tags))})",
+                tags,
+            ).fetchone()[0]
+            if invalidated is not None and invalidated >= page.last_modified:
+                return
+            # Drop the expired pages, and the oldest ones past max_pages
+            now = time.time()
+            stale = connection.execute(
+                "SELECT key FROM pages WHERE expires <= ? OR key = ? UNION "
+                "SELECT key FROM (SELECT key FROM pages ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (now, key, self.max_pages - 1),
+            ).fetchall()
+            connection.executemany("DELETE FROM pages WHERE key = ?", stale)
+            connection.executemany("DELETE FROM page_tags WHERE key = ?", stale)
+            connection.execute(
+                "INSERT INTO pages VALUES (?, ?, ?, ?, ?)",
+                (key, page.body, page.etag, page.last_modified, now + self.ttl),
+            )
+            connection.executemany(
+                "INSERT INTO page_tags VALUES (?, ?)", [(tag, key) for tag in tags]
+            )
+
+    def invalidate(self, tags):
+        """Drop the pages tagged with any of ``tags``."""
+        tags = list(tags)
+        now = time.time()
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            # Only needed while the pages rendered before now are stored
+            connection.execute(
+                "DELETE FROM invalidated_tags WHERE invalidated < ?", (now - self.ttl,)
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO invalidated_tags VALUES (?, ?)",
+                [(tag, now) for tag in tags],
+            )
+            keys = connection.execute(
+                f"SELECT key FROM page_tags WHERE tag IN ({', '.join('?' * len(tags))})", tags
+            ).fetchall()
+            connection.executemany("DELETE FROM pages WHERE key = ?", keys)
+            connection.executemany("DELETE FROM page_tags WHERE key = ?", keys)
+
+    def clear(self):
+        """Drop all the pages."""
+        connection = self.connection
+        with connection:
+            connection.execute("DELETE FROM pages")
+            connection.execute("DELETE FROM page_tags")
+            connection.execute("DELETE FROM invalidated_tags")
+
+
+def page_store(url, ttl=300, max_pages=1000):
+    """Return the page store configured by ``url``: ``memory`` for a
+    MemoryPageStore, ``sqlite:///<path>`` for a SQLitePageStore, None to
+    disable the page cache.
+    """
+    if not url:
+        return None
+    if url == "memory":
+        return MemoryPageStore(ttl=ttl, max_pages=max_pages)
+    if url.startswith("sqlite:///"):
+        return SQLitePageStore(url[len("sqlite:///") :], ttl=ttl, max_pages=max_pages)
+    raise ValueError(f"Invalid page cache: {url}")
@@ -1,19 +1,37 @@
 # Licensed under the terms of the GNU GPL License version 2
 
+import collections
 import datetime
+import logging
+import os
+import threading
+import time
+import weakref
 
 import sqlalchemy as sa
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.orm import relationship, scoped_session, sessionmaker
+
+import kerneltest.parser as parser
 
 BASE = declarative_base()
 
+_log = logging.getLogger(__name__)
+
+# A page of results: the items of the page and the cursors to use to get the
+# previous and next pages, None when there is no such page
+Page = collections.namedtuple("Page", ["items", "prev", "next"])
+
 
 class KernelTest(BASE):
     __tablename__ = "kerneltest"
     testid = sa.Column(sa.Integer, primary_key=True)
     tester = sa.Column(sa.String(20), nullable=False, default="anon")
     testdate = sa.Column(sa.String(80), nullable=False, default=datetime.datetime.utcnow)
+    # testdate parsed and converted to UTC, see kerneltest.parser.parse_testdate
+    testtime = sa.Column(sa.DateTime, nullable=True, index=True)
+    # When the results were uploaded, in UTC
+    uploaded = sa.Column(sa.DateTime, nullable=True, index=True, default=datetime.datetime.utcnow)
     testset = sa.Column(sa.String(80), nullable=False)
     kver = sa.Column(sa.Text(), nullable=False, index=True)
     fver = sa.Column(sa.Integer, nullable=True, index=True)
@@ -22,6 +40,16 @@ class KernelTest(BASE):
     testresult = sa.Column(sa.Enum("PASS", "FAIL", "WARN", name="testresult"))
     failedtests = sa.Column(sa.Text(), nullable=True)
     authenticated = sa.Column(sa.Boolean, nullable=False, default=False)
+    # Components of kver, see kerneltest.parser.parse_kver, and the key
+    # sorting kver in version order, see kerneltest.parser.kver_key
+    kmajor = sa.Column(sa.Integer, nullable=True)
+    kminor = sa.Column(sa.Integer, nullable=True)
+    kpatch = sa.Column(sa.Integer, nullable=True)
+    kbuild = sa.Column(sa.Text(), nullable=True)
+    kdist = sa.Column(sa.String(16), nullable=True)
+    kverkey = sa.Column(sa.Text(), nullable=True, index=True)
+
+    failures = relationship("FailedTest", cascade="all, delete-orphan")
 
     def to_json(self):
         """Return a dictionnary representation of this object."""
@@ -39,6 +67,69 @@ class KernelTest(BASE):
         )
 
 
+# Composite indexes matching the access paths of the queries below
+sa.Index(
+    "ix_kerneltest_tester_fver_testarch_testid",
+    KernelTest.tester,
+    KernelTest.fver,
+    KernelTest.testarch,
+    KernelTest.testid.desc(),
+)
+sa.Index("ix_kerneltest_fver_testarch", KernelTest.fver, KernelTest.testarch)
+sa.Index(
+    "ix_kerneltest_fver_kver_testarch_tester",
+    KernelTest.fver,
+    KernelTest.kver,
+    KernelTest.testarch,
+    KernelTest.tester,
+)
+sa.Index(
+    "ix_kerneltest_kver_fver_testarch_tester",
+    KernelTest.kver,
+    KernelTest.fver,
+    KernelTest.testarch,
+    KernelTest.tester,
+)
+sa.Index("ix_kerneltest_fver_kverkey_kver", KernelTest.fver, KernelTest.kverkey, KernelTest.kver)
+sa.Index("ix_kerneltest_fver_testtime", KernelTest.fver, KernelTest.testtime)
+sa.Index(
+    "ix_kerneltest_kmajor_kminor_kpatch_fver",
+    KernelTest.kmajor,
+    KernelTest.kminor,
+    KernelTest.kpatch,
+    KernelTest.fver,
+)
+
+
+class FailedTest(BASE):
+    """A test which failed in a test run, one row per name listed in the
+    failedtests column of KernelTest so they can be searched and counted.
+
+    The release and arch of the test run are copied from KernelTest so the
+    failures of a test can be aggregated per release and arch without
+    joining the kerneltest table.
+    """
+
+    __tablename__ = "failedtests"
+    id = sa.Column(sa.Integer, primary_key=True)
+    testid = sa.Column(
+        sa.Integer, sa.ForeignKey("kerneltest.testid", ondelete="CASCADE"), nullable=False
+    )
+    testname = sa.Column(sa.Text(), nullable=False)
+    fver = sa.Column(sa.Integer, nullable=True)
+    testarch = sa.Column(sa.String(8), nullable=True)
+
+
+sa.Index("ix_failedtests_testname_testid", FailedTest.testname, FailedTest.testid)
+sa.Index(
+    "ix_failedtests_testname_fver_testarch_testid",
+    FailedTest.testname,
+    FailedTest.fver,
+    FailedTest.testarch,
+    FailedTest.testid,
+)
+
+
 class Release(BASE):
     __tablename__ = "releases"
     releasenum = sa.Column(sa.Integer, primary_key=True)
@@ -52,7 +143,82 @@ class Release(BASE):
         )
 
 
-def create_session(db_url, debug=False, pool_recycle=3600, create_table=False):
+class OutboxMessage(BASE):
+    """Message waiting to be published on the message bus.
+
+    Messages are added in the same transaction as the changes they announce
+    and published by kerneltest.messaging.dispatch once committed.
+    """
+
+    __tablename__ = "outbox"
+    id = sa.Column(sa.Integer, primary_key=True)
+    schema = sa.Column(sa.String(255), nullable=False)
+    topic = sa.Column(sa.Text(), nullable=False)
+    body = sa.Column(sa.Text(), nullable=False)
+    created = sa.Column(sa.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class TimedQueuePool(sa.pool.QueuePool):
+    """QueuePool recording how long the checkouts wait for a connection,
+    see pool_status.
+    """
+
+    # Checkouts waiting longer than this many seconds are logged
+    wait_warning = 1.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        except sa.exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait = time.monotonic() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+            if wait > self.wait_warning:
+                _log.warning("Waited %.3fs for a database connection: %s", wait, self.status())
+
+
+# Engines created by create_session, see _dispose_after_fork
+_ENGINES = weakref.WeakSet()
+
+
+def _dispose_after_fork():
+    """Drop the connections opened by the parent from the pools of a forked
+    process, such as the workers of gunicorn --preload, leaving them open
+    for the parent.
+    """
+    for engine in list(_ENGINES):
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+def create_session(
+    db_url,
+    debug=False,
+    pool_recycle=3600,
+    create_table=False,
+    pool_size=None,
+    max_overflow=None,
+    pool_timeout=None,
+    pool_pre_ping=False,
+    statement_timeout=None,
+):
     """Create the Session object to use to query the database.
 
     :arg db_url: URL used to connect to the database. The URL contains
@@ -63,16 +229,104 @@ def create_session(db_url, debug=False, pool_recycle=3600, create_table=False):
         output of sqlalchemy or not.
     :kwarg create_table: a boolean specifying wether the database should be
         instanciated/created or not.
+    :kwarg pool_size, max_overflow, pool_timeout, pool_pre_ping: the
+        settings of the connection pool, the defaults of SQLAlchemy are
+        used for the ones left to None.
+    :kwarg statement_timeout: the number of seconds after which PostgreSQL
+        cancels a query, None to let queries run as long as they need.
     :return a Session that can be used to query the database.
 
     """
-    engine = sa.create_engine(db_url, echo=debug, pool_recycle=pool_recycle)
+    kwargs = dict(echo=debug, pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping)
+    url = sa.engine.make_url(db_url)
+    if url.get_backend_name() != "sqlite" or url.database not in (None, "", ":memory:"):
+        kwargs["poolclass"] = TimedQueuePool
+        for name, value in [
+            ("pool_size", pool_size),
+            ("max_overflow", max_overflow),
+            ("pool_timeout", pool_timeout),
+        ]:
+            if value is not None:
+                kwargs[name] = value
+    engine = sa.create_engine(url, **kwargs)
+
+    if statement_timeout and engine.dialect.name == "postgresql":
+
+        @sa.event.listens_for(engine, "connect")
+        def set_statement_timeout(dbapi_connection, connection_record):
+            """Set the statement timeout of the new connections, outside of
+            a transaction so the rollback on return to the pool keeps it.
+            """
+            autocommit = dbapi_connection.autocommit
+            dbapi_connection.autocommit = True
+            try:
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f"SET statement_timeout = {int(statement_timeout * 1000)}")
+                cursor.close()
+            finally:
+                dbapi_connection.autocommit = autocommit
+
+    _ENGINES.add(engine)
+
     if create_table:
         BASE.metadata.create_all(engine)
     scopedsession = scoped_session(sessionmaker(bind=engine))
     return scopedsession
 
 
+def pool_status(session):
+    """Return the state of the connection pool used by the session: the
+    number of connections opened and checked out, and for pools created by
+    create_session, the number of checkouts, the number of them which timed
+    out and the total and maximum time spent waiting for a connection.
+    """
+    pool = session.get_bind().pool
+    output = dict(status=pool.status())
+    if isinstance(pool, sa.pool.QueuePool):
+        output.update(size=pool.size(), checkedout=pool.checkedout(), overflow=pool.overflow())
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            output.update(
+                checkouts=pool.checkouts,
+                timeouts=pool.timeouts,
+                wait_total=pool.wait_total,
+                wait_max=pool.wait_max,
+            )
+    return output
+
+
+def paginate(query, column, key, limit, before=None, after=None):
+    """Return a Page of the results of the query sorted by ``column`` in
+    descending order.
+
+    The pages are selected using keyset pagination: ``before`` returns the
+    results whose ``column`` is lower than the given value and ``after``
+    the ones whose ``column`` is greater. ``key`` is a function returning
+    the value of ``column`` for a result, used to build the cursors.
+    """
+    if after is not None:
+        query = query.filter(column > after).order_by(column.asc())
+    else:
+        if before is not None:
+            query = query.filter(column < before)
+        query = query.order_by(column.desc())
+
+    items = query.limit(limit + 1).all()
+    more = len(items) > limit
+    items = items[:limit]
+    if after is not None:
+        items.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = before is not None, more
+
+    return Page(
+        items,
+        key(items[0]) if items and has_prev else None,
+        key(items[-1]) if items and has_next else None,
+    )
+
+
 def get_release(session, releasenum):
     """Return the Release object for a specified release number."""
     query = session.query(Release).filter(Release.releasenum == releasenum)
@@ -124,43 +378,282 @@ def getlatest(session, release, arch):
     return query.first()
 
 
-def getkernelsbyrelease(session, release=None):
-    """Return the different kernel version for the release specified."""
-    query = session.query(sa.func.distinct(KernelTest.kver)).order_by(KernelTest.kver.desc())
+def getlatestmatrix(session):
+    """Return the latest test of the `kerneltest` tester for every arch of
+    every active release, in a single query.
+    """
+    latest = (
+        session.query(sa.func.max(KernelTest.testid).label("testid"))
+        .join(Release, Release.releasenum == KernelTest.fver)
+        .filter(Release.support != "RETIRED")
+        .filter(KernelTest.tester == "kerneltest")
+        .group_by(KernelTest.fver, KernelTest.testarch)
+        .subquery()
+    )
+    query = (
+        session.query(KernelTest)
+        .join(latest, KernelTest.testid == latest.c.testid)
+        .order_by(KernelTest.fver.desc(), KernelTest.testarch.desc())
+    )
+
+    return query.all()
+
+
+def filterversion(query, version):
+    """Restrict the query to the kernels of a version given as ``major``,
+    ``major.minor`` or ``major.minor.patch``.
+
+    :raise ValueError: if ``version`` is not such a version.
+    """
+    columns = [KernelTest.kmajor, KernelTest.kminor, KernelTest.kpatch]
+    numbers = [int(number) for number in version.split(".")]
+    if len(numbers) > len(columns):
+        raise ValueError(f"Invalid version: {version}")
+    for column, number in zip(columns, numbers):
+        query = query.filter(column == number)
+    return query
+
+
+def filtertime(query, since=None, until=None):
+    """Restrict the query to the test results of the tests ran from
+    ``since`` and before ``until``, as UTC datetimes.
+    """
+    if since is not None:
+        query = query.filter(KernelTest.testtime >= since)
+    if until is not None:
+        query = query.filter(KernelTest.testtime < until)
+    return query
+
+
+def getkernelsbyrelease(
+    session,
+    release=None,
+    limit=None,
+    before=None,
+    after=None,
+    version=None,
+    since=None,
+    until=None,
+):
+    """Return the different kernel version for the release specified,
+    newest version first, optionally restricted to a version (e.g. "6.8")
+    and to the kernels tested between ``since`` and ``until``.
+
+    When ``limit`` is set, return a Page of at most that many kernels
+    instead, using kernel versions as ``before``/``after`` cursors.
+    """
+    query = session.query(KernelTest.kver, KernelTest.kverkey).distinct()
 
     if release is not None:
         query = query.filter(KernelTest.fver == release)
+    if version is not None:
+        query = filterversion(query, version)
+    query = filtertime(query, since, until)
+
+    if limit is not None:
+        return paginate(
+            query,
+            KernelTest.kverkey,
+            lambda row: row[0],
+            limit,
+            parser.kver_key(before) if before is not None else None,
+            parser.kver_key(after) if after is not None else None,
+        )
 
-    return query.all()
+    return query.order_by(KernelTest.kverkey.desc()).all()
 
 
-def getresultsbykernel(session, kernel):
-    """Return test results for the specified kernel version."""
-    query = (
-        session.query(KernelTest)
-        .filter(KernelTest.kver == kernel)
-        .order_by(KernelTest.testid.desc())
-    )
+def getresultsbykernel(
+    session, kernel, limit=None, before=None, after=None, since=None, until=None
+):
+    """Return test results for the specified kernel version, optionally
+    restricted to the tests ran between ``since`` and ``until``.
 
-    return query.all()
+    When ``limit`` is set, return a Page of at most that many results
+    instead, using test identifiers as ``before``/``after`` cursors.
+    """
+    query = session.query(KernelTest).filter(KernelTest.kver == kernel)
+    query = filtertime(query, since, until)
+
+    if limit is not None:
+        return paginate(query, KernelTest.testid, lambda test: test.testid, limit, before, after)
+
+    return query.order_by(KernelTest.testid.desc()).all()
 
 
 def getallkernels(session):
-    """Return all kernels present in the database."""
-    query = session.query(KernelTest).order_by(KernelTest.kver.desc())
+    """Return all kernels present in the database, newest version first."""
+    query = session.query(KernelTest).order_by(KernelTest.kverkey.desc())
 
     return query.all()
 
 
-def getresultsbyrelease(session, release):
-    """Return test results for the specified kernel version."""
+def iterallkernels(session, batch_size=1000):
+    """Iterate over all kernels present in the database, fetching them
+    from the database ``batch_size`` rows at a time instead of loading
+    them all in memory.
+    """
+    query = session.query(KernelTest).order_by(KernelTest.kverkey.desc())
+
+    yield from query.yield_per(batch_size)
+
+
+def getresultsbyrelease(
+    session, release, limit=None, before=None, after=None, since=None, until=None
+):
+    """Return test results for the specified release, optionally
+    restricted to the tests ran between ``since`` and ``until``.
+
+    When ``limit`` is set, return a Page of at most that many results
+    instead, using test identifiers as ``before``/``after`` cursors.
+    """
+    query = session.query(KernelTest).filter(KernelTest.fver == release)
+    query = filtertime(query, since, until)
+
+    if limit is not None:
+        return paginate(query, KernelTest.testid, lambda test: test.testid, limit, before, after)
+
+    return query.order_by(KernelTest.testid.desc()).all()
+
+
+def searchfailures(
+    session,
+    testname,
+    release=None,
+    arch=None,
+    limit=None,
+    before=None,
+    after=None,
+    since=None,
+    until=None,
+):
+    """Return the test results in which the specified test failed, newest
+    first, optionally restricted to a release, an arch and the tests ran
+    between ``since`` and ``until``.
+
+    When ``limit`` is set, return a Page of at most that many results
+    instead, using test identifiers as ``before``/``after`` cursors.
+    """
     query = (
         session.query(KernelTest)
+        .join(FailedTest, FailedTest.testid == KernelTest.testid)
+        .filter(FailedTest.testname == testname)
+    )
+
+    if release is not None:
+        query = query.filter(FailedTest.fver == release)
+    if arch is not None:
+        query = query.filter(FailedTest.testarch == arch)
+    query = filtertime(query, since, until)
+
+    if limit is not None:
+        return paginate(query, FailedTest.testid, lambda test: test.testid, limit, before, after)
+
+    return query.order_by(FailedTest.testid.desc()).all()
+
+
+def getfailurerates(session, release=None, arch=None, limit=None):
+    """Return the tests which failed the most, as (testname, failures, runs)
+    tuples sorted by number of failures, optionally restricted to a release
+    and an arch. ``runs`` is the number of test runs in that scope.
+    """
+    runs = session.query(sa.func.count(KernelTest.testid))
+    query = session.query(FailedTest.testname, sa.func.count(FailedTest.id).label("failures"))
+
+    if release is not None:
+        runs = runs.filter(KernelTest.fver == release)
+        query = query.filter(FailedTest.fver == release)
+    if arch is not None:
+        runs = runs.filter(KernelTest.testarch == arch)
+        query = query.filter(FailedTest.testarch == arch)
+
+    query = query.group_by(FailedTest.testname).order_by(sa.desc("failures"), FailedTest.testname)
+    if limit is not None:
+        query = query.limit(limit)
+
+    query = query.add_columns(runs.scalar_subquery())
+    return [tuple(row) for row in query]
+
+
+def getfailurestart(session, testname, release, arch):
+    """Return the test result in which the specified test started failing
+    for a release and an arch: the oldest failure since the last test run
+    in which it did not fail, or None if its last run did not fail.
+    """
+    failed = (
+        session.query(FailedTest.testid)
+        .filter(FailedTest.testname == testname)
+        .filter(FailedTest.fver == release)
+        .filter(FailedTest.testarch == arch)
+    )
+    last_pass = (
+        session.query(sa.func.coalesce(sa.func.max(KernelTest.testid), 0))
         .filter(KernelTest.fver == release)
-        .order_by(KernelTest.testid.desc())
+        .filter(KernelTest.testarch == arch)
+        .filter(KernelTest.testid.not_in(failed))
+        .scalar_subquery()
     )
+    first_failure = failed.filter(FailedTest.testid > last_pass).with_entities(
+        sa.func.min(FailedTest.testid)
+    )
+    query = session.query(KernelTest).filter(KernelTest.testid == first_failure.scalar_subquery())
 
-    return query.all()
+    return query.first()
+
+
+def getfailureheatmap(session, testname):
+    """Return the number of failures of the specified test and the number
+    of test runs for every release and arch, as a dictionnary of
+    (failures, runs) keyed by (release, arch).
+    """
+    failures = dict(
+        ((fver, arch), count)
+        for fver, arch, count in session.query(
+            FailedTest.fver, FailedTest.testarch, sa.func.count(FailedTest.id)
+        )
+        .filter(FailedTest.testname == testname)
+        .group_by(FailedTest.fver, FailedTest.testarch)
+    )
+    runs = session.query(
+        KernelTest.fver, KernelTest.testarch, sa.func.count(KernelTest.testid)
+    ).group_by(KernelTest.fver, KernelTest.testarch)
+
+    return {(fver, arch): (failures.get((fver, arch), 0), count) for fver, arch, count in runs}
+
+
+def backfill_failedtests(session, batch_size=1000):
+    """Add the FailedTest rows missing for the test results stored in the
+    database, committing every ``batch_size`` test results. Return the
+    number of FailedTest rows added.
+    """
+    added = 0
+    last = 0
+    while True:
+        tests = (
+            session.query(KernelTest)
+            .filter(KernelTest.testid > last)
+            .filter(KernelTest.failedtests.isnot(None))
+            .filter(~sa.exists().where(FailedTest.testid == KernelTest.testid))
+            .order_by(KernelTest.testid)
+            .limit(batch_size)
+            .all()
+        )
+        if not tests:
+            break
+        for test in tests:
+            for testname in parser.split_failedtests(test.failedtests):
+                session.add(
+                    FailedTest(
+                        testid=test.testid,
+                        testname=testname,
+                        fver=test.fver,
+                        testarch=test.testarch,
+                    )
+                )
+                added += 1
+        last = tests[-1].testid
+        session.commit()
+    return added
 
 
 def getreleasebykernel(session, kernel=None):
@@ -168,43 +661,84 @@ def getreleasebykernel(session, kernel=None):
     query = (
         session.query(sa.func.distinct(KernelTest.fver), KernelTest.kver)
         .filter(KernelTest.kver == kernel)
-        .order_by(KernelTest.kver.desc())
+        .order_by(KernelTest.fver.desc())
+    )
+
+    return query.all()
+
+
+def getoutbox(session, limit):
+    """Return the oldest messages waiting in the outbox, locking them so
+    concurrent dispatchers skip them.
+    """
+    query = (
+        session.query(OutboxMessage)
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
     )
 
     return query.all()
 
 
+def getdataversion(session):
+    """Return a value changing whenever test results are uploaded or a
+    release is added or edited: the highest test identifier and the
+    number and support status of every release.
+    """
+    maxid = session.query(sa.func.max(KernelTest.testid)).scalar()
+    releases = session.query(Release.releasenum, Release.support).order_by(Release.releasenum)
+
+    return (maxid, tuple(tuple(release) for release in releases))
+
+
 def get_stats(session):
     """Return a dictionnary containing statistics about the data in the
     database.
+
+    All the numbers are computed by the database using aggregate queries,
+    so this function issues a fixed number of queries whatever the number
+    of releases, kernels or tests stored.
     """
     output = {}
 
-    output["arches"] = [arch[0] for arch in getarches(session)]
-    output["kernels"] = set([rel[0] for rel in getkernelsbyrelease(session)])
-    output["n_test"] = session.query(KernelTest).count()
+    n_test, n_kernels, n_arches = session.query(
+        sa.func.count(KernelTest.testid),
+        sa.func.count(sa.distinct(KernelTest.kver)),
+        sa.func.count(sa.distinct(KernelTest.testarch)),
+    ).one()
+    output["n_test"] = n_test
+    output["n_kernels"] = n_kernels
+    output["n_arches"] = n_arches
 
     # Tests per release
-    releases = session.query(Release).all()
-    rel_stats = {}
-    for release in releases:
-        tmp = {}
-        tmp["kernels"] = getkernelsbyrelease(session, release.releasenum)
-        tmp["tests"] = getresultsbyrelease(session, release.releasenum)
-        tmp["arches"] = set([test.testarch for test in tmp["tests"]])
-        tmp["testers"] = set([test.tester for test in tmp["tests"]])
-        rel_stats[release.releasenum] = tmp
-    output["rel_stats"] = rel_stats
+    query = (
+        session.query(
+            Release.releasenum,
+            sa.func.count(sa.distinct(KernelTest.kver)),
+            sa.func.count(KernelTest.testid),
+            sa.func.count(sa.distinct(KernelTest.testarch)),
+            sa.func.count(sa.distinct(KernelTest.tester)),
+        )
+        .outerjoin(KernelTest, KernelTest.fver == Release.releasenum)
+        .group_by(Release.releasenum)
+    )
+    output["rel_stats"] = {
+        releasenum: dict(kernels=kernels, tests=tests, arches=arches, testers=testers)
+        for releasenum, kernels, tests, arches, testers in query
+    }
 
     # Tests per kernel
-    ker_stats = {}
-    for kernel in output["kernels"]:
-        tmp = {}
-        tmp["releases"] = getreleasebykernel(session, kernel)
-        tmp["tests"] = getresultsbykernel(session, kernel)
-        tmp["arches"] = set([test.testarch for test in tmp["tests"]])
-        tmp["testers"] = set([test.tester for test in tmp["tests"]])
-        ker_stats[kernel] = tmp
-    output["ker_stats"] = ker_stats
+    query = session.query(
+        KernelTest.kver,
+        sa.func.count(sa.distinct(KernelTest.fver)),
+        sa.func.count(KernelTest.testid),
+        sa.func.count(sa.distinct(KernelTest.testarch)),
+        sa.func.count(sa.distinct(KernelTest.tester)),
+    ).group_by(KernelTest.kver)
+    output["ker_stats"] = {
+        kver: dict(releases=releases, tests=tests, arches=arches, testers=testers)
+        for kver, releases, tests, arches, testers in query
+    }
 
     return output
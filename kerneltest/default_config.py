@@ -6,12 +6,89 @@ SECRET_KEY = "<change me before using me in prod>"
 # URL used to connect to the database
 DB_URL = "sqlite:////var/tmp/kernel-test_dev.sqlite"
 
+# Connection pool of each worker process: number of connections kept open,
+# number of extra connections opened under load and number of seconds to
+# wait for a connection before failing the request. Size the pool so that
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) fits in the connection limit of
+# the database server, the waits are logged and counted by
+# kerneltest.dbtools.pool_status
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30
+# Number of seconds after which connections are replaced
+DB_POOL_RECYCLE = 3600
+# Check that connections are still alive before using them
+DB_POOL_PRE_PING = True
+# Number of seconds after which PostgreSQL cancels a query, None to disable
+DB_STATEMENT_TIMEOUT = None
+
+# Number of seconds the list of active releases is cached by each worker
+# process, releases edited through the admin pages are refreshed right away
+# in the process handling the edit
+RELEASE_CACHE_TTL = 300
+
+# Where the pages rendered for anonymous users are cached: "memory" for a
+# cache in each worker process, "sqlite:///<path>" for a cache shared by the
+# worker processes of a host, None to disable it. Pages are dropped when
+# results are uploaded or releases edited, and at the latest after
+# PAGE_CACHE_TTL seconds. Past PAGE_CACHE_MAX_PAGES pages, the oldest ones
+# are dropped
+PAGE_CACHE = "memory"
+PAGE_CACHE_TTL = 300
+PAGE_CACHE_MAX_PAGES = 1000
+
+# Report the time spent by each request in the database, rendering
+# templates, saving logs and queuing messages in a Server-Timing header
+SERVER_TIMING = True
+# Expose the request metrics of each worker process in the Prometheus text
+# format on /metrics
+METRICS = True
+
+# Check the number of SQL queries issued by each view against its budget:
+# "log" to log the views exceeding it along with the statements they
+# repeated, likely N+1 patterns, "raise" to fail them (in the tests), None
+# to only log them in debug mode
+QUERY_BUDGET = None
+
+# Number of kernels or test results displayed per page
+PAGE_SIZE = 100
+
 # Specify where the logs of the tests should be stored
 LOG_DIR = "logs"
 
+# Number of seconds clients may cache the logs, which never change
+LOGS_MAX_AGE = 365 * 24 * 3600
+
+# Let the web server send the log files instead of the application, either
+# with X-Sendfile (for Apache's mod_xsendfile or lighttpd) by setting
+# USE_X_SENDFILE to True, or with X-Accel-Redirect (for nginx) by setting
+# LOGS_X_ACCEL_REDIRECT to the internal location serving LOG_DIR. nginx
+# drops the Content-Encoding of the application on the redirect, so that
+# location has to send the compressed logs with gzip_static:
+#
+#     location /protected-logs/ {
+#         internal;
+#         alias /path/to/LOG_DIR/;
+#         default_type text/plain;
+#         gzip_static always;
+#         gzip_vary on;
+#     }
+USE_X_SENDFILE = False
+LOGS_X_ACCEL_REDIRECT = None
+
 # API key used to authenticate the autotest client, should be private as well
 API_KEY = "This is a secret only the cli knows about"
 
+# Messages sent to the message bus are stored in the outbox table along with
+# the changes they announce, then published by a background thread of each
+# worker process. Set OUTBOX_DISPATCHER to False when running the
+# `flask dispatch-outbox` command instead.
+OUTBOX_DISPATCHER = True
+# Number of seconds between two checks of the outbox by the dispatcher
+OUTBOX_INTERVAL = 10
+# Number of messages published per transaction
+OUTBOX_BATCH_SIZE = 100
+
 # Email of the admin that should receive the error emails
 MAIL_ADMIN = None
 
@@ -22,9 +99,20 @@ ADMIN_GROUP = ["sysadmin-kernel", "sysadmin-main"]
 # List of MIME types allowed for upload in the application
 ALLOWED_MIMETYPES = ["text/plain"]
 
+# Stop looking for the header of the uploaded result files after reading
+# that many bytes or lines
+PARSE_MAX_BYTES = 16384
+PARSE_MAX_LINES = 100
+
 # Restrict the size of content uploaded, this is 25Kb
 MAX_CONTENT_LENGTH = 1024 * 25
 
+# Restrict the size of the requests uploading many results at once, each
+# result file being still limited to MAX_CONTENT_LENGTH, and the number of
+# result files they hold
+BATCH_MAX_CONTENT_LENGTH = 1024 * 1024 * 25
+BATCH_MAX_ITEMS = 1000
+
 # obviously, this needs to be changed for deployments
 OIDC_CLIENT_SECRETS = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "../tests", "client_secrets.json"
@@ -0,0 +1,108 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""Storage of the logs of the test runs.
+
+The logs are gzip-compressed and spread over two levels of subdirectories
+named after the hash of the test identifier, so that no single directory
+holds all of them: ``<logdir>/ab/cd/<testid>.log.gz``.
+
+Logs uploaded before the introduction of this store are kept flat as
+``<logdir>/<testid>.log`` until ``migrate`` is run.
+"""
+
+import concurrent.futures
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import struct
+import tempfile
+
+LEGACY_NAME = re.compile(r"(\d+)\.log")
+CHUNK_SIZE = 64 * 1024
+
+# Mode of the logs stored, the one open() would give them: mkstemp creates
+# files only readable by their owner, which the web server may not be
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+LOG_MODE = 0o666 & ~_UMASK
+
+
+def log_path(logdir, testid):
+    """Return the path of the compressed log of the specified test."""
+    digest = hashlib.sha1(str(testid).encode()).hexdigest()
+    return os.path.join(logdir, digest[:2], digest[2:4], f"{testid}.log.gz")
+
+
+def legacy_path(logdir, testid):
+    """Return the path the log of the specified test had before the store."""
+    return os.path.join(logdir, f"{testid}.log")
+
+
+def save(logdir, testid, stream, compresslevel=6):
+    """Compress the log read from ``stream`` into the store and return its
+    path. The file is written under a temporary name and then renamed, so
+    readers never see a partial log.
+    """
+    path = log_path(logdir, testid)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmppath = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        os.fchmod(fd, LOG_MODE)
+        with os.fdopen(fd, "wb") as raw:
+            with gzip.GzipFile(
+                filename="", mode="wb", fileobj=raw, compresslevel=compresslevel, mtime=0
+            ) as compressed:
+                shutil.copyfileobj(stream, compressed, CHUNK_SIZE)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+    return path
+
+
+def iter_decompressed(path):
+    """Yield the decompressed content of the log at ``path`` by chunks."""
+    with gzip.open(path, "rb") as stream:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def decompressed_size(path):
+    """Return the size of the decompressed log at ``path``, as recorded at
+    the end of the gzip file.
+    """
+    with open(path, "rb") as stream:
+        stream.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", stream.read(4))[0]
+
+
+def migrate_log(logdir, filename):
+    """Move the flat log ``filename`` of ``logdir`` into the store."""
+    testid = LEGACY_NAME.fullmatch(filename).group(1)
+    path = os.path.join(logdir, filename)
+    with open(path, "rb") as stream:
+        save(logdir, testid, stream)
+    os.unlink(path)
+
+
+def migrate(logdir, jobs=None):
+    """Move all the flat logs of ``logdir`` into the store, using ``jobs``
+    processes. Return the number of logs migrated.
+    """
+    filenames = [
+        entry.name
+        for entry in os.scandir(logdir)
+        if entry.is_file() and LEGACY_NAME.fullmatch(entry.name)
+    ]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(migrate_log, logdir, filename) for filename in filenames]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    return len(filenames)
@@ -1,6 +1,23 @@
+import json
+import logging
+import threading
+import time
+
 import backoff
+from fedora_messaging import message as fm_message
 from fedora_messaging.api import publish as fm_publish
-from fedora_messaging.exceptions import ConnectionException, PublishTimeout
+from fedora_messaging.exceptions import (
+    ConnectionException,
+    PublishForbidden,
+    PublishReturned,
+    PublishTimeout,
+    ValidationError,
+)
+
+import kerneltest.dbtools as dbtools
+import kerneltest.metrics as metrics
+
+_log = logging.getLogger(__name__)
 
 
 @backoff.on_exception(
@@ -10,3 +27,85 @@ from fedora_messaging.exceptions import ConnectionException, PublishTimeout
 )
 def publish(msg):
     fm_publish(msg)
+
+
+def enqueue(session, msg):
+    """Add the message to the outbox of the session's transaction, it will
+    be published by the dispatcher once the transaction is committed.
+    """
+    entry = dbtools.OutboxMessage(
+        schema=fm_message.get_name(msg.__class__),
+        topic=msg.topic,
+        body=json.dumps(msg.body),
+    )
+    session.add(entry)
+    return entry
+
+
+def dispatch(session, batch_size=100):
+    """Publish the oldest messages waiting in the outbox and remove them
+    from it. Return the number of messages published.
+
+    Messages which can never be published, being invalid or refused by the
+    broker, are logged and removed so they do not hold up the next ones.
+    """
+    published = 0
+    try:
+        for entry in dbtools.getoutbox(session, batch_size):
+            try:
+                msg_class = fm_message.get_class(entry.schema)
+                msg = msg_class(body=json.loads(entry.body), topic=entry.topic)
+                start = time.perf_counter()
+                publish(msg)
+                metrics.PUBLISH_SECONDS.observe(time.perf_counter() - start)
+            except (ConnectionException, PublishTimeout) as err:
+                _log.warning("Could not publish message %s: %s", entry.id, err)
+                break
+            except (PublishForbidden, PublishReturned, ValidationError, ValueError) as err:
+                _log.error(
+                    "Dropping message %s on %s, it cannot be published: %s\n%s",
+                    entry.id,
+                    entry.topic,
+                    err,
+                    entry.body,
+                )
+                session.delete(entry)
+                continue
+            session.delete(entry)
+            published += 1
+    finally:
+        session.commit()
+    return published
+
+
+class Dispatcher(threading.Thread):
+    """Background thread publishing the messages of the outbox.
+
+    It drains the outbox whenever it is woken up and every ``interval``
+    seconds, so messages left behind by other processes or by a broker
+    outage are eventually published.
+    """
+
+    def __init__(self, session, interval=10, batch_size=100):
+        super().__init__(name="kerneltest-outbox", daemon=True)
+        self.session = session
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+
+    def wake(self):
+        """Let the dispatcher know new messages are waiting."""
+        self._wakeup.set()
+
+    def run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                while dispatch(self.session, self.batch_size) == self.batch_size:
+                    pass
+            except Exception:
+                _log.exception("Could not dispatch the messages of the outbox")
+                self.session.rollback()
+            finally:
+                self.session.remove()
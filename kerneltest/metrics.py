@@ -0,0 +1,309 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""Timing of the requests and metrics in the Prometheus text format.
+
+The metrics are kept by each process: with several workers, each of them
+reports what it handled.
+"""
+
+import bisect
+import collections
+import contextlib
+import functools
+import logging
+import re
+import threading
+import time
+
+import flask
+import sqlalchemy as sa
+
+_log = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# All the metrics, in the order they are exposed
+REGISTRY = []
+
+
+def format_value(value):
+    """Return a number as written in the Prometheus text format."""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    """Return the labels of a sample as written in the Prometheus text format."""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """Counter metric, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = collections.defaultdict(float)
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        """Increment the counter of the given label values."""
+        with self._lock:
+            self._values[labels] += amount
+
+    def samples(self):
+        """Yield the (name, labels, value) of the samples of the metric."""
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, list(zip(self.labelnames, labels)), value
+
+    def clear(self):
+        """Reset the metric."""
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(Counter):
+    """Histogram metric, optionally split by labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """Record a value for the given label values."""
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # One count per bucket, then the +Inf count and the sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        """Yield the (name, labels, value) of the samples of the metric."""
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        for labels, counts in values:
+            labels = list(zip(self.labelnames, labels))
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                yield f"{self.name}_bucket", labels + [("le", format_value(bound))], total
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, total
+
+
+def exposition(extra=()):
+    """Return all the metrics in the Prometheus text format, followed by
+    the ``extra`` (name, documentation, kind, value) samples.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+    for name, documentation, kind, value in extra:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter(
+    "kerneltest_requests_total", "Requests handled.", ["endpoint", "method", "status"]
+)
+REQUEST_SECONDS = Histogram(
+    "kerneltest_request_duration_seconds", "Time spent handling requests.", ["endpoint"]
+)
+REQUEST_PHASE_SECONDS = Histogram(
+    "kerneltest_request_phase_duration_seconds",
+    "Time spent by requests in the database, rendering templates, saving logs and"
+    " queuing messages.",
+    ["endpoint", "phase"],
+)
+REQUEST_QUERIES = Histogram(
+    "kerneltest_request_queries", "SQL queries issued per request.", ["endpoint"], QUERIES_BUCKETS
+)
+PUBLISH_SECONDS = Histogram(
+    "kerneltest_publish_duration_seconds", "Time spent publishing messages from the outbox."
+)
+
+
+class RequestTimings:
+    """Time spent by a request in each of its phases and number of SQL
+    queries it issued.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = collections.OrderedDict()
+        self.queries = 0
+
+    def add(self, phase, seconds):
+        """Add time spent in a phase."""
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def elapsed(self):
+        """Return the time elapsed since the start of the request."""
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """Return the value of the Server-Timing header of the request."""
+        metrics = []
+        for phase, seconds in self.phases.items():
+            metric = f"{phase};dur={seconds * 1000:.3f}"
+            if phase == "db":
+                metric += f';desc="{self.queries} queries"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={self.elapsed() * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+def current():
+    """Return the RequestTimings of the request being handled, if any."""
+    if not flask.has_request_context():
+        return None
+    return flask.g.get("timings")
+
+
+@contextlib.contextmanager
+def timed(phase):
+    """Context manager adding the time spent in its block to a phase of
+    the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current()
+        if timings is not None:
+            timings.add(phase, time.perf_counter() - start)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a block issues more SQL queries than its budget."""
+
+
+# Budgets active in each thread
+_budgets = threading.local()
+
+
+def statement_shape(statement):
+    """Return the SQL statement with its whitespace and its lists of
+    parameters collapsed, so the same query with different parameters has
+    the same shape.
+    """
+    statement = " ".join(statement.split())
+    return re.sub(r"\(\?(?:, \?)+\)|\(%\(\w+\)s(?:, %\(\w+\)s)+\)", "(...)", statement)
+
+
+class QueryBudget:
+    """Context manager and decorator checking that its block issues at most
+    ``limit`` SQL queries.
+
+    When the budget is exceeded, the shapes of the statements issued more
+    than once, likely N+1 patterns, are reported and QueryBudgetExceeded
+    is raised if ``strict``, otherwise the report is logged as an error.
+    """
+
+    def __init__(self, limit, name=None, strict=False):
+        self.limit = limit
+        self.name = name
+        self.strict = strict
+        self.statements = []
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def decorated(*args, **kwargs):
+            name = self.name or function.__qualname__
+            with QueryBudget(self.limit, name, self.strict):
+                return function(*args, **kwargs)
+
+        return decorated
+
+    def __enter__(self):
+        instrument_engines()
+        self.statements = []
+        if not hasattr(_budgets, "stack"):
+            _budgets.stack = []
+        _budgets.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _budgets.stack.remove(self)
+        if exc_type is None and len(self.statements) > self.limit:
+            report = self.report()
+            if self.strict:
+                raise QueryBudgetExceeded(report)
+            _log.error(report)
+        return False
+
+    def repeated(self):
+        """Return the (shape, count) of the statements issued more than
+        once, the most repeated first.
+        """
+        counts = collections.Counter(statement_shape(s) for s in self.statements)
+        return [(shape, count) for shape, count in counts.most_common() if count > 1]
+
+    def report(self):
+        """Return the description of the queries issued by the block."""
+        name = self.name or "Block"
+        lines = [f"{name} issued {len(self.statements)} SQL queries, budget is {self.limit}"]
+        for shape, count in self.repeated():
+            lines.append(f"  likely N+1, issued {count} times: {shape}")
+        return "\n".join(lines)
+
+
+def allow_queries(count):
+    """Raise the budgets active in this thread by ``count`` queries, for work
+    which grows with the input of a request.
+    """
+    for budget in getattr(_budgets, "stack", ()):
+        budget.limit += count
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("kerneltest_query_start", []).append(time.perf_counter())
+    for budget in getattr(_budgets, "stack", ()):
+        budget.statements.append(statement)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("kerneltest_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    timings = current()
+    if timings is not None:
+        timings.add("db", elapsed)
+        timings.queries += 1
+
+
+def instrument_engines():
+    """Time the SQL queries of all the engines for the current request, and
+    count them for the active query budgets.
+    """
+    for name, function in [
+        ("before_cursor_execute", _before_cursor_execute),
+        ("after_cursor_execute", _after_cursor_execute),
+    ]:
+        if not sa.event.contains(sa.engine.Engine, name, function):
+            sa.event.listen(sa.engine.Engine, name, function)
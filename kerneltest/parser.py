@@ -0,0 +1,179 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+import collections
+import datetime
+import email.utils
+import re
+
+# Header of a test result file
+TestResult = collections.namedtuple(
+    "TestResult", ["testdate", "testset", "kver", "testrel", "testresult", "failedtests"]
+)
+
+# Name of the header lines and the TestResult field they fill
+FIELDS = {
+    b"Date": "testdate",
+    b"Test set": "testset",
+    b"Kernel": "kver",
+    b"Release": "testrel",
+    b"Result": "testresult",
+    b"Failed Tests": "failedtests",
+}
+
+SEPARATOR = b"========"
+
+# Components of a kernel version such as 6.8.9-300.fc40.x86_64
+KernelVersion = collections.namedtuple(
+    "KernelVersion", ["major", "minor", "patch", "build", "dist", "fver", "arch"]
+)
+
+# UTC offsets, in hours, of the time zone abbreviations found in the output
+# of date(1) on the test machines
+TIMEZONES = {
+    "UTC": 0,
+    "GMT": 0,
+    "WET": 0,
+    "BST": 1,
+    "WEST": 1,
+    "CET": 1,
+    "CEST": 2,
+    "EET": 2,
+    "EEST": 3,
+    "MSK": 3,
+    "IST": 5.5,
+    "CST": -6,
+    "CDT": -5,
+    "EST": -5,
+    "EDT": -4,
+    "MST": -7,
+    "MDT": -6,
+    "PST": -8,
+    "PDT": -7,
+    "AKST": -9,
+    "AKDT": -8,
+    "HST": -10,
+    "JST": 9,
+    "KST": 9,
+    "AEST": 10,
+    "AEDT": 11,
+}
+
+KVER_RE = re.compile(
+    r"(?P<major>\d+)\.(?P<minor>\d+)(?:\.(?P<patch>\d+))?"
+    r"-(?P<build>.+)\.(?P<dist>fc(?P<fver>\d+))\.(?P<arch>[^.]+)(?P<pae>\.PAE)?"
+)
+
+
+def parse_header(log, max_bytes=16384, max_lines=100):
+    """Parse the header of a test result file.
+
+    The file is read line by line, as bytes, until all the header fields
+    have been found, the ``========`` separator is reached or more than
+    ``max_bytes`` bytes or ``max_lines`` lines have been read, whichever
+    comes first. Fields missing from the header are None.
+
+    :arg log: a binary file-like object providing ``readline``.
+    :return a TestResult.
+    :raise UnicodeDecodeError: if a header field is not valid UTF-8.
+    """
+    found = {}
+    remaining = max_bytes
+    for _ in range(max_lines):
+        line = log.readline(remaining)
+        if not line:
+            break
+        remaining -= len(line)
+        if not remaining and not line.endswith(b"\n"):
+            # Truncated by the budget
+            break
+
+        name, sep, value = line.partition(b": ")
+        field = FIELDS.get(name) if sep else None
+        if field is not None:
+            found.setdefault(field, value.rstrip(b"\r\n").decode("utf-8"))
+            if len(found) == len(FIELDS):
+                break
+        elif line.startswith(SEPARATOR):
+            break
+
+    return TestResult(**{field: found.get(field) for field in TestResult._fields})
+
+
+def split_failedtests(failedtests):
+    """Return the names of the tests listed in a ``Failed Tests`` field,
+    without duplicates.
+    """
+    if not failedtests:
+        return []
+    return list(dict.fromkeys(failedtests.replace(",", " ").split()))
+
+
+def parse_kver(kver):
+    """Return the KernelVersion of a kernel version string.
+
+    Kernels of Fedora 19 and older built for i686 with PAE enabled have
+    an extra ``.PAE`` suffix, their arch is ``i686+PAE``.
+
+    :raise ValueError: if ``kver`` is not a Fedora kernel version.
+    """
+    match = KVER_RE.fullmatch(kver)
+    if match is None:
+        raise ValueError(f"Invalid kernel version: {kver}")
+
+    arch = match["arch"]
+    if match["pae"]:
+        arch = f"{arch}+PAE"
+    return KernelVersion(
+        major=int(match["major"]),
+        minor=int(match["minor"]),
+        patch=int(match["patch"] or 0),
+        build=match["build"],
+        dist=match["dist"],
+        fver=int(match["fver"]),
+        arch=arch,
+    )
+
+
+def kver_key(kver):
+    """Return a string sorting kernel versions in version order, the
+    numbers they contain being compared as numbers: 6.10 is after 6.9 and
+    the 0.rc3 builds are before the 300 ones.
+    """
+    return re.sub(r"\d+", lambda match: match[0].zfill(10), kver)
+
+
+def parse_testdate(testdate):
+    """Return the date of a ``Date`` header field as a naive datetime in
+    UTC, or None if it cannot be parsed.
+
+    The field usually holds the output of date(1), such as
+    ``Thu Apr 24 11:48:35 CDT 2014``, RFC 2822 and ISO 8601 dates are
+    accepted as well. Dates without a known time zone are taken as UTC.
+    """
+    if not testdate:
+        return None
+    testdate = " ".join(testdate.split())
+
+    # Weekday, month, day, time, time zone and year, as date(1) writes them
+    parts = testdate.split(" ")
+    if len(parts) == 6:
+        try:
+            value = datetime.datetime.strptime(
+                " ".join(parts[:4] + parts[5:]), "%a %b %d %H:%M:%S %Y"
+            )
+        except ValueError:
+            pass
+        else:
+            return value - datetime.timedelta(hours=TIMEZONES.get(parts[4].upper(), 0))
+
+    try:
+        value = email.utils.parsedate_to_datetime(testdate)
+    except (TypeError, ValueError):
+        try:
+            value = datetime.datetime.fromisoformat(testdate)
+        except ValueError:
+            return None
+
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
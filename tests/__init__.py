@@ -14,6 +14,8 @@ from contextlib import contextmanager
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
+import sqlalchemy as sa
+
 import kerneltest.dbtools as dbtools
 
 # DB_PATH = 'sqlite:///:memory:'
@@ -64,6 +66,22 @@ def user_set(client, user):
     yield
 
 
+@contextmanager
+def count_queries(session):
+    """Record the SQL statements sent to the database of the given session."""
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        queries.append((statement, parameters))
+
+    engine = session.get_bind()
+    sa.event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield queries
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", record)
+
+
 def message_result(
     tester=None,
     testdate="Thu Apr 24 11:48:35 CDT 2014",
@@ -6,20 +6,28 @@ kerneltest tests.
 
 __requires__ = ["SQLAlchemy >= 0.7"]
 
+import gzip
+import io
 import json
 import os
+import shutil
 import sys
+import tarfile
+import tempfile
 import unittest
+import zipfile
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
 from pathlib import Path
+from unittest.mock import patch
 
 from fedora_messaging import testing as fml_testing
+from fedora_messaging.exceptions import ConnectionException, PublishForbidden
 from kerneltest_messages import ReleaseEditV1, ReleaseNewV1, UploadNewV1
 
 import kerneltest.app as app
-from tests import FakeFasUser, Modeltests, message_result, user_set
+from tests import FakeFasUser, Modeltests, count_queries, message_result, user_set
 
 
 class KerneltestTests(Modeltests):
@@ -32,6 +40,12 @@ class KerneltestTests(Modeltests):
         app.APP.config["TESTING"] = True
         app.APP.config["ALLOWED_MIMETYPES"] = ["application/octet-stream", "text/plain"]
         app.SESSION = self.session
+        app.APP.config["OUTBOX_DISPATCHER"] = False
+        app.APP.config["QUERY_BUDGET"] = "raise"
+        app.RELEASES.invalidate()
+        app.PAGES.clear()
+        for metric in app.metrics.REGISTRY:
+            metric.clear()
         self.app = app.APP.test_client()
 
     def test_upload_results_loggedin(self):
@@ -60,8 +74,9 @@ class KerneltestTests(Modeltests):
                 "username": "pingou",
                 "csrf_token": csrf_token,
             }
+            output = self.app.post("/upload/", data=data, follow_redirects=True)
             with fml_testing.mock_sends(UploadNewV1(message_result(tester="pingou"))):
-                output = self.app.post("/upload/", data=data, follow_redirects=True)
+                app.messaging.dispatch(self.session)
             self.assertEqual(output.status_code, 200)
             self.assertTrue(b'<li class="message">Upload successful!</li>' in output.data)
 
@@ -222,8 +237,9 @@ class KerneltestTests(Modeltests):
             "username": "kerneltest",
             "api_token": "api token for the tests",
         }
+        output = self.app.post("/upload/autotest", data=data)
         with fml_testing.mock_sends(UploadNewV1(message_result(tester="kerneltest"))):
-            output = self.app.post("/upload/autotest", data=data)
+            app.messaging.dispatch(self.session)
 
         self.assertEqual(output.status_code, 200)
         data = json.loads(output.data)
@@ -237,6 +253,7 @@ class KerneltestTests(Modeltests):
             "username": "kerneltest",
             "api_token": "api token for the tests",
         }
+        output = self.app.post("/upload/autotest", data=data)
         with fml_testing.mock_sends(
             UploadNewV1(
                 message_result(
@@ -246,7 +263,7 @@ class KerneltestTests(Modeltests):
                 )
             )
         ):
-            output = self.app.post("/upload/autotest", data=data)
+            app.messaging.dispatch(self.session)
         self.assertEqual(output.status_code, 200)
         data = json.loads(output.data)
         exp = {"message": "Upload successful!"}
@@ -265,6 +282,178 @@ class KerneltestTests(Modeltests):
         exp = {"error": "Invalid input file"}
         self.assertEqual(data, exp)
 
+    def test_upload_outbox(self):
+        """Test that uploads queue their message instead of publishing it."""
+        folder = Path(__file__).parent
+        app.APP.config["API_KEY"] = "api token for the tests"
+
+        data = {
+            "test_result": (folder / "3.log").open("rb"),
+            "api_token": "api token for the tests",
+        }
+        with fml_testing.mock_sends():
+            output = self.app.post("/upload/autotest", data=data)
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(self.session.query(app.dbtools.OutboxMessage).count(), 1)
+
+        # The broker is down, the message stays in the outbox
+        with patch("kerneltest.messaging.fm_publish", side_effect=ConnectionException()):
+            with patch("time.sleep"):
+                self.assertEqual(app.messaging.dispatch(self.session), 0)
+        self.assertEqual(self.session.query(app.dbtools.OutboxMessage).count(), 1)
+
+        with fml_testing.mock_sends(UploadNewV1(message_result(tester="kerneltest"))):
+            self.assertEqual(app.messaging.dispatch(self.session), 1)
+        self.assertEqual(self.session.query(app.dbtools.OutboxMessage).count(), 0)
+
+        with fml_testing.mock_sends():
+            self.assertEqual(app.messaging.dispatch(self.session), 0)
+
+        # A message the broker refuses does not hold up the next ones
+        for _ in range(2):
+            data = {
+                "test_result": (folder / "3.log").open("rb"),
+                "api_token": "api token for the tests",
+            }
+            output = self.app.post("/upload/autotest", data=data)
+            self.assertEqual(output.status_code, 200)
+        with patch(
+            "kerneltest.messaging.fm_publish", side_effect=[PublishForbidden("denied"), None]
+        ) as fm_publish:
+            with self.assertLogs("kerneltest.messaging", "ERROR"):
+                self.assertEqual(app.messaging.dispatch(self.session), 1)
+        self.assertEqual(fm_publish.call_count, 2)
+        self.assertEqual(self.session.query(app.dbtools.OutboxMessage).count(), 0)
+
+        # Standalone dispatcher
+        data = {
+            "test_result": (folder / "3.log").open("rb"),
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest", data=data)
+        self.assertEqual(output.status_code, 200)
+        runner = app.APP.test_cli_runner()
+        with fml_testing.mock_sends(UploadNewV1):
+            result = runner.invoke(args=["dispatch-outbox", "--once"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(self.session.query(app.dbtools.OutboxMessage).count(), 0)
+
+    def test_upload_autotest_batch(self):
+        """Test uploading many results at once for the autotest user."""
+        folder = Path(__file__).parent
+        app.APP.config["API_KEY"] = "api token for the tests"
+
+        # Invalid api_token
+        data = {
+            "test_result": [(folder / "1.log").open("rb")],
+            "api_token": "foobar",
+        }
+        output = self.app.post("/upload/autotest/batch", data=data)
+        self.assertEqual(output.status_code, 401)
+
+        # No file
+        data = {"api_token": "api token for the tests"}
+        output = self.app.post("/upload/autotest/batch", data=data)
+        self.assertEqual(output.status_code, 400)
+        self.assertEqual(json.loads(output.data), {"error": "No result file provided"})
+
+        # Several files in the same request
+        data = {
+            "test_result": [
+                ((folder / "1.log").open("rb"), "1.log"),
+                ((folder / "invalid.log").open("rb"), "invalid.log"),
+                ((folder / "2.log").open("rb"), "2.log"),
+            ],
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest/batch", data=data)
+        with fml_testing.mock_sends(UploadNewV1, UploadNewV1):
+            app.messaging.dispatch(self.session)
+        self.assertEqual(output.status_code, 200)
+        exp = {
+            "results": [
+                {"filename": "1.log", "message": "Upload successful!", "testid": 1},
+                {"filename": "invalid.log", "error": "Invalid input file"},
+                {"filename": "2.log", "message": "Upload successful!", "testid": 2},
+            ]
+        }
+        self.assertEqual(json.loads(output.data), exp)
+
+        # A tar archive
+        tarred = io.BytesIO()
+        with tarfile.open(fileobj=tarred, mode="w:gz") as archive:
+            archive.add(folder / "3.log", arcname="results/3.log")
+            archive.add(folder / "4.log", arcname="results/4.log")
+        tarred.seek(0)
+        data = {
+            "archive": (tarred, "results.tar.gz"),
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest/batch", data=data)
+        with fml_testing.mock_sends(UploadNewV1, UploadNewV1):
+            app.messaging.dispatch(self.session)
+        self.assertEqual(output.status_code, 200)
+        exp = {
+            "results": [
+                {"filename": "results/3.log", "message": "Upload successful!", "testid": 3},
+                {"filename": "results/4.log", "message": "Upload successful!", "testid": 4},
+            ]
+        }
+        self.assertEqual(json.loads(output.data), exp)
+
+        # A zip archive with a file too large
+        zipped = io.BytesIO()
+        with zipfile.ZipFile(zipped, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.write(folder / "1.log", arcname="1.log")
+            archive.writestr("big.log", "x" * (app.APP.config["MAX_CONTENT_LENGTH"] + 1))
+        zipped.seek(0)
+        data = {
+            "archive": (zipped, "results.zip"),
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest/batch", data=data)
+        with fml_testing.mock_sends(UploadNewV1):
+            app.messaging.dispatch(self.session)
+        self.assertEqual(output.status_code, 200)
+        exp = {
+            "results": [
+                {"filename": "1.log", "message": "Upload successful!", "testid": 5},
+                {"filename": "big.log", "error": "File too large"},
+            ]
+        }
+        self.assertEqual(json.loads(output.data), exp)
+
+        # Not an archive
+        data = {
+            "archive": ((folder / "denied.png").open("rb"), "results.tar"),
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest/batch", data=data)
+        self.assertEqual(output.status_code, 400)
+        self.assertEqual(json.loads(output.data), {"error": "Invalid archive"})
+
+        # Too many files, the ones read before are not kept
+        tarred = io.BytesIO()
+        with tarfile.open(fileobj=tarred, mode="w:gz") as archive:
+            archive.add(folder / "3.log", arcname="results/3.log")
+            archive.add(folder / "4.log", arcname="results/4.log")
+        tarred.seek(0)
+        data = {
+            "test_result": [((folder / "1.log").open("rb"), "1.log")],
+            "archive": (tarred, "results.tar.gz"),
+            "api_token": "api token for the tests",
+        }
+        app.APP.config["BATCH_MAX_ITEMS"] = 2
+        try:
+            output = self.app.post("/upload/autotest/batch", data=data)
+        finally:
+            app.APP.config["BATCH_MAX_ITEMS"] = 1000
+        self.assertEqual(output.status_code, 413)
+        self.assertEqual(json.loads(output.data), {"error": "At most 2 result files per batch"})
+        self.assertEqual(self.session.query(app.dbtools.KernelTest).count(), 5)
+        self.assertEqual(self.session.query(app.dbtools.OutboxMessage).count(), 0)
+        self.assertFalse(os.path.exists(app.logstore.log_path("logs", 6)))
+
     def test_stats(self):
         """Test the stats method."""
         self.test_upload_results_autotest()
@@ -303,6 +492,13 @@ class KerneltestTests(Modeltests):
         self.assertTrue(b"<a href='/kernel/3.14.1-200.fc20.x86_64'>" in output.data)
         self.assertTrue(b"<h1>Kernels Tested for Fedora </h1>" in output.data)
 
+        output = self.app.get("/release/20?version=3.14")
+        self.assertTrue(b"<a href='/kernel/3.14.1-200.fc20.x86_64'>" in output.data)
+        output = self.app.get("/release/20?version=3.15")
+        self.assertFalse(b"<a href='/kernel/3.14.1-200.fc20.x86_64'>" in output.data)
+        output = self.app.get("/release/20?version=latest")
+        self.assertEqual(output.status_code, 400)
+
     def test_kernel(self):
         """Test the kernel method."""
         self.test_upload_results_autotest()
@@ -317,6 +513,268 @@ class KerneltestTests(Modeltests):
         self.assertTrue(b"<a href='/logs/3'>" in output.data)
         self.assertTrue(b"<a href='/logs/4'>" in output.data)
 
+    def test_releases_cached(self):
+        """Test that the releases are not queried once they are cached."""
+        self.test_admin_new_release()
+
+        output = self.app.get("/")
+        self.assertTrue(b"<a href='/release/20'>" in output.data)
+
+        with count_queries(self.session) as queries:
+            output = self.app.get("/")
+            self.assertTrue(b"<a href='/release/20'>" in output.data)
+            output = self.app.get("/kernel/3.14.1-200.fc20.x86_64")
+            self.assertEqual(output.status_code, 200)
+        self.assertTrue(queries)
+        self.assertFalse([stmt for stmt, _ in queries if "FROM releases" in stmt])
+
+    def test_pages_cached(self):
+        """Test that the pages are served from the cache until a result
+        they show is uploaded.
+        """
+        self.test_upload_results_autotest()
+        kernel = "/kernel/3.14.1-200.fc20.x86_64"
+
+        output = self.app.get(kernel)
+        etag, last_modified = output.headers["ETag"], output.headers["Last-Modified"]
+        self.app.get("/release/20")
+        self.app.get("/release/21")
+        with count_queries(self.session) as queries:
+            output = self.app.get(kernel)
+            self.assertEqual(output.headers["ETag"], etag)
+            self.assertTrue(b"<a href='/logs/1'>" in output.data)
+            output = self.app.get(kernel, headers={"If-None-Match": etag})
+            self.assertEqual(output.status_code, 304)
+            output = self.app.get(kernel, headers={"If-Modified-Since": last_modified})
+            self.assertEqual(output.status_code, 304)
+            # Query arguments the page does not read do not make new pages
+            output = self.app.get(f"{kernel}?utm_source=1&x=2")
+            self.assertEqual(output.headers["ETag"], etag)
+        self.assertEqual(queries, [])
+
+        # A result for another kernel only drops the pages showing it
+        content = (Path(__file__).parent / "3.log").read_bytes()
+        content = content.replace(b"3.14.1-200.fc20", b"3.15.0-300.fc21")
+        data = {
+            "test_result": (io.BytesIO(content), "3.log"),
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest", data=data)
+        self.assertEqual(output.status_code, 200)
+        with count_queries(self.session) as queries:
+            self.app.get(kernel)
+            self.app.get("/release/20")
+        self.assertEqual(queries, [])
+        with count_queries(self.session) as queries:
+            output = self.app.get("/release/21")
+        self.assertTrue(queries)
+        self.assertTrue(b"<a href='/kernel/3.15.0-300.fc21.x86_64'>" in output.data)
+
+        # Editing the releases drops all the pages
+        self.session.query(app.dbtools.OutboxMessage).delete()
+        self.session.commit()
+        self.test_admin_new_release()
+        # Pages are not cached for logged in users
+        self.assertFalse("ETag" in self.app.get("/stats").headers)
+        with self.app.session_transaction() as session:
+            session.clear()
+        with count_queries(self.session) as queries:
+            output = self.app.get(kernel)
+        self.assertTrue(queries)
+
+    def test_search(self):
+        """Test the search method."""
+        self.test_upload_results_autotest()
+        self.test_upload_results_anonymous()
+
+        output = self.app.get("/search")
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue(b'<input id="test" name="test" type="text" value=""' in output.data)
+
+        output = self.app.get("/search?test=./default/paxtest&release=20")
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue(b"<h2>Test runs in which ./default/paxtest failed</h2>" in output.data)
+        self.assertEqual(output.data.count(b"<a href='/kernel/3.14.1-200.fc20.x86_64'>"), 3)
+        self.assertTrue(b"<a href='/logs/3'>" in output.data)
+
+        output = self.app.get("/search?test=./default/paxtest&release=20&arch=i686")
+        self.assertFalse(b"<a href='/kernel/3.14.1-200.fc20.x86_64'>" in output.data)
+
+    def test_kernel_paginated(self):
+        """Test the pagination of the kernel page."""
+        self.test_upload_results_autotest()
+        self.test_upload_results_anonymous()
+        self.test_upload_results_loggedin()
+        app.APP.config["PAGE_SIZE"] = 3
+
+        try:
+            output = self.app.get("/kernel/3.14.1-200.fc20.x86_64")
+            self.assertTrue(b"<a href='/logs/4'>" in output.data)
+            self.assertTrue(b"<a href='/logs/2'>" in output.data)
+            self.assertFalse(b"<a href='/logs/1'>" in output.data)
+            self.assertFalse(b"Newer results" in output.data)
+            self.assertTrue(
+                b"<a href='/kernel/3.14.1-200.fc20.x86_64?before=2'>Older results" in output.data
+            )
+
+            output = self.app.get("/kernel/3.14.1-200.fc20.x86_64?before=2")
+            self.assertTrue(b"<a href='/logs/1'>" in output.data)
+            self.assertFalse(b"<a href='/logs/2'>" in output.data)
+            self.assertTrue(
+                b"<a href='/kernel/3.14.1-200.fc20.x86_64?after=1'>&laquo; Newer" in output.data
+            )
+            self.assertFalse(b"Older results" in output.data)
+        finally:
+            app.APP.config["PAGE_SIZE"] = 100
+
+    def test_pages_cached_query_args(self):
+        """Test that the pages of the cache differ by the query arguments
+        the view reads.
+        """
+        self.test_upload_results_autotest()
+        content = (Path(__file__).parent / "3.log").read_bytes()
+        content = content.replace(b"3.14.1-200.fc20", b"3.15.0-200.fc20")
+        data = {
+            "test_result": (io.BytesIO(content), "3.log"),
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest", data=data)
+        self.assertEqual(output.status_code, 200)
+        app.APP.config["PAGE_SIZE"] = 1
+
+        try:
+            first = self.app.get("/release/20")
+            self.assertTrue(b"<a href='/kernel/3.15.0-200.fc20.x86_64'>" in first.data)
+            self.assertTrue(b"before=3.15.0-200.fc20.x86_64" in first.data)
+            output = self.app.get("/release/20?before=3.15.0-200.fc20.x86_64")
+            self.assertNotEqual(output.data, first.data)
+            self.assertTrue(b"<a href='/kernel/3.14.1-200.fc20.x86_64'>" in output.data)
+            output = self.app.get("/release/20?version=3.14")
+            self.assertNotEqual(output.data, first.data)
+            self.assertTrue(b"<a href='/kernel/3.14.1-200.fc20.x86_64'>" in output.data)
+            self.assertEqual(self.app.get("/release/20").data, first.data)
+        finally:
+            app.APP.config["PAGE_SIZE"] = 100
+
+    def test_api(self):
+        """Test the JSON API."""
+        self.test_upload_results_autotest()
+        self.test_upload_results_anonymous()
+        self.test_upload_results_loggedin()
+        self.test_admin_new_release()
+
+        output = self.app.get("/api/v1/releases")
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.json["items"], [{"releasenum": 20, "support": "RELEASE"}])
+
+        output = self.app.get("/api/v1/matrix?fields=kernel_version,arch")
+        self.assertEqual(
+            output.json, {"items": [{"kernel_version": "3.14.1-200.fc20.x86_64", "arch": "x86_64"}]}
+        )
+
+        output = self.app.get("/api/v1/release/20/kernels")
+        self.assertEqual(
+            output.json, {"items": ["3.14.1-200.fc20.x86_64"], "prev": None, "next": None}
+        )
+
+        output = self.app.get("/api/v1/kernel/3.14.1-200.fc20.x86_64/results?limit=3")
+        self.assertEqual([test["testid"] for test in output.json["items"]], [4, 3, 2])
+        self.assertEqual((output.json["prev"], output.json["next"]), (None, 2))
+        output = self.app.get(
+            "/api/v1/kernel/3.14.1-200.fc20.x86_64/results?before=2&fields=testid,tester"
+        )
+        self.assertEqual(output.json["items"], [{"testid": 1, "tester": "kerneltest"}])
+        output = self.app.get(
+            "/api/v1/kernel/3.14.1-200.fc20.x86_64/results?before=2&fields=testdate,testtime"
+        )
+        self.assertEqual(
+            output.json["items"],
+            [{"testdate": "Thu Apr 24 11:48:35 CDT 2014", "testtime": "2014-04-24T16:48:35"}],
+        )
+        output = self.app.get("/api/v1/kernel/3.14.1-200.fc20.x86_64/results?fields=nope")
+        self.assertEqual(output.status_code, 400)
+        self.assertEqual(output.json, {"error": "Unknown fields: nope"})
+
+        output = self.app.get("/api/v1/stats")
+        self.assertEqual(output.json["n_test"], 4)
+
+    def test_api_etag(self):
+        """Test that the JSON API answers with a 304 until the data changes."""
+        self.test_upload_results_autotest()
+
+        output = self.app.get("/api/v1/stats")
+        n_test = output.json["n_test"]
+        etag = output.headers["ETag"]
+        self.assertTrue(output.cache_control.no_cache)
+        self.assertNotEqual(self.app.get("/api/v1/matrix").headers["ETag"], etag)
+
+        with count_queries(self.session) as queries:
+            output = self.app.get("/api/v1/stats", headers={"If-None-Match": etag})
+        self.assertEqual(output.status_code, 304)
+        self.assertEqual(output.headers["ETag"], etag)
+        self.assertEqual(len(queries), 2)
+
+        # A new release changes the data version
+        self.test_admin_new_release()
+        output = self.app.get("/api/v1/stats", headers={"If-None-Match": etag})
+        self.assertEqual(output.status_code, 200)
+        etag = output.headers["ETag"]
+
+        # So does a new test result
+        data = {
+            "test_result": (Path(__file__).parent / "3.log").open("rb"),
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest", data=data)
+        self.assertEqual(output.status_code, 200)
+        output = self.app.get("/api/v1/stats", headers={"If-None-Match": etag})
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.json["n_test"], n_test + 1)
+
+    def test_metrics(self):
+        """Test the Server-Timing header and the metrics endpoint."""
+        self.test_upload_results_autotest()
+
+        data = {
+            "test_result": (Path(__file__).parent / "3.log").open("rb"),
+            "api_token": "api token for the tests",
+        }
+        output = self.app.post("/upload/autotest", data=data)
+        self.assertEqual(output.status_code, 200)
+        phases = [metric.split(";")[0] for metric in output.headers["Server-Timing"].split(", ")]
+        self.assertEqual(sorted(phases), ["db", "publish", "save", "total"])
+
+        output = self.app.get("/stats")
+        self.assertIn("render;dur=", output.headers["Server-Timing"])
+
+        output = self.app.get("/metrics")
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.content_type, "text/plain; version=0.0.4")
+        lines = output.get_data(as_text=True).splitlines()
+        self.assertIn("# TYPE kerneltest_request_duration_seconds histogram", lines)
+        self.assertIn(
+            'kerneltest_request_duration_seconds_bucket{endpoint="stats",le="+Inf"} 1', lines
+        )
+        phases = [
+            line.split(",")[1].split("}")[0]
+            for line in lines
+            if line.startswith(
+                'kerneltest_request_phase_duration_seconds_count{endpoint="upload_autotest"'
+            )
+        ]
+        self.assertEqual(sorted(phases), ['phase="db"', 'phase="publish"', 'phase="save"'])
+        self.assertIn(
+            'kerneltest_requests_total{endpoint="stats",method="GET",status="200"} 1.0', lines
+        )
+        self.assertIn("kerneltest_db_pool_checkedout 0", lines)
+
+        app.APP.config["SERVER_TIMING"] = False
+        app.APP.config["METRICS"] = False
+        self.assertNotIn("Server-Timing", self.app.get("/stats").headers)
+        self.assertEqual(self.app.get("/metrics").status_code, 404)
+        app.APP.config["SERVER_TIMING"] = True
+        app.APP.config["METRICS"] = True
+
     def test_is_safe_url(self):
         """Test the is_safe_url function."""
         import flask
@@ -372,8 +830,9 @@ class KerneltestTests(Modeltests):
                 "agent": "pingou",
                 "release": {"releasenum": 20, "support": "RELEASE"},
             }
+            output = self.app.post("/admin/new", data=data, follow_redirects=True)
             with fml_testing.mock_sends(ReleaseNewV1(expected_message)):
-                output = self.app.post("/admin/new", data=data, follow_redirects=True)
+                app.messaging.dispatch(self.session)
             self.assertEqual(output.status_code, 200)
             self.assertTrue(b'<li class="message">Release &#34;20&#34; added</li>' in output.data)
             self.assertTrue(b"<a href='/release/20'>" in output.data)
@@ -411,8 +870,9 @@ class KerneltestTests(Modeltests):
                 "agent": "pingou",
                 "release": {"releasenum": 21, "support": "RAWHIDE"},
             }
+            output = self.app.post("/admin/20/edit", data=data, follow_redirects=True)
             with fml_testing.mock_sends(ReleaseEditV1(expected_message)):
-                output = self.app.post("/admin/20/edit", data=data, follow_redirects=True)
+                app.messaging.dispatch(self.session)
             self.assertEqual(output.status_code, 200)
             self.assertTrue(b'<li class="message">Release &#34;21&#34; updated</li>' in output.data)
             self.assertTrue(b"<a href='/release/21'>" in output.data)
@@ -446,6 +906,120 @@ class KerneltestTests(Modeltests):
         output = self.app.get("/logs/2")
         self.assertEqual(output.data, exp_2)
 
+    def test_logs_compressed(self):
+        """Test serving the compressed logs and the logs not migrated yet."""
+        folder = Path(__file__).parent
+        exp = (folder / "3.log").read_bytes()
+
+        with tempfile.TemporaryDirectory() as logdir:
+            app.APP.config["LOG_DIR"] = logdir
+            try:
+                self.test_upload_results_autotest()
+            finally:
+                app.APP.config["LOG_DIR"] = "logs"
+
+            path = app.logstore.log_path(logdir, 1)
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(gzip.decompress(Path(path).read_bytes()), exp)
+            # Readable by the web server, like the files open() creates
+            with open(os.path.join(logdir, "other"), "w"):
+                pass
+            mode = os.stat(os.path.join(logdir, "other")).st_mode
+            self.assertEqual(os.stat(path).st_mode, mode)
+
+            app.APP.config["LOG_DIR"] = logdir
+            try:
+                output = self.app.get("/logs/1", headers={"Accept-Encoding": "gzip"})
+                self.assertEqual(output.headers["Content-Encoding"], "gzip")
+                self.assertIn("Accept-Encoding", output.headers["Vary"])
+                self.assertEqual(gzip.decompress(output.data), exp)
+
+                output = self.app.get("/logs/1", headers={"Accept-Encoding": "br"})
+                self.assertNotIn("Content-Encoding", output.headers)
+                self.assertEqual(output.data, exp)
+
+                # Flat log uploaded before the log store
+                os.unlink(path)
+                shutil.copy(folder / "3.log", os.path.join(logdir, "1.log"))
+                output = self.app.get("/logs/1", headers={"Accept-Encoding": "gzip"})
+                self.assertEqual(output.status_code, 200)
+                self.assertEqual(output.data, exp)
+
+                output = self.app.get("/logs/10")
+                self.assertEqual(output.status_code, 404)
+
+                result = app.APP.test_cli_runner().invoke(args=["migrate-logs", "-j", "2"])
+                self.assertEqual(result.exit_code, 0)
+                self.assertEqual(result.output, "1 logs migrated\n")
+                self.assertFalse(os.path.exists(os.path.join(logdir, "1.log")))
+                self.assertEqual(gzip.decompress(Path(path).read_bytes()), exp)
+                self.assertEqual(os.stat(path).st_mode, mode)
+            finally:
+                app.APP.config["LOG_DIR"] = "logs"
+
+    def test_logs_conditional(self):
+        """Test the caching headers, conditional and range requests of logs."""
+        folder = Path(__file__).parent
+        exp = (folder / "3.log").read_bytes()
+
+        with tempfile.TemporaryDirectory() as logdir:
+            app.APP.config["LOG_DIR"] = logdir
+            try:
+                self.test_upload_results_autotest()
+
+                for encoding, etag in (("identity", '"log-1"'), ("gzip", '"log-1-gzip"')):
+                    headers = {"Accept-Encoding": encoding}
+                    output = self.app.get("/logs/1", headers=headers)
+                    self.assertEqual(output.status_code, 200)
+                    self.assertEqual(output.headers["ETag"], etag)
+                    self.assertEqual(output.headers["Accept-Ranges"], "bytes")
+                    last_modified = output.headers["Last-Modified"]
+                    self.assertEqual(
+                        output.headers["Cache-Control"], "public, max-age=31536000, immutable"
+                    )
+
+                    output = self.app.get("/logs/1", headers={"If-None-Match": etag, **headers})
+                    self.assertEqual(output.status_code, 304)
+                    self.assertEqual(output.data, b"")
+
+                    output = self.app.get(
+                        "/logs/1",
+                        headers={"If-Modified-Since": last_modified, **headers},
+                    )
+                    self.assertEqual(output.status_code, 304)
+
+                # Range over the decompressed log
+                output = self.app.get("/logs/1", headers={"Range": "bytes=6-13"})
+                self.assertEqual(output.status_code, 206)
+                self.assertEqual(output.data, exp[6:14])
+                self.assertEqual(output.headers["Content-Range"], f"bytes 6-13/{len(exp)}")
+
+                # Range over the compressed log
+                compressed = Path(app.logstore.log_path(logdir, 1)).read_bytes()
+                output = self.app.get(
+                    "/logs/1", headers={"Range": "bytes=-10", "Accept-Encoding": "gzip"}
+                )
+                self.assertEqual(output.status_code, 206)
+                self.assertEqual(output.data, compressed[-10:])
+
+                # Let nginx send the file
+                app.APP.config["LOGS_X_ACCEL_REDIRECT"] = "/protected-logs/"
+                output = self.app.get("/logs/1", headers={"Accept-Encoding": "gzip"})
+                self.assertEqual(output.status_code, 200)
+                self.assertEqual(output.data, b"")
+                path = os.path.relpath(app.logstore.log_path(logdir, 1), logdir)
+                self.assertEqual(output.headers["X-Accel-Redirect"], f"/protected-logs/{path[:-3]}")
+                self.assertEqual(output.headers["Content-Encoding"], "gzip")
+                self.assertEqual(output.headers["Last-Modified"], last_modified)
+                output = self.app.get(
+                    "/logs/1", headers={"If-None-Match": '"log-1-gzip"', "Accept-Encoding": "gzip"}
+                )
+                self.assertEqual(output.status_code, 304)
+                self.assertNotIn("X-Accel-Redirect", output.headers)
+            finally:
+                app.APP.config["LOG_DIR"] = "logs"
+                app.APP.config["LOGS_X_ACCEL_REDIRECT"] = None
+
     def test_is_admin(self):
         """Test the is_admin method."""
         self.assertFalse(app.is_admin(None))
@@ -0,0 +1,178 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""
+kerneltest page cache tests.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import kerneltest.cache as cache
+import kerneltest.dbtools as dbtools
+
+
+class ReleaseCacheTests(unittest.TestCase):
+    """ReleaseCache tests."""
+
+    def test_invalidated_while_querying(self):
+        """Test that the releases queried before an invalidation are not
+        cached.
+        """
+        releases = cache.ReleaseCache()
+        stale = [dbtools.Release(releasenum="40", support="RELEASE")]
+        fresh = [dbtools.Release(releasenum="41", support="RAWHIDE")]
+
+        def getcurrentreleases(session):
+            releases.invalidate()
+            return stale
+
+        with patch.object(dbtools, "getcurrentreleases", getcurrentreleases):
+            self.assertEqual(releases.get(None)[0][0].releasenum, "40")
+        with patch.object(dbtools, "getcurrentreleases", return_value=fresh) as query:
+            self.assertEqual(releases.get(None)[1].releasenum, "41")
+            releases.get(None)
+        query.assert_called_once_with(None)
+
+
+class MemoryPageStoreTests(unittest.TestCase):
+    """MemoryPageStore tests."""
+
+    def make_store(self, ttl=300, max_pages=1000):
+        """Return the page store to test."""
+        return cache.MemoryPageStore(ttl=ttl, max_pages=max_pages)
+
+    def stored(self, store):
+        """Return the keys of the pages stored, oldest first."""
+        return list(store._pages)
+
+    def setUp(self):
+        """Set up the environnment, ran before every tests."""
+        self.store = self.make_store()
+
+    def page(self, body=b"page", rendered=None):
+        """Return a CachedPage rendered now or at the given time."""
+        return cache.CachedPage(body, "etag", rendered or time.time())
+
+    def test_get_set(self):
+        """Test storing and getting pages."""
+        self.assertIsNone(self.store.get("/"))
+        page = self.page()
+        self.store.set("/", page, ["releases", "index"])
+        self.assertEqual(self.store.get("/"), page)
+
+        page = self.page(b"other page")
+        self.store.set("/", page, ["releases", "index"])
+        self.assertEqual(self.store.get("/"), page)
+
+    def test_invalidate(self):
+        """Test that only the pages with the invalidated tags are dropped."""
+        self.store.set("/", self.page(), ["releases", "index"])
+        self.store.set("/release/20", self.page(), ["releases", "release:20"])
+        self.store.set("/release/21", self.page(), ["releases", "release:21"])
+
+        self.store.invalidate(["index", "release:20", "kernel:3.14.1-200.fc20.x86_64"])
+        self.assertIsNone(self.store.get("/"))
+        self.assertIsNone(self.store.get("/release/20"))
+        self.assertIsNotNone(self.store.get("/release/21"))
+
+        self.store.invalidate(["releases"])
+        self.assertIsNone(self.store.get("/release/21"))
+
+    def test_invalidated_while_rendering(self):
+        """Test that a page rendered before its tags were invalidated is
+        not stored.
+        """
+        rendered = time.time() - 1
+        self.store.invalidate(["index"])
+        self.store.set("/", self.page(rendered=rendered), ["releases", "index"])
+        self.assertIsNone(self.store.get("/"))
+
+        self.store.set("/", self.page(), ["releases", "index"])
+        self.assertIsNotNone(self.store.get("/"))
+
+    def test_expired(self):
+        """Test that the pages expire after the TTL."""
+        store = self.make_store(ttl=0)
+        store.set("/", self.page(), ["releases", "index"])
+        self.assertIsNone(store.get("/"))
+
+    def test_expired_dropped(self):
+        """Test that the expired pages are dropped when storing pages."""
+        store = self.make_store(ttl=0)
+        store.set("/", self.page(), ["releases", "index"])
+        store.set("/stats", self.page(), ["releases", "stats"])
+        self.assertEqual(self.stored(store), ["/stats"])
+
+    def test_max_pages(self):
+        """Test that the oldest pages are dropped past max_pages."""
+        store = self.make_store(max_pages=2)
+        for key in ["/", "/stats", "/", "/release/20"]:
+            store.set(key, self.page(), ["releases", key])
+        self.assertEqual(self.stored(store), ["/", "/release/20"])
+        store.invalidate(["/"])
+        self.assertEqual(self.stored(store), ["/release/20"])
+
+    def test_clear(self):
+        """Test dropping all the pages."""
+        self.store.set("/", self.page(), ["releases", "index"])
+        self.store.clear()
+        self.assertIsNone(self.store.get("/"))
+
+
+class SQLitePageStoreTests(MemoryPageStoreTests):
+    """SQLitePageStore tests."""
+
+    def make_store(self, ttl=300, max_pages=1000):
+        """Return the page store to test."""
+        return cache.SQLitePageStore(
+            os.path.join(self.tmpdir.name, "pages.sqlite"), ttl=ttl, max_pages=max_pages
+        )
+
+    def stored(self, store):
+        """Return the keys of the pages stored, oldest first."""
+        rows = store.connection.execute("SELECT key FROM pages ORDER BY expires")
+        keys = [key for key, in rows]
+        tagged = store.connection.execute("SELECT DISTINCT key FROM page_tags")
+        self.assertEqual(sorted(key for key, in tagged), sorted(keys))
+        return keys
+
+    def setUp(self):
+        """Set up the environnment, ran before every tests."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        super().setUp()
+
+    def test_shared(self):
+        """Test that the pages are shared by the stores using the same file."""
+        other = self.make_store()
+        self.store.set("/", self.page(), ["releases", "index"])
+        self.assertEqual(other.get("/"), self.store.get("/"))
+
+        other.invalidate(["index"])
+        self.assertIsNone(self.store.get("/"))
+
+
+class PageStoreTests(unittest.TestCase):
+    """page_store tests."""
+
+    def test_page_store(self):
+        """Test the page_store function."""
+        self.assertIsNone(cache.page_store(None))
+        self.assertIsInstance(cache.page_store("memory"), cache.MemoryPageStore)
+        store = cache.page_store("sqlite:////tmp/pages.sqlite", ttl=60)
+        self.assertIsInstance(store, cache.SQLitePageStore)
+        self.assertEqual((store.path, store.ttl), ("/tmp/pages.sqlite", 60))
+        self.assertRaises(ValueError, cache.page_store, "redis://localhost")
+
+
+if __name__ == "__main__":
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(ReleaseCacheTests)
+    SUITE.addTests(unittest.TestLoader().loadTestsFromTestCase(MemoryPageStoreTests))
+    SUITE.addTests(unittest.TestLoader().loadTestsFromTestCase(SQLitePageStoreTests))
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
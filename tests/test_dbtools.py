@@ -0,0 +1,479 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""
+kerneltest dbtools tests.
+"""
+
+__requires__ = ["SQLAlchemy >= 0.7"]
+
+import datetime
+import os
+import re
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sqlalchemy as sa
+
+import kerneltest.dbtools as dbtools
+import kerneltest.parser as parser
+from tests import DB_PATH, Modeltests, count_queries
+
+
+def add_test(
+    session,
+    kver,
+    tester="kerneltest",
+    result="PASS",
+    failedtests=None,
+    testdate="Thu Apr 24 11:48:35 CDT 2014",
+):
+    """Add a test result for the given kernel in the database."""
+    version = parser.parse_kver(kver)
+    test = dbtools.KernelTest(
+        tester=tester,
+        testdate=testdate,
+        testtime=parser.parse_testdate(testdate),
+        testset="default",
+        kver=kver,
+        fver=version.fver,
+        testarch=version.arch,
+        kmajor=version.major,
+        kminor=version.minor,
+        kpatch=version.patch,
+        kbuild=version.build,
+        kdist=version.dist,
+        kverkey=parser.kver_key(kver),
+        testrel="Fedora release 20 (Heisenbug)",
+        testresult=result,
+        failedtests=failedtests,
+        failures=[
+            dbtools.FailedTest(testname=testname, fver=version.fver, testarch=version.arch)
+            for testname in parser.split_failedtests(failedtests)
+        ],
+    )
+    session.add(test)
+    return test
+
+
+class DbtoolsTests(Modeltests):
+    """dbtools tests."""
+
+    def setUp(self):
+        """Set up the environnment, ran before every tests."""
+        super().setUp()
+
+        self.session.add(dbtools.Release(releasenum=20, support="RELEASE"))
+        self.session.add(dbtools.Release(releasenum=21, support="RAWHIDE"))
+        self.session.add(dbtools.Release(releasenum=19, support="RETIRED"))
+        add_test(self.session, "3.14.1-200.fc20.x86_64")
+        add_test(self.session, "3.14.1-200.fc20.x86_64", tester="pingou", result="FAIL")
+        add_test(self.session, "3.14.1-200.fc20.i686")
+        add_test(self.session, "3.15.0-300.fc21.x86_64")
+        add_test(self.session, "3.15.0-300.fc21.x86_64")
+        self.session.commit()
+
+    def test_get_stats(self):
+        """Test the get_stats function."""
+        with count_queries(self.session) as queries:
+            stats = dbtools.get_stats(self.session)
+        self.assertEqual(len(queries), 3)
+
+        self.assertEqual(stats["n_test"], 5)
+        self.assertEqual(stats["n_kernels"], 3)
+        self.assertEqual(stats["n_arches"], 2)
+        self.assertEqual(
+            stats["rel_stats"],
+            {
+                19: {"kernels": 0, "tests": 0, "arches": 0, "testers": 0},
+                20: {"kernels": 2, "tests": 3, "arches": 2, "testers": 2},
+                21: {"kernels": 1, "tests": 2, "arches": 1, "testers": 1},
+            },
+        )
+        self.assertEqual(
+            stats["ker_stats"],
+            {
+                "3.14.1-200.fc20.i686": {"releases": 1, "tests": 1, "arches": 1, "testers": 1},
+                "3.14.1-200.fc20.x86_64": {"releases": 1, "tests": 2, "arches": 1, "testers": 2},
+                "3.15.0-300.fc21.x86_64": {"releases": 1, "tests": 2, "arches": 1, "testers": 1},
+            },
+        )
+
+    def test_getlatestmatrix(self):
+        """Test the getlatestmatrix function."""
+        add_test(self.session, "3.14.2-200.fc20.x86_64", result="FAIL")
+        add_test(self.session, "3.14.3-200.fc20.x86_64", tester="pingou")
+        add_test(self.session, "3.13.0-100.fc19.x86_64")
+        self.session.commit()
+
+        with count_queries(self.session) as queries:
+            matrix = dbtools.getlatestmatrix(self.session)
+        self.assertEqual(len(queries), 1)
+
+        self.assertEqual(
+            [(test.fver, test.testarch, test.kver, test.testresult) for test in matrix],
+            [
+                (21, "x86_64", "3.15.0-300.fc21.x86_64", "PASS"),
+                (20, "x86_64", "3.14.2-200.fc20.x86_64", "FAIL"),
+                (20, "i686", "3.14.1-200.fc20.i686", "PASS"),
+            ],
+        )
+
+        # Same results as looking up the latest test arch by arch
+        expected = []
+        for release in dbtools.getcurrentreleases(self.session):
+            for arch in dbtools.getarches(self.session, release.releasenum):
+                expected.append(dbtools.getlatest(self.session, release.releasenum, arch[0]))
+        self.assertEqual(matrix, expected)
+
+    def test_getresultsbykernel_paginated(self):
+        """Test the keyset pagination of getresultsbykernel."""
+        kernel = "3.14.1-200.fc20.x86_64"
+        for _ in range(3):
+            add_test(self.session, kernel)
+        self.session.commit()
+        testids = [test.testid for test in dbtools.getresultsbykernel(self.session, kernel)]
+        self.assertEqual(testids, [8, 7, 6, 2, 1])
+
+        page = dbtools.getresultsbykernel(self.session, kernel, limit=2)
+        self.assertEqual([test.testid for test in page.items], [8, 7])
+        self.assertEqual((page.prev, page.next), (None, 7))
+
+        page = dbtools.getresultsbykernel(self.session, kernel, limit=2, before=page.next)
+        self.assertEqual([test.testid for test in page.items], [6, 2])
+        self.assertEqual((page.prev, page.next), (6, 2))
+
+        last = dbtools.getresultsbykernel(self.session, kernel, limit=2, before=page.next)
+        self.assertEqual([test.testid for test in last.items], [1])
+        self.assertEqual((last.prev, last.next), (1, None))
+
+        page = dbtools.getresultsbykernel(self.session, kernel, limit=2, after=last.prev)
+        self.assertEqual([test.testid for test in page.items], [6, 2])
+        self.assertEqual((page.prev, page.next), (6, 2))
+
+        page = dbtools.getresultsbykernel(self.session, kernel, limit=2, after=page.prev)
+        self.assertEqual([test.testid for test in page.items], [8, 7])
+        self.assertEqual((page.prev, page.next), (None, 7))
+
+    def test_getkernelsbyrelease_paginated(self):
+        """Test the keyset pagination of getkernelsbyrelease."""
+        add_test(self.session, "3.14.2-200.fc20.x86_64")
+        self.session.commit()
+
+        page = dbtools.getkernelsbyrelease(self.session, 20, limit=2)
+        self.assertEqual(
+            [kernel[0] for kernel in page.items],
+            ["3.14.2-200.fc20.x86_64", "3.14.1-200.fc20.x86_64"],
+        )
+        self.assertEqual((page.prev, page.next), (None, "3.14.1-200.fc20.x86_64"))
+
+        page = dbtools.getkernelsbyrelease(self.session, 20, limit=2, before=page.next)
+        self.assertEqual([kernel[0] for kernel in page.items], ["3.14.1-200.fc20.i686"])
+        self.assertEqual((page.prev, page.next), ("3.14.1-200.fc20.i686", None))
+
+    def test_getkernelsbyrelease_version(self):
+        """Test that getkernelsbyrelease sorts and filters the kernels by version."""
+        for kernel in ("6.9.2-200.fc40.x86_64", "6.10.0-300.fc40.x86_64", "6.8.9-300.fc40.x86_64"):
+            add_test(self.session, kernel)
+        add_test(self.session, "6.9.0-0.rc3.fc40.x86_64")
+        add_test(self.session, "6.9.12-100.fc39.x86_64")
+        self.session.commit()
+
+        kernels = [kernel[0] for kernel in dbtools.getkernelsbyrelease(self.session, 40)]
+        self.assertEqual(
+            kernels,
+            [
+                "6.10.0-300.fc40.x86_64",
+                "6.9.2-200.fc40.x86_64",
+                "6.9.0-0.rc3.fc40.x86_64",
+                "6.8.9-300.fc40.x86_64",
+            ],
+        )
+        kernels = dbtools.getkernelsbyrelease(self.session, 40, version="6.9")
+        self.assertEqual(
+            [kernel[0] for kernel in kernels],
+            ["6.9.2-200.fc40.x86_64", "6.9.0-0.rc3.fc40.x86_64"],
+        )
+        kernels = dbtools.getkernelsbyrelease(self.session, version="6.9.12")
+        self.assertEqual([kernel[0] for kernel in kernels], ["6.9.12-100.fc39.x86_64"])
+
+        page = dbtools.getkernelsbyrelease(self.session, 40, limit=2, version="6")
+        self.assertEqual(page.next, "6.9.2-200.fc40.x86_64")
+        page = dbtools.getkernelsbyrelease(self.session, 40, limit=2, before=page.next)
+        self.assertEqual(
+            [kernel[0] for kernel in page.items],
+            ["6.9.0-0.rc3.fc40.x86_64", "6.8.9-300.fc40.x86_64"],
+        )
+        self.assertEqual(page.prev, "6.9.0-0.rc3.fc40.x86_64")
+
+        self.assertEqual(dbtools.getallkernels(self.session)[0].kver, "6.10.0-300.fc40.x86_64")
+        self.assertRaises(ValueError, dbtools.getkernelsbyrelease, self.session, 40, version="6.x")
+
+    def test_time_window(self):
+        """Test restricting the listings to the tests ran in a time window."""
+        kernel = "3.14.2-200.fc20.x86_64"
+        add_test(self.session, kernel, testdate="Mon Apr 28 09:00:00 UTC 2014")
+        add_test(self.session, kernel, "kerneltest", "FAIL", "./mm", "Tue Apr 29 09:00:00 UTC 2014")
+        add_test(self.session, kernel, "kerneltest", "FAIL", "./mm", "Wed Apr 30 09:00:00 UTC 2014")
+        self.session.commit()
+        since = datetime.datetime(2014, 4, 29)
+        until = datetime.datetime(2014, 4, 30)
+
+        tests = dbtools.getresultsbykernel(self.session, kernel, since=since)
+        self.assertEqual([test.testid for test in tests], [8, 7])
+        tests = dbtools.getresultsbykernel(self.session, kernel, since=since, until=until)
+        self.assertEqual([test.testid for test in tests], [7])
+        tests = dbtools.getresultsbyrelease(self.session, 20, until=since)
+        self.assertEqual([test.testid for test in tests], [6, 3, 2, 1])
+        page = dbtools.getresultsbyrelease(self.session, 20, limit=1, since=since)
+        self.assertEqual(([test.testid for test in page.items], page.next), ([8], 8))
+        tests = dbtools.searchfailures(self.session, "./mm", until=until)
+        self.assertEqual([test.testid for test in tests], [7])
+        kernels = dbtools.getkernelsbyrelease(self.session, 20, since=since)
+        self.assertEqual([kernel[0] for kernel in kernels], [kernel])
+
+        # Results uploaded before the test date was parsed are left out
+        self.session.query(dbtools.KernelTest).update({"testtime": None})
+        self.assertEqual(dbtools.getresultsbykernel(self.session, kernel, since=since), [])
+
+    def test_iterallkernels(self):
+        """Test the iterallkernels function."""
+        kernels = list(dbtools.iterallkernels(self.session, batch_size=2))
+        self.assertEqual(kernels, dbtools.getallkernels(self.session))
+
+    def test_searchfailures(self):
+        """Test the searchfailures function."""
+        paxtest = "./default/paxtest"
+        add_test(self.session, "3.14.2-200.fc20.x86_64", "kerneltest", "FAIL", paxtest)
+        add_test(self.session, "3.14.2-200.fc20.i686", "kerneltest", "FAIL", f"{paxtest} ./mm")
+        add_test(self.session, "3.15.0-300.fc21.x86_64", "kerneltest", "FAIL", "./mm, ./default")
+        add_test(self.session, "3.15.1-300.fc21.x86_64", "kerneltest", "FAIL", paxtest)
+        self.session.commit()
+
+        tests = dbtools.searchfailures(self.session, paxtest)
+        self.assertEqual([test.testid for test in tests], [9, 7, 6])
+        tests = dbtools.searchfailures(self.session, "./mm")
+        self.assertEqual([test.testid for test in tests], [8, 7])
+        tests = dbtools.searchfailures(self.session, paxtest, release=20)
+        self.assertEqual([test.testid for test in tests], [7, 6])
+        tests = dbtools.searchfailures(self.session, paxtest, release=20, arch="i686")
+        self.assertEqual([test.testid for test in tests], [7])
+        self.assertEqual(dbtools.searchfailures(self.session, "./default/mm"), [])
+
+        page = dbtools.searchfailures(self.session, paxtest, limit=2)
+        self.assertEqual([test.testid for test in page.items], [9, 7])
+        self.assertEqual((page.prev, page.next), (None, 7))
+
+        # The failures go away with their test result
+        self.session.delete(tests[0])
+        self.session.commit()
+        self.assertEqual(self.session.query(dbtools.FailedTest).count(), 4)
+
+    def test_failure_trends(self):
+        """Test the getfailurerates, getfailurestart and getfailureheatmap functions."""
+        paxtest = "./default/paxtest"
+        add_test(self.session, "3.14.2-200.fc20.x86_64", "kerneltest", "FAIL", paxtest)
+        add_test(self.session, "3.14.3-200.fc20.x86_64", "kerneltest", "PASS")
+        add_test(self.session, "3.14.4-200.fc20.x86_64", "kerneltest", "FAIL", paxtest)
+        add_test(self.session, "3.14.5-200.fc20.x86_64", "kerneltest", "FAIL", f"{paxtest} ./mm")
+        add_test(self.session, "3.14.5-200.fc20.i686", "kerneltest", "FAIL", "./mm")
+        self.session.commit()
+
+        self.assertEqual(dbtools.getfailurerates(self.session), [(paxtest, 3, 10), ("./mm", 2, 10)])
+        self.assertEqual(
+            dbtools.getfailurerates(self.session, 20, "x86_64"),
+            [(paxtest, 3, 6), ("./mm", 1, 6)],
+        )
+        self.assertEqual(dbtools.getfailurerates(self.session, limit=1), [(paxtest, 3, 10)])
+        self.assertEqual(dbtools.getfailurerates(self.session, 21), [])
+
+        test = dbtools.getfailurestart(self.session, paxtest, 20, "x86_64")
+        self.assertEqual(test.kver, "3.14.4-200.fc20.x86_64")
+        test = dbtools.getfailurestart(self.session, "./mm", 20, "x86_64")
+        self.assertEqual(test.kver, "3.14.5-200.fc20.x86_64")
+        test = dbtools.getfailurestart(self.session, "./mm", 20, "i686")
+        self.assertEqual(test.kver, "3.14.5-200.fc20.i686")
+        self.assertIsNone(dbtools.getfailurestart(self.session, paxtest, 21, "x86_64"))
+
+        self.assertEqual(
+            dbtools.getfailureheatmap(self.session, paxtest),
+            {(20, "x86_64"): (3, 6), (20, "i686"): (0, 2), (21, "x86_64"): (0, 2)},
+        )
+
+    def test_backfill_failedtests(self):
+        """Test the backfill_failedtests function."""
+        self.session.execute(
+            sa.insert(dbtools.KernelTest),
+            [
+                dict(
+                    tester="kerneltest",
+                    testdate="Thu Apr 24 11:48:35 CDT 2014",
+                    testset="default",
+                    kver=f"3.14.{minor}-200.fc20.x86_64",
+                    fver=20,
+                    testarch="x86_64",
+                    testrel="Fedora release 20 (Heisenbug)",
+                    testresult="FAIL",
+                    failedtests="./default/paxtest ./mm",
+                )
+                for minor in range(2, 7)
+            ],
+        )
+        add_test(self.session, "3.14.7-200.fc20.x86_64", "kerneltest", "FAIL", "./mm")
+        self.session.commit()
+
+        self.assertEqual(dbtools.backfill_failedtests(self.session, batch_size=2), 10)
+        self.assertEqual(
+            dbtools.getfailurerates(self.session), [("./mm", 6, 11), ("./default/paxtest", 5, 11)]
+        )
+        self.assertEqual(dbtools.backfill_failedtests(self.session), 0)
+
+
+class PoolTests(Modeltests):
+    """Tests of the connection pool created by create_session."""
+
+    def test_pool_status(self):
+        """Test that the checkouts of connections are counted."""
+        session = dbtools.create_session(DB_PATH, pool_size=2, max_overflow=1, pool_timeout=0.1)
+        self.addCleanup(session.get_bind().dispose)
+        session.query(dbtools.Release).all()
+        session.close()
+
+        status = dbtools.pool_status(session)
+        self.assertEqual((status["size"], status["checkedout"]), (2, 0))
+        self.assertEqual((status["checkouts"], status["timeouts"]), (1, 0))
+        self.assertGreaterEqual(status["wait_max"], 0)
+
+    def test_pool_timeout(self):
+        """Test that the checkouts timing out are counted."""
+        session = dbtools.create_session(DB_PATH, pool_size=1, max_overflow=0, pool_timeout=0.1)
+        self.addCleanup(session.get_bind().dispose)
+        first = session.session_factory()
+        first.connection()
+        second = session.session_factory()
+        with self.assertLogs("kerneltest.dbtools", "WARNING"):
+            with patch.object(dbtools.TimedQueuePool, "wait_warning", 0.05):
+                self.assertRaises(sa.exc.TimeoutError, second.connection)
+        first.close()
+
+        status = dbtools.pool_status(session)
+        self.assertEqual((status["checkouts"], status["timeouts"]), (2, 1))
+        self.assertGreaterEqual(status["wait_max"], 0.1)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "Needs os.fork")
+    def test_pool_after_fork(self):
+        """Test that forked processes do not reuse the pooled connections."""
+        session = dbtools.create_session(DB_PATH)
+        self.addCleanup(session.get_bind().dispose)
+        session.query(dbtools.Release).all()
+        session.close()
+        pool = session.get_bind().pool
+        self.assertEqual(pool.checkedin(), 1)
+        self.assertIn(session.get_bind(), dbtools._ENGINES)
+
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            os._exit(session.get_bind().pool.checkedin())
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(pool.checkedin(), 1)
+
+
+@unittest.skipUnless(DB_PATH.startswith("sqlite"), "Checks SQLite query plans")
+class QueryPlanTests(Modeltests):
+    """Check that the dbtools queries use the indexes of the kerneltest table."""
+
+    def setUp(self):
+        """Seed the database with a few thousands test results."""
+        super().setUp()
+
+        rows = []
+        for fver in range(30, 40):
+            self.session.add(dbtools.Release(releasenum=fver, support="RELEASE"))
+            for minor in range(20):
+                for arch in ("x86_64", "i686", "aarch64"):
+                    for tester in ("kerneltest", "anon", "pingou"):
+                        rows.append(
+                            dict(
+                                tester=tester,
+                                testdate="Thu Apr 24 11:48:35 CDT 2014",
+                                testset="default",
+                                kver=f"6.{minor}.0-200.fc{fver}.{arch}",
+                                fver=fver,
+                                testarch=arch,
+                                kmajor=6,
+                                kminor=minor,
+                                kpatch=0,
+                                kbuild="200",
+                                kdist=f"fc{fver}",
+                                kverkey=parser.kver_key(f"6.{minor}.0-200.fc{fver}.{arch}"),
+                                testrel=f"Fedora release {fver}",
+                                testresult="PASS",
+                            )
+                        )
+        self.session.execute(sa.insert(dbtools.KernelTest), rows)
+        self.session.execute(
+            sa.insert(dbtools.FailedTest),
+            [
+                dict(
+                    testid=testid,
+                    testname=f"./test{testid % 50}",
+                    fver=30 + (testid - 1) // 180,
+                    testarch=("x86_64", "i686", "aarch64")[(testid - 1) // 3 % 3],
+                )
+                for testid in range(1, 1800)
+            ],
+        )
+        self.session.commit()
+
+    def assert_no_table_scan(self, function, *args):
+        """Run the function and check that none of the queries it issued
+        reads the kerneltest table without going through an index.
+        """
+        with count_queries(self.session) as queries:
+            function(self.session, *args)
+        self.assertTrue(queries)
+
+        connection = self.session.connection()
+        for statement, parameters in queries:
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            for row in plan:
+                detail = row[-1]
+                self.assertIsNone(
+                    re.match(r"SCAN kerneltest(?! USING)", detail),
+                    f"{function.__name__} scans the kerneltest table: {detail}\n{statement}",
+                )
+
+    def test_query_plans(self):
+        """Test that no dbtools query falls back to a full table scan."""
+        kernel = "6.1.0-200.fc30.x86_64"
+        self.assert_no_table_scan(dbtools.getarches)
+        self.assert_no_table_scan(dbtools.getarches, 30)
+        self.assert_no_table_scan(dbtools.getlatest, 30, "x86_64")
+        self.assert_no_table_scan(dbtools.getlatestmatrix)
+        self.assert_no_table_scan(dbtools.getkernelsbyrelease)
+        self.assert_no_table_scan(dbtools.getkernelsbyrelease, 30)
+        self.assert_no_table_scan(dbtools.getkernelsbyrelease, 30, 10, "6.5.0-200.fc30.i686")
+        self.assert_no_table_scan(dbtools.getkernelsbyrelease, 30, None, None, None, "6.5")
+        self.assert_no_table_scan(dbtools.getkernelsbyrelease, None, 10, None, None, "6.5.0")
+        self.assert_no_table_scan(dbtools.getresultsbykernel, kernel)
+        self.assert_no_table_scan(dbtools.getresultsbykernel, kernel, 10, 100)
+        self.assert_no_table_scan(dbtools.getallkernels)
+        self.assert_no_table_scan(dbtools.getresultsbyrelease, 30)
+        self.assert_no_table_scan(dbtools.getresultsbyrelease, 30, 10, None, 100)
+        since = datetime.datetime(2014, 4, 24)
+        self.assert_no_table_scan(dbtools.getresultsbyrelease, 30, 10, None, None, since)
+        self.assert_no_table_scan(dbtools.getresultsbykernel, kernel, 10, None, None, since)
+        self.assert_no_table_scan(dbtools.getreleasebykernel, kernel)
+        self.assert_no_table_scan(dbtools.searchfailures, "./test10")
+        self.assert_no_table_scan(dbtools.searchfailures, "./test10", 30, "x86_64", 10, 500)
+        self.assert_no_table_scan(dbtools.getfailurerates, 30, "x86_64", 10)
+        self.assert_no_table_scan(dbtools.getfailurestart, "./test10", 30, "x86_64")
+        self.assert_no_table_scan(dbtools.get_stats)
+
+
+if __name__ == "__main__":
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(DbtoolsTests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
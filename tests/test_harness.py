@@ -0,0 +1,372 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""
+harness tests.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fedora_messaging.exceptions import Drop, Nack
+from fedora_messaging.message import Message
+
+import harness
+
+
+def build_message(version="6.8.9", release="300.fc40", name="kernel", state=1, **extra):
+    """Return a recorded Koji build state change message."""
+    body = dict(name=name, version=version, release=release, new=state, old=0, instance="primary")
+    body.update(extra)
+    return dict(
+        topic="org.fedoraproject.prod.buildsys.build.state.change",
+        msg=body,
+        timestamp=time.time(),
+    )
+
+
+class StandInBroker:
+    """In-process stand-in for the message broker, delivering the messages
+    published to the consumers of the queues bound to their topic.
+    """
+
+    def __init__(self):
+        self.consumers = []
+
+    def consume(self, callback, bindings=None, queues=None):
+        """Register the consumer, without blocking like api.consume does."""
+        for binding in bindings:
+            assert binding["queue"] in queues
+            for key in binding["routing_keys"]:
+                words = [
+                    "[^.]+" if word == "*" else ".*" if word == "#" else re.escape(word)
+                    for word in key.split(".")
+                ]
+                self.consumers.append((re.compile(r"\.".join(words)), callback))
+
+    def publish(self, message):
+        """Deliver the message, return the number of consumers it reached."""
+        delivered = 0
+        for pattern, callback in self.consumers:
+            if pattern.fullmatch(message.topic):
+                callback(message)
+                delivered += 1
+        return delivered
+
+
+class HarnessTests(unittest.TestCase):
+    """harness tests."""
+
+    def setUp(self):
+        """Set up the environnment, ran before every tests."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue = harness.JobQueue(os.path.join(self.tmpdir.name, "queue.sqlite"))
+        self.hypervisor = harness.SimulatedHypervisor(
+            boot_time=0.01, test_time=0.05, shutdown_time=0
+        )
+        # Kernel each guest started had been assigned
+        self.assigned = []
+        start = self.hypervisor.start
+
+        def assigned_start(domain):
+            self.assigned.append(self.queue.assignment(domain).kernel)
+            start(domain)
+
+        self.hypervisor.start = assigned_start
+        self.dispatcher = self.make_dispatcher()
+
+    def tearDown(self):
+        """Stop the simulated guests."""
+        self.dispatcher.close()
+        self.hypervisor.close()
+        self.tmpdir.cleanup()
+
+    def make_dispatcher(self, **kwargs):
+        """Return a Dispatcher of the queue and simulated guests."""
+        dispatcher = harness.Dispatcher(self.hypervisor, self.queue, **kwargs)
+        self.hypervisor.on_stopped = dispatcher.stopped
+        return dispatcher
+
+    def wait(self, timeout=5):
+        """Wait for the guests to test all the kernels queued."""
+        deadline = time.monotonic() + timeout
+        while self.dispatcher.busy() or self.queue.depth():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def jobs(self):
+        """Return the (kernel, domain, state) of the jobs."""
+        return list(self.queue.connection.execute("SELECT kernel, domain, state FROM jobs"))
+
+    def test_parse_build(self):
+        """Test the parse_build function."""
+        message = build_message()
+        self.assertEqual(
+            harness.parse_build(message["topic"], message["msg"]), "kernel-6.8.9-300.fc40"
+        )
+        for message in [
+            build_message(state=0),
+            build_message(name="kernel-headers"),
+            build_message(version="5.19.1"),
+            build_message(instance="ppc"),
+            dict(build_message(), topic="org.fedoraproject.prod.buildsys.tag"),
+        ]:
+            self.assertIsNone(harness.parse_build(message["topic"], message["msg"]))
+
+        message = build_message()
+        del message["msg"]["release"]
+        self.assertRaises(ValueError, harness.parse_build, message["topic"], message["msg"])
+        self.assertRaises(ValueError, harness.parse_build, message["topic"], ["kernel"])
+
+    def test_queue(self):
+        """Test that kernels are queued once and coalesced per guest."""
+        guests = ["Fedora40_arm64", "Fedora40_64"]
+        self.assertEqual(self.queue.add("Fedora40_", "kernel-6.8.1-300.fc40", guests), guests)
+        self.assertEqual(self.queue.add("Fedora40_", "kernel-6.8.1-300.fc40", guests), [])
+        job = self.queue.start("Fedora40_64")
+        self.assertEqual(job.kernel, "kernel-6.8.1-300.fc40")
+
+        # The newer build supersedes the one Fedora40_arm64 has not started
+        self.queue.add("Fedora40_", "kernel-6.8.10-300.fc40", guests)
+        self.queue.add("Fedora40_", "kernel-6.8.9-300.fc40", guests)
+        self.assertEqual(self.queue.depth(), 2)
+        self.assertEqual(
+            self.jobs(),
+            [
+                ("kernel-6.8.1-300.fc40", "Fedora40_arm64", "superseded"),
+                ("kernel-6.8.1-300.fc40", "Fedora40_64", "started"),
+                ("kernel-6.8.10-300.fc40", "Fedora40_arm64", "queued"),
+                ("kernel-6.8.10-300.fc40", "Fedora40_64", "queued"),
+            ],
+        )
+
+        # A kernel interrupted by a restart is superseded by the queued one
+        self.queue.requeue("Fedora40_64")
+        self.assertEqual(self.jobs()[1][2], "superseded")
+        self.assertEqual(self.queue.pending(), guests)
+        self.queue.start("Fedora40_64")
+        self.queue.finish("Fedora40_64")
+        self.assertEqual(self.jobs()[3][2], "finished")
+
+    def test_dispatch(self):
+        """Test that the guests test the newest kernel of their release."""
+        harness.run(harness.ReplaySource([build_message("6.8.1")], None), self.dispatcher)
+        deadline = time.monotonic() + 5
+        while len(self.assigned) < 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+        messages = [
+            build_message("6.8.2"),
+            build_message("6.8.3"),
+            build_message("6.9.0", "0.rc1.fc41"),
+            build_message("6.8.3", state=3),
+        ]
+        harness.run(harness.ReplaySource(messages, speed=None), self.dispatcher)
+        self.wait()
+
+        states = {}
+        for kernel, domain, state in self.jobs():
+            states.setdefault(state, set()).add((kernel, domain))
+        # 6.8.1 was started right away, 6.8.2 superseded by 6.8.3
+        self.assertEqual(
+            states["finished"],
+            {
+                ("kernel-6.8.1-300.fc40", "Fedora40_64"),
+                ("kernel-6.8.1-300.fc40", "Fedora40_arm64"),
+                ("kernel-6.8.3-300.fc40", "Fedora40_64"),
+                ("kernel-6.8.3-300.fc40", "Fedora40_arm64"),
+                ("kernel-6.9.0-0.rc1.fc41", "Rawhide64"),
+                ("kernel-6.9.0-0.rc1.fc41", "Rawhidearm64"),
+            },
+        )
+        self.assertEqual(len(states["superseded"]), 2)
+        self.assertEqual(self.assigned.count("kernel-6.8.3-300.fc40"), 2)
+
+    def test_max_running(self):
+        """Test that at most max_running guests run at the same time."""
+        self.dispatcher.close()
+        self.dispatcher = self.make_dispatcher(max_running=1)
+        running = []
+
+        def stopped(domain):
+            running.append(len(self.hypervisor._timers))
+            self.dispatcher.stopped(domain)
+
+        self.hypervisor.on_stopped = stopped
+        messages = [build_message("6.8.1"), build_message("6.8.1", "200.fc39")]
+        harness.run(harness.ReplaySource(messages, speed=None), self.dispatcher)
+        self.wait()
+        self.assertEqual(running, [0, 0, 0, 0])
+        self.assertEqual([state for _, _, state in self.jobs()], ["finished"] * 4)
+
+    def test_resume(self):
+        """Test that the kernels being tested are queued again on restart."""
+        self.queue.add("Fedora40_", "kernel-6.8.1-300.fc40", ["Fedora40_64"])
+        self.queue.start("Fedora40_64")
+
+        self.dispatcher.resume()
+        self.wait()
+        self.assertEqual(self.jobs(), [("kernel-6.8.1-300.fc40", "Fedora40_64", "finished")])
+        self.assertEqual(self.assigned, ["kernel-6.8.1-300.fc40"])
+
+    def test_reconcile(self):
+        """Test that the guests which shut off unnoticed are started again."""
+        self.hypervisor.on_stopped = lambda domain: None
+        self.queue.add("Fedora40_", "kernel-6.8.1-300.fc40", ["Fedora40_64"])
+        self.dispatcher.submit("Fedora40_64")
+        self.dispatcher.watch(interval=0.01)
+        deadline = time.monotonic() + 5
+        while not self.hypervisor.is_running("Fedora40_64"):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+        self.queue.add("Fedora40_", "kernel-6.8.2-300.fc40", ["Fedora40_64"])
+        self.dispatcher.submit("Fedora40_64")
+
+        self.wait()
+        self.assertEqual(
+            self.jobs(),
+            [
+                ("kernel-6.8.1-300.fc40", "Fedora40_64", "finished"),
+                ("kernel-6.8.2-300.fc40", "Fedora40_64", "finished"),
+            ],
+        )
+
+    def test_retry(self):
+        """Test that the guests which could not be started are retried."""
+        self.dispatcher.close()
+        self.dispatcher = self.make_dispatcher(retry_delay=0.01)
+        start = self.hypervisor.start
+        errors = [harness.HypervisorError("Connection reset"), OSError("Timed out")]
+        attempts = []
+
+        def flaky_start(domain):
+            attempts.append(domain)
+            if errors:
+                raise errors.pop()
+            start(domain)
+
+        with patch.object(self.hypervisor, "start", flaky_start):
+            self.queue.add("Fedora40_", "kernel-6.8.1-300.fc40", ["Fedora40_64"])
+            self.dispatcher.submit("Fedora40_64")
+            self.wait()
+        self.assertEqual(self.jobs(), [("kernel-6.8.1-300.fc40", "Fedora40_64", "finished")])
+        self.assertEqual(attempts, ["Fedora40_64"] * 3)
+        self.assertEqual(self.assigned, ["kernel-6.8.1-300.fc40"])
+        self.assertEqual(self.dispatcher.failures, {})
+
+    def test_consume(self):
+        """Test consuming the build state changes from the message bus."""
+        broker = StandInBroker()
+        with patch.object(harness.fm_api, "consume", broker.consume):
+            harness.consume(self.dispatcher)
+
+        def publish(**kwargs):
+            message = build_message(**kwargs)
+            return broker.publish(Message(topic=message["topic"], body=message["msg"]))
+
+        # Messages of other topics are not routed to the harness
+        tag = Message(topic="org.fedoraproject.prod.buildsys.tag", body={"name": "kernel"})
+        self.assertEqual(broker.publish(tag), 0)
+        self.assertEqual(publish(name="bash", version="6.2.1"), 1)
+        self.assertEqual(publish(version="6.8.1", state=0), 1)
+        self.assertEqual(publish(version="6.8.1"), 1)
+        self.wait()
+        self.assertEqual(self.assigned, ["kernel-6.8.1-300.fc40"] * 2)
+
+        # Malformed messages are dropped
+        message = build_message("6.8.2")
+        del message["msg"]["release"]
+        message = Message(topic=message["topic"], body=message["msg"])
+        with self.assertLogs("harness", "ERROR"):
+            self.assertRaises(Drop, broker.publish, message)
+
+        # The broker delivers the message again if it could not be queued
+        with patch.object(self.queue, "add", side_effect=sqlite3.OperationalError("locked")):
+            self.assertRaises(Nack, publish, version="6.8.2")
+
+    def test_assignments(self):
+        """Test serving the kernel assignments to the guests."""
+        server = harness.AssignmentServer(self.queue, ("127.0.0.1", 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/jobs/Fedora40_64"
+
+        def request(path="", method="GET", etag=None):
+            req = urllib.request.Request(url + path, method=method)
+            if etag is not None:
+                req.add_header("If-None-Match", etag)
+            try:
+                with urllib.request.urlopen(req, timeout=5) as response:
+                    body = response.read()
+                    return response.status, response.headers["ETag"], body
+            except urllib.error.HTTPError as err:
+                return err.code, err.headers["ETag"], err.read()
+
+        self.assertEqual(request()[0], 204)
+        self.queue.add("Fedora40_", "kernel-6.8.1-300.fc40", ["Fedora40_64"])
+        self.assertEqual(request("?wait=0.1")[0], 204)
+        job = self.queue.start("Fedora40_64")
+        status, etag, body = request()
+        self.assertEqual((status, etag), (200, f'"{job.id}"'))
+        self.assertEqual(json.loads(body)["kernel"], "kernel-6.8.1-300.fc40")
+        self.assertEqual(request("?wait=0.1", etag=etag)[0], 304)
+
+        # A guest waiting is assigned the next kernel as soon as it starts
+        self.queue.add("Fedora40_", "kernel-6.8.2-300.fc40", ["Fedora40_64"])
+        self.queue.finish("Fedora40_64")
+        timer = threading.Timer(0.1, self.queue.start, ["Fedora40_64"])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        status, etag, body = request("?wait=5", etag=etag)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["kernel"], "kernel-6.8.2-300.fc40")
+
+        # The guests report when they pick up and finish their job
+        job_id = json.loads(body)["id"]
+        self.assertEqual(request(f"/{job_id}/pickup", "POST")[0], 200)
+        self.assertEqual(request(f"/{job_id}/finish", "POST")[0], 200)
+        self.assertEqual(request(f"/{job_id + 1}/finish", "POST")[0], 404)
+        pickedup, completed = self.queue.connection.execute(
+            "SELECT pickedup, completed FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        self.assertLessEqual(pickedup, completed)
+        self.assertEqual(request("/1/reboot", "POST")[0], 404)
+
+    def test_replay(self):
+        """Test replaying recorded messages."""
+        path = os.path.join(self.tmpdir.name, "messages.jsonl")
+        with open(path, "w") as stream:
+            for idx in range(3):
+                message = build_message(f"6.8.{idx}")
+                message["timestamp"] = 1000 + idx
+                stream.write(json.dumps(message) + "\n")
+
+        start = time.monotonic()
+        messages = list(harness.ReplaySource(path, speed=20))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual([body["version"] for _, body in messages], ["6.8.0", "6.8.1", "6.8.2"])
+
+        # Messages recorded by fedora-messaging hold a body instead of a msg
+        message = build_message()
+        message["body"] = message.pop("msg")
+        self.assertEqual(
+            list(harness.ReplaySource([message], None)), [(message["topic"], message["body"])]
+        )
+
+
+if __name__ == "__main__":
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(HarnessTests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -0,0 +1,152 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""
+kerneltest metrics tests.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import kerneltest.dbtools as dbtools
+import kerneltest.metrics as metrics
+from tests import Modeltests
+
+
+class MetricsTests(unittest.TestCase):
+    """Metrics tests."""
+
+    def setUp(self):
+        """Set up the environnment, ran before every tests."""
+        self.registry = list(metrics.REGISTRY)
+        metrics.REGISTRY.clear()
+
+    def tearDown(self):
+        """Restore the metrics of the application."""
+        metrics.REGISTRY[:] = self.registry
+
+    def test_counter(self):
+        """Test the exposition of counters."""
+        counter = metrics.Counter("requests_total", "Requests.", ["endpoint", "status"])
+        counter.inc("index", 200)
+        counter.inc("index", 200)
+        counter.inc('say "hi"', 404, amount=3)
+        self.assertEqual(
+            metrics.exposition(),
+            "# HELP requests_total Requests.\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{endpoint="index",status="200"} 2.0\n'
+            'requests_total{endpoint="say \\"hi\\"",status="404"} 3.0\n',
+        )
+
+    def test_histogram(self):
+        """Test the exposition of histograms."""
+        histogram = metrics.Histogram("queries", "Queries.", buckets=(1, 5))
+        for value in (0, 1, 3, 12):
+            histogram.observe(value)
+        self.assertEqual(
+            metrics.exposition([("pool_size", "Pool size.", "gauge", 5)]),
+            "# HELP queries Queries.\n"
+            "# TYPE queries histogram\n"
+            'queries_bucket{le="1"} 2\n'
+            'queries_bucket{le="5"} 3\n'
+            'queries_bucket{le="+Inf"} 4\n'
+            "queries_sum 16\n"
+            "queries_count 4\n"
+            "# HELP pool_size Pool size.\n"
+            "# TYPE pool_size gauge\n"
+            "pool_size 5\n",
+        )
+
+        histogram.clear()
+        self.assertEqual(
+            metrics.exposition(), "# HELP queries Queries.\n# TYPE queries histogram\n"
+        )
+
+    def test_request_timings(self):
+        """Test the Server-Timing header of the requests."""
+        timings = metrics.RequestTimings()
+        timings.add("db", 0.002)
+        timings.queries = 3
+        timings.add("render", 0.0105)
+        timings.add("db", 0.001)
+        header = timings.server_timing().split(", ")
+        self.assertEqual(header[:2], ['db;dur=3.000;desc="3 queries"', "render;dur=10.500"])
+        self.assertTrue(header[2].startswith("total;dur="))
+
+        # Outside of a request, timed blocks are not recorded anywhere
+        with metrics.timed("save"):
+            pass
+        self.assertIsNone(metrics.current())
+
+
+class QueryBudgetTests(Modeltests):
+    """QueryBudget tests."""
+
+    def setUp(self):
+        """Set up the environnment, ran before every tests."""
+        super().setUp()
+        for releasenum in (19, 20, 21):
+            self.session.add(dbtools.Release(releasenum=releasenum, support="RELEASE"))
+        self.session.commit()
+
+    def load_releases(self):
+        """Load the releases one by one, the way an N+1 pattern does."""
+        for releasenum in (19, 20, 21):
+            self.session.expunge_all()
+            self.session.get(dbtools.Release, releasenum)
+
+    def test_statement_shape(self):
+        """Test the statement_shape function."""
+        self.assertEqual(
+            metrics.statement_shape("SELECT *\n  FROM kerneltest WHERE testid IN (?, ?, ?)"),
+            "SELECT * FROM kerneltest WHERE testid IN (...)",
+        )
+        self.assertEqual(
+            metrics.statement_shape("WHERE fver IN (%(fver_1_1)s, %(fver_1_2)s) AND x = (?)"),
+            "WHERE fver IN (...) AND x = (?)",
+        )
+
+    def test_budget(self):
+        """Test that blocks exceeding their budget are reported."""
+        with metrics.QueryBudget(3, strict=True) as budget:
+            self.load_releases()
+        self.assertEqual(len(budget.statements), 3)
+
+        with self.assertRaises(metrics.QueryBudgetExceeded) as context:
+            with metrics.QueryBudget(2, "releases", strict=True):
+                self.load_releases()
+        report = str(context.exception).splitlines()
+        self.assertEqual(report[0], "releases issued 3 SQL queries, budget is 2")
+        self.assertEqual(len(report), 2)
+        self.assertTrue(report[1].startswith("  likely N+1, issued 3 times: SELECT releases."))
+
+        with self.assertLogs("kerneltest.metrics", "ERROR") as logs:
+            with metrics.QueryBudget(2, "releases"):
+                self.load_releases()
+        self.assertEqual(logs.records[0].getMessage().splitlines()[0], report[0])
+
+    def test_budget_nested(self):
+        """Test nested budgets, the decorator and allow_queries."""
+
+        @metrics.QueryBudget(0, strict=True)
+        def load_releases():
+            metrics.allow_queries(3)
+            self.load_releases()
+
+        with metrics.QueryBudget(4, strict=True) as budget:
+            load_releases()
+            self.session.query(dbtools.Release).all()
+        self.assertEqual(len(budget.statements), 4)
+
+        with self.assertRaises(metrics.QueryBudgetExceeded) as context:
+            metrics.QueryBudget(1, strict=True)(self.load_releases)()
+        self.assertTrue(str(context.exception).startswith("QueryBudgetTests.load_releases issued"))
+
+
+if __name__ == "__main__":
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(MetricsTests)
+    SUITE.addTests(unittest.TestLoader().loadTestsFromTestCase(QueryBudgetTests))
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -0,0 +1,142 @@
+# Licensed under the terms of the GNU GPL License version 2
+
+"""
+kerneltest parser tests.
+"""
+
+import datetime
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pathlib import Path
+
+import kerneltest.parser as parser
+
+HEADER = (
+    b"Date: Thu Apr 24 11:48:35 CDT 2014\n"
+    b"Test set: default\n"
+    b"Kernel: 3.14.1-200.fc20.x86_64\n"
+    b"Release: Fedora release 19 (Schrodingers Cat)\n"
+    b"Result: FAIL\n"
+)
+
+
+class ParserTests(unittest.TestCase):
+    """parser tests."""
+
+    def test_parse_header(self):
+        """Test parsing the header of an uploaded result file."""
+        with (Path(__file__).parent / "1.log").open("rb") as stream:
+            result = parser.parse_header(stream)
+
+        self.assertEqual(
+            result,
+            parser.TestResult(
+                testdate="Thu Apr 24 11:48:35 CDT 2014",
+                testset="default",
+                kver="3.14.1-200.fc20.x86_64",
+                testrel="Fedora release 19 (Schrodingers Cat)",
+                testresult="FAIL",
+                failedtests="./default/paxtest",
+            ),
+        )
+
+    def test_parse_header_stops_early(self):
+        """Test that the parser stops once all the fields are found."""
+        stream = io.BytesIO(HEADER + b"Failed Tests: ./default/paxtest\nKernel: foo\n")
+        result = parser.parse_header(stream)
+        self.assertEqual(result.kver, "3.14.1-200.fc20.x86_64")
+        self.assertEqual(stream.read(), b"Kernel: foo\n")
+
+        stream = io.BytesIO(HEADER + b"=========\nFailed Tests: ./default/paxtest\n")
+        result = parser.parse_header(stream)
+        self.assertEqual(result.testresult, "FAIL")
+        self.assertIsNone(result.failedtests)
+
+    def test_parse_header_budget(self):
+        """Test that the parser reads at most the given number of bytes or lines."""
+        stream = io.BytesIO(HEADER)
+        result = parser.parse_header(stream, max_lines=2)
+        self.assertEqual(result.testset, "default")
+        self.assertIsNone(result.kver)
+
+        # The line truncated by the budget is ignored
+        stream = io.BytesIO(HEADER)
+        result = parser.parse_header(stream, max_bytes=len(HEADER) - 3)
+        self.assertEqual(result.testrel, "Fedora release 19 (Schrodingers Cat)")
+        self.assertIsNone(result.testresult)
+
+        stream = io.BytesIO(b"x" * 100000)
+        result = parser.parse_header(stream, max_bytes=100)
+        self.assertEqual(result, parser.TestResult(None, None, None, None, None, None))
+        self.assertEqual(stream.tell(), 100)
+
+    def test_parse_header_prefix(self):
+        """Test that the fields are only recognized at the start of the lines."""
+        stream = io.BytesIO(b"Boot Kernel: foo\r\nKernel: bar\r\n")
+        result = parser.parse_header(stream)
+        self.assertEqual(result.kver, "bar")
+
+    def test_parse_header_invalid(self):
+        """Test parsing a result file which is not valid UTF-8."""
+        stream = io.BytesIO(b"Kernel: \xff\xfe\n")
+        self.assertRaises(UnicodeDecodeError, parser.parse_header, stream)
+
+    def test_parse_kver(self):
+        """Test the parse_kver function."""
+        self.assertEqual(
+            parser.parse_kver("3.14.1-200.fc20.x86_64"),
+            parser.KernelVersion(3, 14, 1, "200", "fc20", 20, "x86_64"),
+        )
+        self.assertEqual(
+            parser.parse_kver("6.8.0-0.rc3.20240209git841c3516.30.fc40.aarch64"),
+            parser.KernelVersion(6, 8, 0, "0.rc3.20240209git841c3516.30", "fc40", 40, "aarch64"),
+        )
+        self.assertEqual(
+            parser.parse_kver("3.9.5-301.fc19.i686.PAE"),
+            parser.KernelVersion(3, 9, 5, "301", "fc19", 19, "i686+PAE"),
+        )
+        self.assertEqual(
+            parser.parse_kver("4.0-1.fc22.x86_64"),
+            parser.KernelVersion(4, 0, 0, "1", "fc22", 22, "x86_64"),
+        )
+        self.assertRaises(ValueError, parser.parse_kver, "3.14.1")
+        self.assertRaises(ValueError, parser.parse_kver, "3.14.1-200.el7.x86_64")
+
+    def test_kver_key(self):
+        """Test that kver_key sorts kernel versions in version order."""
+        kernels = [
+            "6.10.0-300.fc40.x86_64",
+            "6.9.12-200.fc40.x86_64",
+            "6.9.2-200.fc40.x86_64",
+            "6.9.0-300.fc40.x86_64",
+            "6.9.0-0.rc10.fc40.x86_64",
+            "6.9.0-0.rc3.fc40.x86_64",
+        ]
+        self.assertEqual(sorted(kernels, key=parser.kver_key, reverse=True), kernels)
+        self.assertEqual(sorted(kernels, reverse=True)[0], "6.9.2-200.fc40.x86_64")
+
+    def test_parse_testdate(self):
+        """Test the parse_testdate function."""
+        expected = datetime.datetime(2014, 4, 24, 16, 48, 35)
+        self.assertEqual(parser.parse_testdate("Thu Apr 24 11:48:35 CDT 2014"), expected)
+        self.assertEqual(parser.parse_testdate("Thu Apr 24 18:48:35 CEST 2014"), expected)
+        self.assertEqual(parser.parse_testdate("Thu Apr 24 16:48:35 UTC 2014"), expected)
+        self.assertEqual(parser.parse_testdate("Thu, 24 Apr 2014 11:48:35 -0500"), expected)
+        self.assertEqual(parser.parse_testdate("2014-04-24T18:48:35+02:00"), expected)
+        self.assertEqual(parser.parse_testdate("2014-04-24 16:48:35"), expected)
+        self.assertEqual(
+            parser.parse_testdate("Thu Apr  3 11:48:35 CDT 2014"),
+            datetime.datetime(2014, 4, 3, 16, 48, 35),
+        )
+        self.assertIsNone(parser.parse_testdate("yesterday"))
+        self.assertIsNone(parser.parse_testdate(None))
+
+
+if __name__ == "__main__":
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(ParserTests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)